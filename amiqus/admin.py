@@ -170,9 +170,10 @@ class EventAdmin(RawMixin, UserMixin, admin.ModelAdmin):
         "_user",
         "action",
         "status",
+        "state",
         "completed_at",
     )
-    list_filter = ("action", "resource_type", "status", "completed_at")
+    list_filter = ("action", "resource_type", "status", "state", "completed_at")
     readonly_fields = (
         "amiqus_id",
         "resource_type",
@@ -180,6 +181,11 @@ class EventAdmin(RawMixin, UserMixin, admin.ModelAdmin):
         "status",
         "completed_at",
         "received_at",
+        "state",
+        "attempts",
+        "last_error",
+        "next_attempt_at",
+        "processed_at",
         "_raw",
     )
     search_fields = ("amiqus_id",)
@@ -0,0 +1,317 @@
+"""
+Async wire operations with the API, and async versions of the helpers.
+
+This mirrors amiqus.api and amiqus.helpers using httpx, so that views
+running under ASGI can have many API calls in flight at once without
+tying up a thread for each. It requires the optional httpx dependency:
+
+    $ pip install django-amiqus[async]
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import weakref
+from datetime import datetime
+from typing import Any, Callable, Literal, Union, cast
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import api, codec
+from .api import (
+    ConditionalResponse,
+    _RequestStats,
+    _cached_conditional,
+    _conditional_headers,
+    _conditional_respond,
+    _headers,
+    _respond,
+    _timeout,
+    _url,
+)
+from .helpers import (
+    _client_data,
+    _expired_at_data,
+    _record_data,
+    _reviews_href,
+    _save_reviews,
+)
+from .models import Client, Event, Record, Step
+from .settings import (
+    ASYNC_MAX_CONNECTIONS,
+    DEFAULT_REQUESTS_TIMEOUT,
+    POOL_MAXSIZE,
+    REVIEW_FETCH_CONCURRENCY,
+)
+from .signals import record_reviewed
+
+logger = logging.getLogger(__name__)
+
+# httpx clients are bound to the event loop on which they were created
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the pooled async client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAXSIZE,
+            ),
+            timeout=DEFAULT_REQUESTS_TIMEOUT,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_client() -> None:
+    """Close the async client for the running event loop."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _call(func: Callable[[], Any], shared: bool) -> Any:
+    """Call a sync function - in a thread if it uses a shared cache."""
+    if shared:
+        return await sync_to_async(func, thread_sensitive=False)()
+    return func()
+
+
+async def _send(
+    method: str,
+    url: str,
+    started: float,
+    headers: dict[str, str] | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """Make a single request, subject to the circuit breaker and rate limit."""
+    if (breaker := api.CIRCUIT_BREAKER) is not None:
+        await _call(breaker.before_request, True)
+    if (limiter := api.RATE_LIMITER) is not None:
+        delay = await _call(limiter.reserve, limiter.cache_alias is not None)
+        limiter.record_wait(delay)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    timeout = _timeout(time.monotonic() - started)
+    try:
+        response = await get_client().request(
+            method,
+            url,
+            headers={**_headers(), **headers} if headers else _headers(),
+            timeout=timeout,
+            **kwargs,
+        )
+    except httpx.TransportError:
+        if breaker is not None:
+            await _call(breaker.record_failure, True)
+        raise
+    if breaker is not None:
+        if breaker.is_failure(response.status_code):
+            await _call(breaker.record_failure, True)
+        else:
+            await _call(breaker.record_success, True)
+    return response
+
+
+async def _retry(
+    stats: _RequestStats, method: str, href: str, **kwargs: Any
+) -> httpx.Response:
+    """Make an async request, retrying it according to api.RETRY_POLICY."""
+    url = _url(href)
+    while True:
+        attempt = stats.attempt()
+        try:
+            response = stats.response = await _send(
+                method, url, stats.started, **kwargs
+            )
+        except httpx.TransportError:
+            delay = api.RETRY_POLICY.next_delay(method, attempt, stats.elapsed)
+            if delay is None:
+                raise
+            logger.warning("Amiqus API %s request failed: %s", method, href)
+        else:
+            delay = api.RETRY_POLICY.next_delay(
+                method, attempt, stats.elapsed, response
+            )
+            if delay is None:
+                return response
+            logger.warning(
+                "Amiqus API %s request returned %s: %s",
+                method,
+                response.status_code,
+                href,
+            )
+        logger.debug("Retrying Amiqus API request in %.2fs", delay)
+        await asyncio.sleep(delay)
+
+
+async def _request(method: str, href: str, **kwargs: Any) -> httpx.Response:
+    """Make an async request, recording its stats."""
+    stats = _RequestStats("amiqus.aio", method, href)
+    try:
+        response = await _retry(stats, method, href, **kwargs)
+    except Exception as ex:  # noqa: B902
+        stats.finish(ex)
+        raise
+    stats.finish()
+    return response
+
+
+async def _cached(href: str) -> ConditionalResponse | None:
+    """Return the cached response for an href, if there is one."""
+    if (backend := api.RESPONSE_CACHE_BACKEND) is None:
+        return None
+    if (cached := await backend.aget(href)) is None:
+        return None
+    return ConditionalResponse(*cached)
+
+
+async def _cache(href: str, response: ConditionalResponse) -> None:
+    """Cache the response for an href."""
+    backend = api.RESPONSE_CACHE_BACKEND
+    if backend is not None and response.data is not None:
+        await backend.aset(href, tuple(response))
+
+
+async def invalidate(href: str) -> None:
+    """Remove any cached response for an href - e.g. because it has changed."""
+    if (backend := api.RESPONSE_CACHE_BACKEND) is not None:
+        await backend.ainvalidate(href)
+
+
+async def _get(
+    href: str, etag: str = "", last_modified: str = ""
+) -> ConditionalResponse:
+    """Make a (conditional) GET request, from the cache if possible."""
+    if (cached := await _cached(href)) is not None:
+        return _cached_conditional(cached, etag, last_modified)
+
+    async def request() -> ConditionalResponse:
+        headers = _conditional_headers(etag, last_modified)
+        response = _conditional_respond(
+            await _request("GET", href, headers=headers), etag, last_modified
+        )
+        await _cache(href, response)
+        return response
+
+    if (group := api.SINGLE_FLIGHT_GROUP) is None:
+        return await request()
+    return await group.ado(f"{href}:{etag}:{last_modified}", request)
+
+
+async def get(href: str) -> dict:
+    """Make an async GET request and return the response as JSON."""
+    logger.debug("Amiqus API GET request: %s", href)
+    # an unconditional response always has data
+    return cast(dict, (await _get(href)).data)
+
+
+async def get_conditional(
+    href: str, *, etag: str = "", last_modified: str = ""
+) -> ConditionalResponse:
+    """Make an async conditional GET request - see api.get_conditional."""
+    logger.debug("Amiqus API conditional GET request: %s", href)
+    return await _get(href, etag, last_modified)
+
+
+async def post(href: str, *, data: dict) -> dict:
+    """Make an async POST request and return the response as JSON."""
+    logger.debug("Amiqus API POST request: %s", href)
+    try:
+        return _respond(await _request("POST", href, content=codec.dumps(data)))
+    finally:
+        await invalidate(href)
+
+
+async def patch(href: str, *, data: dict) -> dict:
+    """Make an async PATCH request and return the response as JSON."""
+    logger.debug("Amiqus API PATCH request: %s", href)
+    try:
+        return _respond(await _request("PATCH", href, content=codec.dumps(data)))
+    finally:
+        await invalidate(href)
+
+
+async def create_client(user: settings.AUTH_USER_MODEL, **kwargs: Any) -> Client:
+    """Async version of amiqus.helpers.create_client."""
+    response = await post("clients", data=_client_data(user, **kwargs))
+    return await sync_to_async(Client.objects.create_client)(user, response)
+
+
+async def create_record(
+    client: Client,
+    steps: list[dict[str, Any]],
+    notification: Union[Literal["email"], Literal[False]] = "email",
+    reminder: bool = True,
+) -> Record:
+    """Async version of amiqus.helpers.create_record."""
+    data = _record_data(client, steps, notification, reminder)
+    response = await post("records", data=data)
+    return await sync_to_async(Record.objects.create_record)(
+        client=client, raw=response
+    )
+
+
+async def create_or_update_reviews(event: Event, record: Record | None = None) -> None:
+    """
+    Async version of amiqus.helpers.create_or_update_reviews.
+
+    The reviews for each step are fetched concurrently.
+
+    """
+    record_id = event.raw["data"]["record"]["id"]
+    if record is None:
+        record = await Record.objects.aget(amiqus_id=record_id)
+    steps = [step async for step in record.steps.all()]
+    semaphore = asyncio.Semaphore(max(REVIEW_FETCH_CONCURRENCY, 1))
+
+    async def fetch(step: Step) -> tuple[Step, list[dict]]:
+        async with semaphore:
+            return step, (await get(_reviews_href(record_id, step)))["data"]
+
+    step_reviews = await asyncio.gather(*[fetch(step) for step in steps])
+    await sync_to_async(_save_reviews)(step_reviews)
+
+
+async def update_client_status(
+    client: Client, client_status: Client.ClientStatus
+) -> None:
+    """Async version of amiqus.helpers.update_client_status."""
+    response = await patch(
+        f"clients/{client.amiqus_id}", data={"status": client_status.value}
+    )
+    await client.parse(response).asave()
+
+
+async def update_record_expired_at_date(record: Record, expired_at: datetime) -> None:
+    """Async version of amiqus.helpers.update_record_expired_at_date."""
+    response = await patch(
+        f"records/{record.amiqus_id}", data=_expired_at_data(expired_at)
+    )
+    await record.parse(response).asave()
+
+
+async def process_event(event: Event) -> Record | Client:
+    """Async version of amiqus.views.process_event."""
+    resource = await event.aresource()
+    await resource.aupdate_status(event)
+
+    # Send signal for record.reviewed events
+    if event.action == "record.reviewed" and not resource.stale:
+        logger.debug("Sending record_reviewed signal for record %s", resource.id)
+        await create_or_update_reviews(event, record=resource)
+        await record_reviewed.asend(
+            sender=resource.__class__, record=resource, event=event, data=event.raw
+        )
+    return resource
@@ -1,24 +1,73 @@
 """
 Basic wire operations with the API - GET/POST/PUT.
 
-This is a simple wrapper around requests.
+This is a simple wrapper around requests. All requests are made through
+a pooled session so that keep-alive connections to the API are reused
+rather than paying for a new TCP/TLS handshake on every call.
+
+Idempotent requests (GET/PATCH) that fail with a transient error are
+retried according to RETRY_POLICY, all requests are throttled by
+RATE_LIMITER if a client-side rate limit is configured, and requests fail
+fast with CircuitOpenError while CIRCUIT_BREAKER is open. GET responses
+are cached in RESPONSE_CACHE if it is configured, and concurrent identical
+GET requests are coalesced into one by SINGLE_FLIGHT_GROUP. The
+api_request_started / api_request_finished signals are sent for every
+request, and slow requests are logged.
 
 """
 
 from __future__ import annotations
 
 import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, NamedTuple, cast
 from urllib import parse as urlparse
 
 import requests
 from django.http import HttpResponse
+from requests.adapters import HTTPAdapter
 
-from .settings import API_KEY, DEFAULT_REQUESTS_TIMEOUT
+from . import codec, metrics
+from .circuitbreaker import CircuitBreaker
+from .settings import (
+    API_KEY,
+    API_ROOT,
+    CIRCUIT_BREAKER_CACHE,
+    CIRCUIT_BREAKER_RESET_TIMEOUT,
+    CIRCUIT_BREAKER_THRESHOLD,
+    DEFAULT_REQUESTS_TIMEOUT,
+    POOL_CONNECTIONS,
+    POOL_MAXSIZE,
+    RATE_LIMIT,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_CACHE,
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_TTLS,
+    RETRY_BACKOFF,
+    RETRY_BACKOFF_MAX,
+    RETRY_DEADLINE,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_STATUS_CODES,
+    SINGLE_FLIGHT,
+    SINGLE_FLIGHT_CACHE,
+    SINGLE_FLIGHT_TIMEOUT,
+    SLOW_REQUEST_THRESHOLD,
+)
+from .signals import api_request_finished, api_request_started
+from .ratelimit import RateLimiter
+from .responsecache import ResponseCache
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
-# the API HTTP root url
-API_ROOT = "https://id.amiqus.co/api/v2/"
+# the connection pool is shared by all threads, sessions are per-thread
+_adapter: HTTPAdapter | None = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
 
 
 class ApiError(Exception):
@@ -26,13 +75,249 @@ class ApiError(Exception):
 
     def __init__(self, response: HttpResponse) -> None:
         """Initialise error from response object."""
-        data = response.json()
+        try:
+            data = codec.loads(response.content)
+        except ValueError:
+            # e.g. an HTML error page from a proxy in front of the API
+            data = {"error": response.text}
         logger.debug("Amiqus API error: %s", data)
         super().__init__(data["error"])
         self.status_code = response.status_code
         self.error_type = data["error"]
 
 
+class RetryPolicy:
+    """
+    Retry policy for idempotent API requests.
+
+    Requests that fail with a connection error, a timeout or one of the
+    retryable status codes are retried with "full jitter" exponential
+    backoff - unless the API returns a Retry-After header, in which case
+    we wait for as long as we are told to. A retry is never scheduled if
+    it would start after the deadline (in seconds from the first attempt).
+
+    """
+
+    methods = ("GET", "PATCH")
+
+    def __init__(
+        self,
+        *,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        backoff: float = RETRY_BACKOFF,
+        backoff_max: float = RETRY_BACKOFF_MAX,
+        deadline: float = RETRY_DEADLINE,
+        status_codes: tuple[int, ...] = RETRY_STATUS_CODES,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.status_codes = tuple(status_codes)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Return a random delay of up to backoff * 2^(attempt - 1) seconds."""
+        return random.uniform(  # noqa: S311
+            0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1))
+        )
+
+    def next_delay(
+        self, method: str, attempt: int, elapsed: float, response: Any = None
+    ) -> float | None:
+        """
+        Return the number of seconds to wait before retrying a request.
+
+        Args:
+            method: the HTTP method of the request.
+            attempt: the number of attempts made so far.
+            elapsed: the number of seconds since the first attempt.
+            response: the failed response, or None if there was no response
+                (connection error or timeout).
+
+        Returns None if the request should not be retried.
+
+        """
+        if method not in self.methods or attempt >= self.max_attempts:
+            return None
+        if response is not None and response.status_code not in self.status_codes:
+            return None
+        delay = _retry_after(response)
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+        if elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+
+# the policy used for all requests - patch this to change it at runtime
+RETRY_POLICY = RetryPolicy()
+
+# the rate limiter used for all requests - None if there is no limit
+RATE_LIMITER = (
+    RateLimiter(RATE_LIMIT, RATE_LIMIT_BURST, cache_alias=RATE_LIMIT_CACHE)
+    if RATE_LIMIT
+    else None
+)
+
+# the circuit breaker used for all requests - None if it is disabled
+CIRCUIT_BREAKER = (
+    CircuitBreaker(
+        CIRCUIT_BREAKER_THRESHOLD,
+        CIRCUIT_BREAKER_RESET_TIMEOUT,
+        cache_alias=CIRCUIT_BREAKER_CACHE,
+    )
+    if CIRCUIT_BREAKER_THRESHOLD
+    else None
+)
+
+# the cache used for GET responses - None if it is disabled
+RESPONSE_CACHE_BACKEND = (
+    ResponseCache(RESPONSE_CACHE_TTLS, cache_alias=RESPONSE_CACHE)
+    if RESPONSE_CACHE_TTLS
+    else None
+)
+
+# used to coalesce concurrent GET requests - None if it is disabled
+SINGLE_FLIGHT_GROUP = (
+    SingleFlight(cache_alias=SINGLE_FLIGHT_CACHE, timeout=SINGLE_FLIGHT_TIMEOUT)
+    if SINGLE_FLIGHT
+    else None
+)
+
+
+def _retry_after(response: Any) -> float | None:
+    """Return the Retry-After header value in seconds, if there is one."""
+    if response is None or not (value := response.headers.get("Retry-After")):
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class ConditionalResponse(NamedTuple):
+    """Response to a conditional GET request - data is None if not modified."""
+
+    data: dict | None
+    etag: str
+    last_modified: str
+
+
+def path_template(href: str) -> str:
+    """Return an href with the ids replaced - e.g. "records/{id}"."""
+    parts = href.strip("/").split("/")
+    parts[1::2] = ["{id}"] * len(parts[1::2])
+    return "/".join(parts)
+
+
+class _RequestStats:
+    """Records the stats for a request, and sends the api_request signals."""
+
+    def __init__(self, sender: str, method: str, href: str) -> None:
+        self.sender = sender
+        self.method = method
+        self.path = path_template(href)
+        self.started = time.monotonic()
+        self.attempts = 0
+        self.response: Any = None
+        api_request_started.send(sender, method=method, path=self.path)
+
+    @property
+    def elapsed(self) -> float:
+        """Return the number of seconds since the request started."""
+        return time.monotonic() - self.started
+
+    def attempt(self) -> int:
+        """Record a new attempt at the request, and return the attempt number."""
+        self.attempts += 1
+        self.response = None
+        return self.attempts
+
+    def finish(self, exception: BaseException | None = None) -> None:
+        """Send the api_request_finished signal, and log slow requests."""
+        duration = self.elapsed
+        retries = max(self.attempts - 1, 0)
+        status = None if self.response is None else self.response.status_code
+        size = 0 if self.response is None else len(self.response.content)
+        metrics.incr("api.requests")
+        metrics.incr("api.retries", retries)
+        metrics.incr("api.seconds", duration)
+        if duration >= SLOW_REQUEST_THRESHOLD:
+            metrics.incr("api.slow_requests")
+            logger.warning(
+                "Slow Amiqus API request: %s %s took %.2fs (status=%s, retries=%s)",
+                self.method,
+                self.path,
+                duration,
+                status,
+                retries,
+            )
+        api_request_finished.send(
+            self.sender,
+            method=self.method,
+            path=self.path,
+            status=status,
+            duration=duration,
+            size=size,
+            retries=retries,
+            exception=exception,
+        )
+
+
+def _get_adapter() -> HTTPAdapter:
+    """Return the shared connection pool, creating it if required."""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(
+                pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE
+            )
+        return _adapter
+
+
+def get_session() -> requests.Session:
+    """
+    Return the pooled session for the current thread.
+
+    A requests.Session is not safe to share between threads, so each thread
+    gets its own - but they all mount the same HTTPAdapter, which means that
+    keep-alive connections to the API are pooled across threads.
+
+    """
+    adapter = _get_adapter()
+    session = getattr(_local, "session", None)
+    if session is None or getattr(_local, "adapter", None) is not adapter:
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+        _local.adapter = adapter
+    return session
+
+
+def close_session() -> None:
+    """Close all pooled connections - a new pool is created on next use."""
+    global _adapter
+    with _adapter_lock:
+        if _adapter is not None:
+            _adapter.close()
+        _adapter = None
+
+
+def warm_up() -> None:
+    """Open a pooled keep-alive connection to the API ahead of first use."""
+    logger.debug("Warming up Amiqus API connection: %s", API_ROOT)
+    try:
+        get_session().head(API_ROOT, timeout=DEFAULT_REQUESTS_TIMEOUT)
+    except requests.RequestException:
+        logger.warning("Unable to warm up Amiqus API connection.", exc_info=True)
+
+
 def _url(path: str) -> str:
     """Format absolute API URL."""
     return urlparse.urljoin(API_ROOT, path)
@@ -46,44 +331,202 @@ def _headers(api_key: str = API_KEY) -> dict[str, str]:
     }
 
 
+def _conditional_headers(etag: str, last_modified: str) -> dict[str, str]:
+    """Format the validator headers for a conditional request."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def _conditional_respond(
+    response: HttpResponse, etag: str, last_modified: str
+) -> ConditionalResponse:
+    """Process the response to a conditional request."""
+    if response.status_code == 304:
+        logger.debug("Amiqus API response: not modified")
+        return ConditionalResponse(None, etag, last_modified)
+    return ConditionalResponse(
+        _respond(response),
+        response.headers.get("ETag", ""),
+        response.headers.get("Last-Modified", ""),
+    )
+
+
 def _respond(response: HttpResponse) -> dict:
     """Process common response object."""
     if not str(response.status_code).startswith("2"):
         raise ApiError(response)
-    data = response.json()
+    data = codec.loads(response.content)
     logger.debug("Amiqus API response: %s", data)
     return data
 
 
+def _timeout(elapsed: float) -> float:
+    """Return the request timeout, limited by the retry deadline."""
+    return min(DEFAULT_REQUESTS_TIMEOUT, max(RETRY_POLICY.deadline - elapsed, 0.1))
+
+
+def _send(
+    method: str,
+    url: str,
+    started: float,
+    headers: dict[str, str] | None = None,
+    **kwargs: Any,
+) -> requests.Response:
+    """Make a single request, subject to the circuit breaker and rate limit."""
+    if CIRCUIT_BREAKER is not None:
+        CIRCUIT_BREAKER.before_request()
+    if RATE_LIMITER is not None:
+        RATE_LIMITER.acquire()
+    timeout = _timeout(time.monotonic() - started)
+    try:
+        response = get_session().request(
+            method,
+            url,
+            headers={**_headers(), **headers} if headers else _headers(),
+            timeout=timeout,
+            **kwargs,
+        )
+    except (requests.ConnectionError, requests.Timeout):
+        if CIRCUIT_BREAKER is not None:
+            CIRCUIT_BREAKER.record_failure()
+        raise
+    if CIRCUIT_BREAKER is not None:
+        if CIRCUIT_BREAKER.is_failure(response.status_code):
+            CIRCUIT_BREAKER.record_failure()
+        else:
+            CIRCUIT_BREAKER.record_success()
+    return response
+
+
+def _retry(
+    stats: _RequestStats, method: str, href: str, **kwargs: Any
+) -> requests.Response:
+    """Make a request, retrying it according to RETRY_POLICY."""
+    url = _url(href)
+    while True:
+        attempt = stats.attempt()
+        try:
+            response = stats.response = _send(method, url, stats.started, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            delay = RETRY_POLICY.next_delay(method, attempt, stats.elapsed)
+            if delay is None:
+                raise
+            logger.warning("Amiqus API %s request failed: %s", method, href)
+        else:
+            delay = RETRY_POLICY.next_delay(method, attempt, stats.elapsed, response)
+            if delay is None:
+                return response
+            logger.warning(
+                "Amiqus API %s request returned %s: %s",
+                method,
+                response.status_code,
+                href,
+            )
+        logger.debug("Retrying Amiqus API request in %.2fs", delay)
+        time.sleep(delay)
+
+
+def _request(method: str, href: str, **kwargs: Any) -> requests.Response:
+    """Make a request, recording its stats."""
+    stats = _RequestStats("amiqus.api", method, href)
+    try:
+        response = _retry(stats, method, href, **kwargs)
+    except Exception as ex:  # noqa: B902
+        stats.finish(ex)
+        raise
+    stats.finish()
+    return response
+
+
+def _cached(href: str) -> ConditionalResponse | None:
+    """Return the cached response for an href, if there is one."""
+    if RESPONSE_CACHE_BACKEND is None:
+        return None
+    if (cached := RESPONSE_CACHE_BACKEND.get(href)) is None:
+        return None
+    return ConditionalResponse(*cached)
+
+
+def _cache(href: str, response: ConditionalResponse) -> None:
+    """Cache the response for an href."""
+    if RESPONSE_CACHE_BACKEND is not None and response.data is not None:
+        RESPONSE_CACHE_BACKEND.set(href, tuple(response))
+
+
+def _cached_conditional(
+    cached: ConditionalResponse, etag: str, last_modified: str
+) -> ConditionalResponse:
+    """Return a cached response to a conditional request."""
+    if (etag and etag == cached.etag) or (
+        last_modified and last_modified == cached.last_modified
+    ):
+        return ConditionalResponse(None, etag, last_modified)
+    return cached
+
+
+def invalidate(href: str) -> None:
+    """Remove any cached response for an href - e.g. because it has changed."""
+    if RESPONSE_CACHE_BACKEND is not None:
+        RESPONSE_CACHE_BACKEND.invalidate(href)
+
+
+def _get(href: str, etag: str = "", last_modified: str = "") -> ConditionalResponse:
+    """Make a (conditional) GET request, from the cache if possible."""
+    if (cached := _cached(href)) is not None:
+        return _cached_conditional(cached, etag, last_modified)
+
+    def request() -> ConditionalResponse:
+        headers = _conditional_headers(etag, last_modified)
+        response = _conditional_respond(
+            _request("GET", href, headers=headers), etag, last_modified
+        )
+        _cache(href, response)
+        return response
+
+    if SINGLE_FLIGHT_GROUP is None:
+        return request()
+    return SINGLE_FLIGHT_GROUP.do(f"{href}:{etag}:{last_modified}", request)
+
+
 def get(href: str) -> dict:
     """Make a GET request and return the response as JSON."""
     logger.debug("Amiqus API GET request: %s", href)
-    return _respond(
-        requests.get(_url(href), headers=_headers(), timeout=DEFAULT_REQUESTS_TIMEOUT)
-    )
+    # an unconditional response always has data
+    return cast(dict, _get(href).data)
+
+
+def get_conditional(
+    href: str, *, etag: str = "", last_modified: str = ""
+) -> ConditionalResponse:
+    """
+    Make a conditional GET request.
+
+    If the ETag / Last-Modified validators from a previous response are
+    passed in, the API will return a 304 if the resource has not changed
+    since, in which case the returned data is None.
+
+    """
+    logger.debug("Amiqus API conditional GET request: %s", href)
+    return _get(href, etag, last_modified)
 
 
 def post(href: str, *, data: dict) -> dict:
     """Make a POST request and return the response as JSON."""
     logger.debug("Amiqus API POST request: %s", href)
-    return _respond(
-        requests.post(
-            _url(href),
-            headers=_headers(),
-            json=data,
-            timeout=DEFAULT_REQUESTS_TIMEOUT,
-        )
-    )
+    try:
+        return _respond(_request("POST", href, data=codec.dumps(data)))
+    finally:
+        invalidate(href)
 
 
 def patch(href: str, *, data: dict) -> dict:
     """Make a PATCH request and return the response as JSON."""
     logger.debug("Amiqus API PATCH request: %s", href)
-    return _respond(
-        requests.patch(
-            _url(href),
-            headers=_headers(),
-            json=data,
-            timeout=DEFAULT_REQUESTS_TIMEOUT,
-        )
-    )
+    try:
+        return _respond(_request("PATCH", href, data=codec.dumps(data)))
+    finally:
+        invalidate(href)
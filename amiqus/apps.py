@@ -7,3 +7,11 @@ class AmiqusAppConfig(AppConfig):
     name = "amiqus"
     verbose_name = "Amiqus"
     default_auto_field = "django.db.models.AutoField"
+
+    def ready(self) -> None:
+        """Optionally open a pooled connection to the API."""
+        from .api import warm_up
+        from .settings import WARM_UP_SESSION
+
+        if WARM_UP_SESSION:
+            warm_up()
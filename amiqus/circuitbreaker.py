@@ -0,0 +1,115 @@
+"""
+Circuit breaker for outgoing API requests.
+
+When the Amiqus API is down, every request waits for its full timeout
+before failing. The circuit breaker stops making requests once the API
+has failed repeatedly, so that callers fail fast (and fall back to local
+state) until it has recovered.
+
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Error raised when a request is not made because the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with state shared through a Django cache.
+
+    The circuit opens after `failure_threshold` consecutive failures
+    (connection errors, timeouts and 5xx responses). While it is open all
+    requests fail immediately with CircuitOpenError. After `reset_timeout`
+    seconds it is half-open: a single probe request is let through, and
+    if that succeeds the circuit closes again, otherwise it re-opens.
+
+    The state is stored in the Django cache `cache_alias`, so all processes
+    that share the cache trip (and recover) together.
+
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        *,
+        cache_alias: str = "default",
+        key: str = "amiqus:circuit",
+    ) -> None:
+        if failure_threshold <= 0:
+            raise ValueError("Failure threshold must be greater than zero.")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache_alias = cache_alias
+        self.key = key
+
+    @property
+    def _cache(self) -> BaseCache:
+        return caches[self.cache_alias]
+
+    @property
+    def state(self) -> str:
+        """Return the current state - 'closed', 'open' or 'half-open'."""
+        opened_at = self._cache.get(f"{self.key}:opened_at")
+        if opened_at is None:
+            return "closed"
+        if time.time() - opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    @staticmethod
+    def is_failure(status_code: int) -> bool:
+        """Return True if a response status code counts as a failure."""
+        return status_code >= 500
+
+    def before_request(self) -> None:
+        """Raise CircuitOpenError if a request should not be made."""
+        state = self.state
+        if state == "closed":
+            return
+        # only one probe request is allowed through when half-open
+        probe_key = f"{self.key}:probe"
+        if state == "half-open" and self._cache.add(
+            probe_key, 1, timeout=self.reset_timeout
+        ):
+            logger.info("Amiqus API circuit half-open, sending probe request.")
+            return
+        metrics.incr("circuitbreaker.rejected")
+        raise CircuitOpenError("Amiqus API circuit breaker is open.")
+
+    def record_success(self) -> None:
+        """Record a successful request - this closes the circuit."""
+        if self._cache.get(f"{self.key}:failures"):
+            if self.state != "closed":
+                logger.info("Amiqus API circuit closed.")
+            self._cache.delete_many(
+                [f"{self.key}:failures", f"{self.key}:opened_at", f"{self.key}:probe"]
+            )
+
+    def record_failure(self) -> None:
+        """Record a failed request, opening the circuit if required."""
+        failures_key = f"{self.key}:failures"
+        self._cache.add(failures_key, 0, timeout=None)
+        failures = self._cache.incr(failures_key)
+        if failures >= self.failure_threshold:
+            if self.state == "closed":
+                logger.warning(
+                    "Amiqus API circuit opened after %s consecutive failures.",
+                    failures,
+                )
+                metrics.incr("circuitbreaker.opened")
+            # (re-)open the circuit - this also ends a failed half-open probe
+            self._cache.set(f"{self.key}:opened_at", time.time(), timeout=None)
+            self._cache.delete(f"{self.key}:probe")
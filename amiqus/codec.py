@@ -0,0 +1,77 @@
+"""
+JSON encoding / decoding.
+
+Webhook bodies and API requests / responses are (de)serialised using the
+codec set by AMIQUS_JSON_CODEC. orjson is considerably faster than the
+stdlib json module on large payloads, and is used by default if it is
+installed (pip install django-amiqus[orjson]).
+
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+from .settings import JSON_CODEC
+
+
+class JsonCodec:
+    """JSON codec using the stdlib json module."""
+
+    name = "json"
+
+    def loads(self, data: bytes | str) -> Any:
+        """Deserialise a JSON document."""
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        """Serialise an object as a compact JSON document."""
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
+class OrjsonCodec(JsonCodec):
+    """JSON codec using orjson."""
+
+    name = "orjson"
+
+    def loads(self, data: bytes | str) -> Any:
+        """Deserialise a JSON document."""
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        """Serialise an object as a compact JSON document."""
+        return orjson.dumps(obj)
+
+
+CODECS: dict[str, type[JsonCodec]] = {"json": JsonCodec, "orjson": OrjsonCodec}
+
+
+def get_codec(name: str | None = None) -> JsonCodec:
+    """Return the named codec, or the fastest one available."""
+    if name is None:
+        name = "json" if orjson is None else "orjson"
+    if name == "orjson" and orjson is None:
+        raise ImportError("AMIQUS_JSON_CODEC is 'orjson', but it is not installed.")
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown AMIQUS_JSON_CODEC: {name}")
+
+
+CODEC = get_codec(JSON_CODEC)
+
+
+def loads(data: bytes | str) -> Any:
+    """Deserialise a JSON document using CODEC."""
+    return CODEC.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialise an object as JSON using CODEC."""
+    return CODEC.dumps(obj)
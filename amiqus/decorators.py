@@ -7,6 +7,7 @@ from base64 import b64decode
 from functools import wraps
 from typing import Any, Callable
 
+from asgiref.sync import iscoroutinefunction
 from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
 
@@ -47,6 +48,22 @@ def _match(token: bytes, request: HttpRequest) -> bool:
     return hmac.compare_digest(received_signature, expected_signature)
 
 
+def _verify(request: HttpRequest) -> HttpResponse | None:
+    """Verify the request signature, and return a 403 response if it fails."""
+    if TEST_MODE:
+        logger.debug("Ignoring Amiqus callback verification (AMIQUS_TEST_MODE enabled)")
+        return None
+    if not WEBHOOK_SECURITY_TOKEN:
+        raise ImproperlyConfigured("Missing AMIQUS_WEBHOOK_SECURITY_TOKEN")
+    if _match(WEBHOOK_SECURITY_TOKEN, request):
+        return None
+    # logging as a warning means it'll likely appear in logs,
+    # but it's by design - if people are sending invalid requests
+    # we need to know.
+    logger.warning("Amiqus callback request verification failed.")
+    return HttpResponseForbidden("Invalid X-Signature")
+
+
 def verify_signature() -> Callable:
     """
     View function decorator used to verify Amiqus webhook signatures.
@@ -74,28 +91,30 @@ def verify_signature() -> Callable:
 
     If the HMAC signatures don't match, return a 403
 
+    The decorator can be applied to sync and async views.
+
     """
 
     def decorator(func: Callable) -> Callable:
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def _async_wrapped_func(
+                request: HttpRequest, *args: Any, **kwargs: Any
+            ) -> HttpResponse:
+                if (response := _verify(request)) is not None:
+                    return response
+                return await func(request, *args, **kwargs)
+
+            return _async_wrapped_func
+
         @wraps(func)
         def _wrapped_func(
             request: HttpRequest, *args: Any, **kwargs: Any
         ) -> HttpResponse:
-            if TEST_MODE:
-                logger.debug(
-                    "Ignoring Amiqus callback verification (AMIQUS_TEST_MODE enabled)"
-                )
-                return func(request, *args, **kwargs)
-            if not WEBHOOK_SECURITY_TOKEN:
-                raise ImproperlyConfigured("Missing AMIQUS_WEBHOOK_SECURITY_TOKEN")
-            if _match(WEBHOOK_SECURITY_TOKEN, request):
-                return func(request, *args, **kwargs)
-            else:
-                # logging as a warning means it'll likely appear in logs,
-                # but it's by design - if people are sending invalid requests
-                # we need to know.
-                logger.warning("Amiqus callback request verification failed.")
-                return HttpResponseForbidden("Invalid X-Signature")
+            if (response := _verify(request)) is not None:
+                return response
+            return func(request, *args, **kwargs)
 
         return _wrapped_func
 
@@ -0,0 +1,83 @@
+"""
+De-duplication of webhook deliveries.
+
+Amiqus retries webhook deliveries that it does not think have succeeded,
+and each retry would otherwise update the resource from the API and fire
+the signals again. Each delivery is identified by its id if it has one, or
+else by the resource, trigger alias and triggered_at timestamp, and the
+deliveries that have been seen are remembered in a Django cache.
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+
+from . import metrics
+from .models import Event
+
+logger = logging.getLogger(__name__)
+
+
+def delivery_id(event: Event) -> str:
+    """Return the id of the delivery of a (parsed) event."""
+    raw = event.raw or {}
+    if delivery := raw.get("id"):
+        return str(delivery)
+    triggered_at = raw.get("trigger", {}).get("triggered_at", "")
+    return f"{event.resource_type}:{event.amiqus_id}:{event.action}:{triggered_at}"
+
+
+class WebhookDeduplicator:
+    """
+    Set of webhook deliveries seen in the last `ttl` seconds.
+
+    claim() adds a delivery to the set, and returns False if it was already
+    there - which is atomic (it uses cache.add), so only one of a number of
+    concurrent deliveries is processed. If processing fails, release() the
+    delivery so that the retry is processed.
+
+    """
+
+    def __init__(
+        self, ttl: int, *, cache_alias: str = "default", prefix: str = "amiqus:webhook"
+    ) -> None:
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.prefix = prefix
+
+    @property
+    def _cache(self) -> BaseCache:
+        return caches[self.cache_alias]
+
+    def key(self, event: Event) -> str:
+        """Return the cache key for the delivery of an event."""
+        digest = hashlib.sha256(delivery_id(event).encode()).hexdigest()
+        return f"{self.prefix}:{digest}"
+
+    def _claimed(self, event: Event, added: bool) -> bool:
+        if not added:
+            logger.info("Ignoring duplicate Amiqus webhook: %s", delivery_id(event))
+            metrics.incr("webhooks.duplicates")
+        return added
+
+    def claim(self, event: Event) -> bool:
+        """Record the delivery of an event - return False if it is a duplicate."""
+        return self._claimed(event, self._cache.add(self.key(event), 1, self.ttl))
+
+    def release(self, event: Event) -> None:
+        """Forget the delivery of an event, so that a retry is processed."""
+        self._cache.delete(self.key(event))
+
+    async def aclaim(self, event: Event) -> bool:
+        """Async version of claim()."""
+        added = await self._cache.aadd(self.key(event), 1, self.ttl)
+        return self._claimed(event, added)
+
+    async def arelease(self, event: Event) -> None:
+        """Async version of release()."""
+        await self._cache.adelete(self.key(event))
@@ -0,0 +1,356 @@
+"""
+Fake Amiqus API server, for load testing and benchmarks.
+
+FakeAmiqusApi is a WSGI app that implements the endpoints used by
+amiqus.api and amiqus.helpers - clients, records, steps, reviews and
+checks - backed by an in-memory store. Objects that have not been
+created through the API are generated on first access, so existing
+local objects can be pulled. Responses have ETags, and honour
+If-None-Match, and latency, errors and 429s can be injected.
+
+Run it in a thread, and point AMIQUS_API_ROOT at it:
+
+    with serve(FakeAmiqusApi(latency=lognormal(0.1), error_rate=0.01)) as url:
+        settings.AMIQUS_API_ROOT = url
+
+Or from the command line: python -m amiqus.fakeapi --port 8001.
+
+NB this module does not depend on Django, so that it can be run standalone.
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from socketserver import ThreadingMixIn
+from typing import Any
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+logger = logging.getLogger(__name__)
+
+# WSGI start_response callable
+StartResponse = Callable[[str, list[tuple[str, str]]], Any]
+
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    304: "Not Modified",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def lognormal(median: float, sigma: float = 0.5) -> Callable[[], float]:
+    """Return a log-normal latency distribution - long tailed, like real APIs."""
+    mu = math.log(median)
+    return lambda: random.lognormvariate(mu, sigma)  # noqa: S311
+
+
+def uniform(low: float, high: float) -> Callable[[], float]:
+    """Return a uniform latency distribution."""
+    return lambda: random.uniform(low, high)  # noqa: S311
+
+
+def _now() -> str:
+    return datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeAmiqusApi:
+    """
+    WSGI app that fakes the Amiqus API.
+
+    Args:
+        latency: seconds to wait before responding, or a function that returns
+            them - e.g. lognormal(0.1).
+        error_rate: proportion of requests that fail with a 500 / 503.
+        throttle_rate: proportion of requests that fail with a 429.
+        retry_after: the Retry-After header sent with 429s.
+        prefix: the path prefix of the API.
+
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float | Callable[[], float] = 0,
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        retry_after: int = 1,
+        prefix: str = "/api/v2/",
+    ) -> None:
+        self.latency = latency if callable(latency) else (lambda: latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.prefix = prefix
+        self.clients: dict[int, dict] = {}
+        self.records: dict[int, dict] = {}
+        self.checks: dict[int, dict] = {}
+        self.reviews: dict[int, list[dict]] = {}
+        self.requests: list[tuple[str, str]] = []
+        self._ids = itertools.count(100000)
+        self._lock = threading.Lock()
+
+    # fixtures - modelled on the API reference (and tests/conftest.py)
+
+    def _id(self) -> int:
+        return next(self._ids)
+
+    def _client(self, client_id: int, data: dict | None = None) -> dict:
+        data = data or {}
+        name = data.get("name", {"first_name": "Fred", "last_name": "McFly"})
+        return {
+            "object": "client",
+            "id": client_id,
+            "status": "pending",
+            "name": {
+                "object": "name",
+                "title": None,
+                "first_name": name.get("first_name", ""),
+                "last_name": name.get("last_name", ""),
+                "full_name": "{first_name} {last_name}".format(**name),
+            },
+            "email": data.get("email", f"client.{client_id}@example.com"),
+            "mobile": None,
+            "dob": data.get("dob"),
+            "reference": data.get("reference"),
+            "created_at": _now(),
+            "updated_at": _now(),
+            "archived_at": None,
+        }
+
+    def _check(self, check_id: int, record_id: int, check_type: str) -> dict:
+        return {
+            "object": "check",
+            "id": check_id,
+            "type": check_type.removeprefix("check."),
+            "record": record_id,
+            "status": "pending",
+            "allow_replay": False,
+            "allow_cancel": False,
+            "requires_consent": True,
+            "created_at": _now(),
+            "updated_at": _now(),
+        }
+
+    def _step(self, record_id: int, data: dict) -> dict:
+        step = {
+            "object": "step",
+            "id": self._id(),
+            "type": data["type"],
+            "preferences": data.get("preferences", {}),
+            "cost": 1,
+            "completed_at": None,
+        }
+        if data["type"].startswith("form."):
+            step["form"] = self._id()
+        else:
+            step["check"] = self._id()
+            self.checks[step["check"]] = self._check(
+                step["check"], record_id, data["type"]
+            )
+        return step
+
+    def _record(self, record_id: int, data: dict | None = None) -> dict:
+        data = data or {}
+        steps = data.get("steps") or [
+            {"type": "check.photo_id", "preferences": {"report_type": "standard"}},
+            {"type": "check.watchlist", "preferences": {"report_type": "standard"}},
+        ]
+        return {
+            "object": "record",
+            "id": record_id,
+            "status": "pending",
+            "client": data.get("client") or self._id(),
+            "steps": [self._step(record_id, step) for step in steps],
+            "perform_url": f"https://id.amiqus.co/perform/{record_id}",
+            "created_at": _now(),
+            "updated_at": _now(),
+            "archived_at": None,
+            "expired_at": None,
+        }
+
+    def _reviews(self, step_id: int) -> list[dict]:
+        if step_id not in self.reviews:
+            self.reviews[step_id] = [
+                {
+                    "object": "review",
+                    "id": self._id(),
+                    "step": step_id,
+                    "status": "pending",
+                    "created_at": _now(),
+                    "updated_at": _now(),
+                }
+            ]
+        return self.reviews[step_id]
+
+    # state changes - e.g. to simulate the events that trigger webhooks
+
+    def set_status(self, resource: str, amiqus_id: int, status: str) -> dict:
+        """Update the status of a client, record or check."""
+        with self._lock:
+            obj = self._get_or_create(resource, amiqus_id)
+            obj.update(status=status, updated_at=_now())
+            return obj
+
+    def _create(self, resource: str, data: dict) -> dict:
+        store: dict[int, dict] = getattr(self, resource)
+        amiqus_id = self._id()
+        if resource == "clients":
+            store[amiqus_id] = self._client(amiqus_id, data)
+        else:
+            store[amiqus_id] = self._record(amiqus_id, data)
+        return store[amiqus_id]
+
+    def _get_or_create(self, resource: str, amiqus_id: int) -> dict:
+        store: dict[int, dict] = getattr(self, resource)
+        if amiqus_id not in store:
+            if resource == "clients":
+                store[amiqus_id] = self._client(amiqus_id)
+            elif resource == "records":
+                store[amiqus_id] = self._record(amiqus_id)
+            else:
+                store[amiqus_id] = self._check(amiqus_id, self._id(), "photo_id")
+        return store[amiqus_id]
+
+    # request handling
+
+    def handle(self, method: str, path: str, data: dict) -> tuple[int, Any]:
+        """Handle an API request, and return the status code and response data."""
+        parts = path.strip("/").split("/") if path.strip("/") else []
+        with self._lock:
+            self.requests.append((method, path))
+            match method, parts:
+                case "HEAD" | "GET", []:
+                    return 200, {}
+                case "POST", ["clients" | "records" as resource]:
+                    return 201, self._create(resource, data)
+                case "GET", ["clients" | "records" | "checks" as resource, pk]:
+                    return 200, self._get_or_create(resource, int(pk))
+                case "PATCH", ["clients" | "records" as resource, pk]:
+                    obj = self._get_or_create(resource, int(pk))
+                    obj.update(data, updated_at=_now())
+                    return 200, obj
+                case "GET", ["records", pk, "steps"]:
+                    steps = self._get_or_create("records", int(pk))["steps"]
+                    return 200, {"object": "list", "data": steps}
+                case "GET", ["records", _, "steps", step_id, "reviews"]:
+                    reviews = self._reviews(int(step_id))
+                    return 200, {"object": "list", "data": reviews}
+                case ("GET" | "PATCH" | "POST", _):
+                    return 404, {"error": {"type": "not_found", "message": path}}
+                case _:
+                    return 405, {"error": {"type": "method_not_allowed"}}
+
+    def fault(self) -> tuple[int, dict, list[tuple[str, str]]] | None:
+        """Return an injected error response, if any."""
+        roll = random.random()  # noqa: S311
+        if roll < self.throttle_rate:
+            error = {"error": {"type": "rate_limited"}}
+            return 429, error, [("Retry-After", str(self.retry_after))]
+        if roll < self.throttle_rate + self.error_rate:
+            return random.choice((500, 503)), {"error": {"type": "error"}}, []  # noqa: S311
+        return None
+
+    def __call__(self, environ: dict, start_response: StartResponse) -> Iterable[bytes]:
+        method = environ["REQUEST_METHOD"]
+        path = environ.get("PATH_INFO", "")
+        headers: list[tuple[str, str]] = []
+        if (delay := self.latency()) > 0:
+            time.sleep(delay)
+        if not environ.get("HTTP_AUTHORIZATION", "").startswith("Bearer "):
+            status, data = 401, {"error": {"type": "unauthorized"}}
+        elif not path.startswith(self.prefix.rstrip("/")):
+            status, data = 404, {"error": {"type": "not_found"}}
+        elif fault := self.fault():
+            status, data, headers = fault
+        else:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            body = environ["wsgi.input"].read(length) if length else b""
+            path = path.removeprefix(self.prefix.rstrip("/"))
+            status, data = self.handle(method, path, json.loads(body or "{}"))
+        content = json.dumps(data).encode()
+        if status == 200:
+            etag = '"{}"'.format(hashlib.md5(content).hexdigest())  # noqa: S324
+            headers.append(("ETag", etag))
+            if environ.get("HTTP_IF_NONE_MATCH") == etag:
+                status, content = 304, b""
+        headers += [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(content))),
+        ]
+        start_response(f"{status} {STATUS_TEXT[status]}", headers)
+        return [b"" if method == "HEAD" else content]
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        logger.debug(format, *args)
+
+
+@contextmanager
+def serve(
+    app: FakeAmiqusApi | None = None, host: str = "127.0.0.1", port: int = 0
+) -> Iterator[str]:
+    """Run the fake API in a background thread, and yield its API root url."""
+    app = app or FakeAmiqusApi()
+    server = make_server(
+        host, port, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler
+    )
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_port}{app.prefix}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the fake API from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0, help="median seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    args = parser.parse_args(argv)
+    app = FakeAmiqusApi(
+        latency=lognormal(args.latency, args.latency_sigma) if args.latency else 0,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    )
+    logging.basicConfig(level=logging.INFO)
+    with serve(app, args.host, args.port) as url:
+        logger.info("Fake Amiqus API running - set AMIQUS_API_ROOT=%s", url)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
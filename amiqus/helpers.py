@@ -1,12 +1,112 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Literal, Union
 
 from django.conf import settings
+from django.db import connection
 
 from .api import get, patch, post
-from .models import Client, Event, Record, Review
+from .models import Client, Event, Record, Review, Step
+from .settings import REVIEW_FETCH_CONCURRENCY
+
+
+def _client_data(user: settings.AUTH_USER_MODEL, **kwargs: Any) -> dict:
+    """Format the POST data used to create a client."""
+    data = {
+        "name": {
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+        },
+        "email": user.email,
+    }
+    data.update(kwargs)
+    return data
+
+
+def _record_data(
+    client: Client,
+    steps: list[dict[str, Any]],
+    notification: Union[Literal["email"], Literal[False]],
+    reminder: bool,
+) -> dict:
+    """Format the POST data used to create a record."""
+    # We can add a custom message to the link here if we like, with a "message"
+    # key in the data dict.
+    return {
+        "client": client.amiqus_id,
+        "notification": notification,
+        "reminder": reminder,
+        "steps": steps,
+    }
+
+
+def _expired_at_data(expired_at: datetime) -> dict:
+    """Format the PATCH data used to update a record expiry date."""
+    return {"expired_at": expired_at.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+
+def _reviews_href(record_id: str, step: Step) -> str:
+    """Format the href for the reviews of a step."""
+    return f"records/{record_id}/steps/{step.amiqus_id}/reviews"
+
+
+def _fetch_reviews(record_id: str, steps: list[Step]) -> list[tuple[Step, list[dict]]]:
+    """Fetch the reviews for each step, up to REVIEW_FETCH_CONCURRENCY at once."""
+
+    def fetch(step: Step) -> tuple[Step, list[dict]]:
+        return step, get(_reviews_href(record_id, step))["data"]
+
+    if REVIEW_FETCH_CONCURRENCY <= 1 or len(steps) <= 1:
+        return [fetch(step) for step in steps]
+    with ThreadPoolExecutor(min(REVIEW_FETCH_CONCURRENCY, len(steps))) as executor:
+        return list(executor.map(fetch, steps))
+
+
+def _save_reviews(step_reviews: list[tuple[Step, list[dict]]]) -> None:
+    """
+    Create or update Reviews from the API response for each step.
+
+    The existing reviews are loaded in one query, and the new / changed
+    reviews are validated and written with a single upsert - or, if the
+    database does not support upserts (e.g. MySQL), with one bulk insert and
+    one bulk update.
+
+    """
+    reviews = {
+        str(review.amiqus_id): review
+        for step, review_list in step_reviews
+        for review in (Review(step=step).parse(data) for data in review_list)
+    }
+    existing = {
+        amiqus_id: (pk, status)
+        for amiqus_id, pk, status in Review.objects.filter(
+            amiqus_id__in=reviews
+        ).values_list("amiqus_id", "pk", "status")
+    }
+    changed = [
+        review
+        for amiqus_id, review in reviews.items()
+        if existing.get(amiqus_id, (None, None))[1] != review.status
+    ]
+    for review in changed:
+        # the steps have been validated already
+        review.clean_fields(exclude=["step"])
+    fields = ["status", "created_at", "raw", "raw_hash"]
+    if connection.features.supports_update_conflicts_with_target:
+        if changed:
+            Review.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=["amiqus_id"],
+                update_fields=fields,
+            )
+        return
+    for review in changed:
+        review.pk = existing.get(str(review.amiqus_id), (None, None))[0]
+    Review.objects.bulk_create([r for r in changed if r.pk is None])
+    Review.objects.bulk_update([r for r in changed if r.pk is not None], fields)
 
 
 def create_client(user: settings.AUTH_USER_MODEL, **kwargs: Any) -> Client:
@@ -21,15 +121,7 @@ def create_client(user: settings.AUTH_USER_MODEL, **kwargs: Any) -> Client:
        dob, gender, country, and any others that may change over time.
 
     """
-    data = {
-        "name": {
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-        },
-        "email": user.email,
-    }
-    data.update(kwargs)
-    response = post("clients", data=data)
+    response = post("clients", data=_client_data(user, **kwargs))
     return Client.objects.create_client(user, response)
 
 
@@ -60,38 +152,22 @@ def create_record(
     https://developers.amiqus.co/aqid/api-reference.html#tag/Records/operation/post-records
 
     """
-    # We can add a custom message to the link here if we like, with a "message"
-    # key in the data dict.
-    data = {
-        "client": client.amiqus_id,
-        "notification": notification,
-        "reminder": reminder,
-        "steps": steps,
-    }
-
+    data = _record_data(client, steps, notification, reminder)
     response = post("records", data=data)
     return Record.objects.create_record(client=client, raw=response)
 
 
-def create_or_update_reviews(
-    event: Event,
-) -> None:
-    """Create or update reviews for each step in a record."""
-    record_id = event.raw["data"]["record"]["id"]
-    record = Record.objects.get(amiqus_id=record_id)
-    steps = record.steps.all()
+def create_or_update_reviews(event: Event, record: Record | None = None) -> None:
+    """
+    Create or update reviews for each step in a record.
 
-    for step in steps:
-        response = get(f"records/{record_id}/steps/{step.amiqus_id}/reviews")
-        review_list = response["data"]
+    The record is looked up from the event, unless it is passed in.
 
-        for review_data in review_list:
-            try:
-                review = Review.objects.get(amiqus_id=review_data["id"])
-                if review.status != review_data["status"]:
-                    review.parse(review_data).save()
-            except Review.DoesNotExist:
-                Review(step=step).parse(review_data).save()
+    """
+    record_id = event.raw["data"]["record"]["id"]
+    if record is None:
+        record = Record.objects.get(amiqus_id=record_id)
+    _save_reviews(_fetch_reviews(record_id, list(record.steps.all())))
 
 
 def update_client_status(client: Client, client_status: Client.ClientStatus) -> None:
@@ -110,8 +186,5 @@ def update_record_expired_at_date(record: Record, expired_at: datetime) -> None:
     the required checks. Updating it with a future date will extend this deadline.
     Value for expiry date must be within 10 days from now.
     """
-    response = patch(
-        f"records/{record.amiqus_id}",
-        data={"expired_at": expired_at.strftime("%Y-%m-%dT%H:%M:%SZ")},
-    )
+    response = patch(f"records/{record.amiqus_id}", data=_expired_at_data(expired_at))
     record.parse(response).save()
@@ -0,0 +1,40 @@
+"""Process deferred webhook events - see amiqus.worker."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ... import worker
+
+
+class Command(BaseCommand):
+    help = "Process deferred Amiqus webhook events (AMIQUS_DEFER_WEBHOOKS)."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size", type=int, default=50, help="Events claimed per batch."
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Seconds to wait between polls when there are no pending events.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are no pending events.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        try:
+            total = worker.run(
+                batch_size=options["batch_size"],
+                poll_interval=options["poll_interval"],
+                once=options["once"],
+            )
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(f"Processed {total} Amiqus events.")
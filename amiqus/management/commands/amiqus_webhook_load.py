@@ -0,0 +1,298 @@
+"""
+Fire synthetic, signed webhooks at the status_update view, and report on them.
+
+The view always returns a 200, so this reports the outcome of each webhook
+by its response body - e.g. "Update processed." / "Record not found.".
+
+Webhooks are sent to the view in-process by default, or to a running
+server (using the same database) with --url. Each webhook refers to one of
+--objects throwaway Records / Clients, which are created for the run and
+deleted afterwards, along with their events - existing objects are only
+used with --use-existing, as the webhooks overwrite their status and raw
+JSON and fire the signals for them. Webhooks update the objects from the
+API, so use --fake-api to run them against amiqus.fakeapi instead.
+
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+from base64 import b64encode
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils.timezone import now
+
+from ... import api
+from ...decorators import _hmac
+from ...fakeapi import FakeAmiqusApi, lognormal, serve
+from ...models import Client, Event, Record
+from ...settings import DEFAULT_REQUESTS_TIMEOUT, WEBHOOK_SECURITY_TOKEN
+
+DEFAULT_MIX = "record.updated=4,record.finished=2,record.reviewed=1,client.status=3"
+
+# the ids used when there are no local objects to refer to
+MISSING_ID = "0"
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """Parse the --mix option - e.g. "record.finished=2,client.status=1"."""
+    try:
+        weights = {
+            alias.strip(): int(weight)
+            for alias, weight in (item.split("=") for item in mix.split(","))
+        }
+    except ValueError:
+        raise CommandError(f"Invalid --mix: {mix}")
+    if unknown := [a for a in weights if a.split(".")[0] not in ("record", "client")]:
+        raise CommandError(f"Unknown webhook aliases: {', '.join(unknown)}")
+    return weights
+
+
+def percentile(latencies: list[float], pct: int) -> float:
+    """Return the given percentile of the latencies."""
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[pct - 1]
+
+
+def webhook(alias: str, record_id: str, client_id: str) -> dict:
+    """Return a synthetic webhook body - see tests/conftest.py."""
+    data: dict[str, dict] = {
+        "client": {
+            "id": client_id,
+            "show": f"https://id.amiqus.co/api/clients/{client_id}",
+        }
+    }
+    if alias.startswith("record."):
+        data["record"] = {
+            "id": record_id,
+            "show": f"https://id.amiqus.co/api/records/{record_id}",
+            "download": f"https://id.amiqus.co/api/records/{record_id}/download",
+        }
+    return {
+        "webhook": {
+            "uuid": "load-test",
+            "created_at": now().isoformat(),
+            "events": ["*"],
+        },
+        "trigger": {"alias": alias, "triggered_at": now().isoformat()},
+        "data": data,
+    }
+
+
+class Command(BaseCommand):
+    help = __doc__.strip().split("\n")[0]
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="Concurrent senders."
+        )
+        parser.add_argument(
+            "--duration", type=float, default=10, help="Seconds to run for."
+        )
+        parser.add_argument(
+            "--requests", type=int, default=0, help="Stop after this many webhooks."
+        )
+        parser.add_argument(
+            "--mix", default=DEFAULT_MIX, help="Weighted webhook aliases to send."
+        )
+        parser.add_argument(
+            "--url", help="Send webhooks over HTTP to this url, not in-process."
+        )
+        parser.add_argument(
+            "--objects",
+            type=int,
+            default=10,
+            help="Throwaway Records / Clients to create for the run.",
+        )
+        parser.add_argument(
+            "--use-existing",
+            action="store_true",
+            help="Send webhooks for existing Records / Clients (this updates them).",
+        )
+        parser.add_argument(
+            "--fake-api",
+            action="store_true",
+            help="Point the API at amiqus.fakeapi while running in-process.",
+        )
+        parser.add_argument(
+            "--fake-api-latency",
+            type=float,
+            default=0.05,
+            help="Median latency of the fake API, in seconds.",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        mix = parse_mix(options["mix"])
+        send = self.sender(options["url"])
+        aliases, weights = list(mix), list(mix.values())
+
+        def body() -> bytes:
+            alias = random.choices(aliases, weights)[0]  # noqa: S311
+            record_id = random.choice(record_ids or [MISSING_ID])  # noqa: S311
+            client_id = random.choice(client_ids or [MISSING_ID])  # noqa: S311
+            return json.dumps(webhook(alias, record_id, client_id)).encode()
+
+        with ExitStack() as stack:
+            if options["use_existing"]:
+                records = Record.objects.values_list("amiqus_id", flat=True)
+                record_ids = list(records[:1000])
+                client_ids = list(
+                    Client.objects.values_list("amiqus_id", flat=True)[:1000]
+                )
+                if not (record_ids and client_ids):
+                    self.stderr.write(
+                        "No local records / clients - webhooks will miss."
+                    )
+            else:
+                user, record_ids, client_ids = self.create_objects(options["objects"])
+                stack.callback(self.delete_objects, user, record_ids + client_ids)
+            if options["fake_api"]:
+                if options["url"]:
+                    raise CommandError("--fake-api cannot be used with --url")
+                fake = FakeAmiqusApi(latency=lognormal(options["fake_api_latency"]))
+                root = stack.enter_context(serve(fake))
+                stack.callback(setattr, api, "API_ROOT", api.API_ROOT)
+                api.API_ROOT = root
+            results = self.run(
+                send,
+                body,
+                options["concurrency"],
+                options["duration"],
+                options["requests"],
+            )
+        self.report(*results)
+
+    def create_objects(self, count: int) -> tuple[Any, list[str], list[str]]:
+        """Create throwaway Records / Clients, and return their user and amiqus_ids."""
+        # numeric ids, as used by the API (and amiqus.fakeapi)
+        base = random.randrange(10**12, 10**13)  # noqa: S311
+        ids = [str(base + i) for i in range(count * 2)]
+        if Client.objects.filter(amiqus_id__in=ids).exists() or (
+            Record.objects.filter(amiqus_id__in=ids).exists()
+        ):
+            raise CommandError("Throwaway ids are in use - please try again.")
+        user = get_user_model().objects.create_user(f"amiqus-load-test-{base}")
+        clients = Client.objects.bulk_create(
+            Client(user=user, amiqus_id=amiqus_id, status="pending")
+            for amiqus_id in ids[:count]
+        )
+        Record.objects.bulk_create(
+            Record(user=user, client=client, amiqus_id=amiqus_id, status="pending")
+            for client, amiqus_id in zip(clients, ids[count:])
+        )
+        return user, ids[count:], ids[:count]
+
+    def delete_objects(self, user: Any, amiqus_ids: list[str]) -> None:
+        """Delete the throwaway objects (and their events) created for the run."""
+        Event.objects.filter(amiqus_id__in=amiqus_ids).delete()
+        # deleting the user deletes its clients / records
+        user.delete()
+
+    def sender(self, url: str | None) -> Callable[[bytes], str]:
+        """Return a function that sends a webhook body, returning the response."""
+
+        def headers(body: bytes) -> dict:
+            if not WEBHOOK_SECURITY_TOKEN:
+                return {}
+            signature = _hmac(WEBHOOK_SECURITY_TOKEN, body)
+            return {"X-AQID-Signature": b64encode(signature).decode()}
+
+        if url:
+            session = requests.Session()
+
+            def send_http(body: bytes) -> str:
+                response = session.post(
+                    url,
+                    data=body,
+                    headers={"Content-Type": "application/json", **headers(body)},
+                    timeout=DEFAULT_REQUESTS_TIMEOUT,
+                )
+                return f"{response.status_code} {response.text}"
+
+            return send_http
+
+        path = reverse("amiqus:status_update")
+        view = resolve(path).func
+        factory = RequestFactory()
+
+        def send(body: bytes) -> str:
+            request = factory.post(
+                path,
+                body,
+                content_type="application/json",
+                headers=headers(body),
+            )
+            response = view(request)
+            return f"{response.status_code} {response.content.decode()}"
+
+        return send
+
+    def run(
+        self,
+        send: Callable[[bytes], str],
+        body: Callable[[], bytes],
+        concurrency: int,
+        duration: float,
+        max_requests: int,
+    ) -> tuple[list[float], Counter, float]:
+        """Send webhooks until the duration / number of requests is reached."""
+        latencies: list[float] = []
+        outcomes: Counter = Counter()
+        lock = threading.Lock()
+        issued = itertools.count(1)
+        started = time.monotonic()
+        deadline = started + duration
+
+        def worker() -> None:
+            try:
+                while time.monotonic() < deadline:
+                    with lock:
+                        if max_requests and next(issued) > max_requests:
+                            return
+                    data = body()
+                    sent = time.monotonic()
+                    try:
+                        outcome = send(data)
+                    except Exception as ex:  # noqa: B902
+                        outcome = f"error {ex.__class__.__name__}"
+                    with lock:
+                        latencies.append(time.monotonic() - sent)
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return latencies, outcomes, time.monotonic() - started
+
+    def report(self, latencies: list[float], outcomes: Counter, elapsed: float) -> None:
+        """Write the throughput, latency percentiles and outcomes."""
+        total = len(latencies)
+        self.stdout.write(f"Webhooks sent: {total} in {elapsed:.2f}s")
+        self.stdout.write(f"Throughput: {total / elapsed:.1f} webhooks/s")
+        self.stdout.write(
+            "Latency (ms): p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+                *(percentile(latencies, pct) * 1000 for pct in (50, 95, 99)),
+                max(latencies, default=0) * 1000,
+            )
+        )
+        self.stdout.write("Outcomes:")
+        for outcome, count in outcomes.most_common():
+            self.stdout.write(f"  {count:>8}  {outcome}")
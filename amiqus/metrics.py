@@ -0,0 +1,40 @@
+"""
+In-process counters used to monitor API and webhook activity.
+
+Counters are held per process (they are not shared between workers), and
+are intended to be read periodically with snapshot() and exported to
+whatever metrics backend is in use.
+
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+
+_counters: defaultdict[str, float] = defaultdict(float)
+_lock = threading.Lock()
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Increment the named counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> float:
+    """Return the current value of the named counter."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict[str, float]:
+    """Return a copy of all counters."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    """Reset all counters to zero."""
+    with _lock:
+        _counters.clear()
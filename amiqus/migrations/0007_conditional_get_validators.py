@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("amiqus", "0006_step_amiqus_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="check",
+            name="etag",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The ETag returned from the API (used for conditional GETs).",
+                max_length=200,
+            ),
+        ),
+        migrations.AddField(
+            model_name="check",
+            name="last_modified",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The Last-Modified header returned from the API (used for conditional GETs).",
+                max_length=50,
+            ),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="etag",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The ETag returned from the API (used for conditional GETs).",
+                max_length=200,
+            ),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="last_modified",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The Last-Modified header returned from the API (used for conditional GETs).",
+                max_length=50,
+            ),
+        ),
+        migrations.AddField(
+            model_name="form",
+            name="etag",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The ETag returned from the API (used for conditional GETs).",
+                max_length=200,
+            ),
+        ),
+        migrations.AddField(
+            model_name="form",
+            name="last_modified",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The Last-Modified header returned from the API (used for conditional GETs).",
+                max_length=50,
+            ),
+        ),
+        migrations.AddField(
+            model_name="record",
+            name="etag",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The ETag returned from the API (used for conditional GETs).",
+                max_length=200,
+            ),
+        ),
+        migrations.AddField(
+            model_name="record",
+            name="last_modified",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The Last-Modified header returned from the API (used for conditional GETs).",
+                max_length=50,
+            ),
+        ),
+        migrations.AddField(
+            model_name="review",
+            name="etag",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The ETag returned from the API (used for conditional GETs).",
+                max_length=200,
+            ),
+        ),
+        migrations.AddField(
+            model_name="review",
+            name="last_modified",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="The Last-Modified header returned from the API (used for conditional GETs).",
+                max_length=50,
+            ),
+        ),
+    ]
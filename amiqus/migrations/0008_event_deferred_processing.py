@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("amiqus", "0007_conditional_get_validators"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0, help_text="The number of attempts made to process the event."
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="last_error",
+            field=models.TextField(
+                blank=True, help_text="The error raised by the last failed attempt."
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="next_attempt_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Failed attempts are retried after this time.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="processed_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="The timestamp when the event was processed.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processed", "Processed"),
+                    ("failed", "Failed"),
+                ],
+                default="processed",
+                help_text="Deferred events are pending until processed by the worker.",
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["state", "next_attempt_at"], name="amiqus_even_state_b3d581_idx"
+            ),
+        ),
+    ]
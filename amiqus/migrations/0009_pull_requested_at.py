@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("amiqus", "0008_event_deferred_processing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="check",
+            name="pull_requested_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="Set when the object was updated from a trusted webhook, until it is pulled from the API.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="pull_requested_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="Set when the object was updated from a trusted webhook, until it is pulled from the API.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="form",
+            name="pull_requested_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="Set when the object was updated from a trusted webhook, until it is pulled from the API.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="record",
+            name="pull_requested_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="Set when the object was updated from a trusted webhook, until it is pulled from the API.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="review",
+            name="pull_requested_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="Set when the object was updated from a trusted webhook, until it is pulled from the API.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("amiqus", "0009_pull_requested_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="check",
+            name="raw_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="A hash of the raw JSON (used to skip unchanged updates).",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="client",
+            name="raw_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="A hash of the raw JSON (used to skip unchanged updates).",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="form",
+            name="raw_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="A hash of the raw JSON (used to skip unchanged updates).",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="record",
+            name="raw_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="A hash of the raw JSON (used to skip unchanged updates).",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="review",
+            name="raw_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="A hash of the raw JSON (used to skip unchanged updates).",
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("amiqus", "0010_raw_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="event",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("processed", "Processed"),
+                    ("failed", "Failed"),
+                ],
+                default="processed",
+                help_text="Deferred events are pending until processed by the worker.",
+                max_length=10,
+            ),
+        ),
+    ]
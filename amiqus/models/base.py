@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import json
 import logging
-from typing import TYPE_CHECKING, Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Iterator
 
+from asgiref.sync import sync_to_async
 from dateutil.parser import parse as date_parse
 from django.db import models
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
-from ..api import get
-from ..signals import on_completion, on_status_change
+from .. import metrics
+from ..api import ConditionalResponse, get_conditional, invalidate
+from ..settings import WEBHOOK_RECONCILE
+from ..signals import on_completion, on_status_change, send_on_commit
 
 if TYPE_CHECKING:
     from .event import Event
@@ -17,6 +26,12 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+def hash_raw(raw_json: dict | None) -> str:
+    """Return a stable hash of (scrubbed) raw JSON - independent of key order."""
+    data = json.dumps(raw_json, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
 class BaseModel(models.Model):
     """Base model used to set timestamps."""
 
@@ -38,6 +53,56 @@ class BaseModel(models.Model):
     raw = models.JSONField(
         help_text=_("The raw JSON returned from the API."), blank=True, null=True
     )
+    etag = models.CharField(
+        max_length=200,
+        blank=True,
+        default="",
+        help_text=_("The ETag returned from the API (used for conditional GETs)."),
+    )
+    last_modified = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        help_text=_(
+            "The Last-Modified header returned from the API "
+            "(used for conditional GETs)."
+        ),
+    )
+
+    raw_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        help_text=_("A hash of the raw JSON (used to skip unchanged updates)."),
+    )
+    pull_requested_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_index=True,
+        help_text=_(
+            "Set when the object was updated from a trusted webhook, until it "
+            "is pulled from the API."
+        ),
+    )
+
+    # the fields set by fetch() - saved by BaseQuerySet.pull(concurrency=...)
+    fetched_fields: tuple[str, ...] = (
+        "raw",
+        "raw_hash",
+        "status",
+        "created_at",
+        "etag",
+        "last_modified",
+    )
+
+    # set by fetch() - True if the remote object had not changed
+    unchanged = False
+    # set by fetch() - True if the remote object had not changed, but the
+    # ETag / Last-Modified did (so they must still be saved)
+    validators_changed = False
+
+    # set by update_status() - True if the event was stale, and was dropped
+    stale = False
 
     class Meta:
         abstract = True
@@ -53,9 +118,14 @@ class BaseModel(models.Model):
         super().save(*args, **kwargs)
         return self
 
+    def scrub(self, raw_json: dict) -> dict:
+        """Remove any data that should not be stored - override in subclasses."""
+        return raw_json
+
     def parse(self, raw_json: dict) -> BaseModel:
         """Parse the raw value out into other properties."""
         self.raw = raw_json
+        self.raw_hash = hash_raw(raw_json)
         self.amiqus_id = self.raw["id"]
         self.status = self.raw.get("status")
 
@@ -79,42 +149,251 @@ class BaseModel(models.Model):
 
         >>> obj = Record(amiqus_id='123').fetch()
 
+        The request is conditional on the ETag / Last-Modified validators
+        from the previous fetch - if the API reports that the object has not
+        changed since then, it is not parsed, and `unchanged` is set.
+
         Returns the updated object (unsaved).
 
         """
-        return self.parse(get(self.href))
+        return self._parse_response(
+            get_conditional(self.href, etag=self.etag, last_modified=self.last_modified)
+        )
 
     def pull(self) -> BaseModel:
         """
         Update the object from the remote API.
 
         Named after the git operation - this will call fetch(), and
-        then save the object.
+        then save the object (unless it has not changed).
 
         Returns the updated object (saved).
 
         """
-        return self.fetch().save()
+        self.fetch()
+        if self.unchanged and not self.pull_requested_at:
+            if self.validators_changed:
+                # so that the next fetch is conditional
+                type(self)._default_manager.filter(pk=self.pk).update(
+                    etag=self.etag, last_modified=self.last_modified
+                )
+            return self
+        self.pull_requested_at = None
+        return self.save()
+
+    def _parse_response(self, response: ConditionalResponse) -> BaseModel:
+        """Parse the response to a conditional GET, unless it is not modified."""
+        self.unchanged = response.data is None
+        self.validators_changed = False
+        if response.data is None:
+            logger.debug("Amiqus object not modified: %r", self)
+            metrics.incr("fetch.unchanged")
+            return self
+        validators = (response.etag, response.last_modified)
+        self.validators_changed = validators != (self.etag, self.last_modified)
+        self.etag, self.last_modified = validators
+        if self.raw_hash and hash_raw(self.scrub(response.data)) == self.raw_hash:
+            # the API returned what we already have (e.g. the stored ETag
+            # was cleared), so there is nothing to parse - only the new
+            # validators are saved
+            logger.debug("Amiqus object is identical: %r", self)
+            metrics.incr("fetch.identical")
+            self.unchanged = True
+            return self
+        return self.parse(response.data)
+
+    def clear_validators(self) -> None:
+        """Clear the ETag / Last-Modified and hash, so the next fetch is parsed."""
+        self.etag = self.last_modified = self.raw_hash = ""
+
+    def defer_pull(self) -> BaseModel:
+        """
+        Mark the object as changed without pulling it from the API.
+
+        Used when the object has been updated from a trusted webhook. If
+        WEBHOOK_RECONCILE is set, pull_requested_at is set so that the object
+        is pulled later by the worker (see amiqus.worker.pull_requested).
+
+        Returns the object (unsaved).
+
+        """
+        self.clear_validators()
+        if WEBHOOK_RECONCILE:
+            # a new timestamp, so that a pull already in progress (see
+            # BaseQuerySet.pull) does not clear it
+            self.pull_requested_at = now()
+        metrics.incr("webhooks.trusted")
+        return self
+
+    async def afetch(self) -> BaseModel:
+        """Async version of fetch() - requires the optional httpx dependency."""
+        # prevents circ. import
+        from ..aio import get_conditional as aget_conditional
+
+        return self._parse_response(
+            await aget_conditional(
+                self.href, etag=self.etag, last_modified=self.last_modified
+            )
+        )
+
+    async def apull(self) -> BaseModel:
+        """Async version of pull() - requires the optional httpx dependency."""
+        await self.afetch()
+        if self.unchanged and not self.pull_requested_at:
+            if self.validators_changed:
+                await (
+                    type(self)
+                    ._default_manager.filter(pk=self.pk)
+                    .aupdate(etag=self.etag, last_modified=self.last_modified)
+                )
+            return self
+        self.pull_requested_at = None
+        await self.asave()
+        return self
+
+
+@dataclass
+class PullSummary:
+    """The outcome of fetching / pulling all the objects in a queryset."""
+
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    # the error for each object that failed, by amiqus_id
+    errors: dict[str, str] = field(default_factory=dict, compare=False)
+
+    @property
+    def succeeded(self) -> int:
+        """Return the number of objects fetched / pulled successfully."""
+        return self.updated + self.unchanged
+
+    def add(self, obj: BaseModel) -> None:
+        """Count a successfully fetched / pulled object."""
+        if obj.unchanged:
+            self.unchanged += 1
+        else:
+            self.updated += 1
+
+    def add_error(self, obj: BaseModel, error: Exception) -> None:
+        """Count an object that could not be fetched / pulled."""
+        self.failed += 1
+        self.errors[obj.amiqus_id] = f"{error.__class__.__name__}: {error}"
+
+
+def _fetch(obj: BaseModel) -> Exception | None:
+    """Fetch and validate an object - return the error if it fails."""
+    try:
+        obj.fetch()
+        # related objects are not changed by a fetch
+        obj.clean_fields(
+            exclude=[f.name for f in obj._meta.concrete_fields if f.is_relation]
+        )
+    except Exception as ex:  # noqa: B902
+        return ex
+    return None
 
 
 class BaseQuerySet(models.QuerySet):
     """Custom queryset for models subclassing BaseModel."""
 
-    def fetch(self) -> None:
-        """Call fetch method on all objects in the queryset."""
+    def _fetch_chunks(
+        self, summary: PullSummary, concurrency: int, chunk_size: int
+    ) -> Iterator[list[BaseModel]]:
+        """
+        Fetch the objects concurrently, a chunk at a time.
+
+        Yields the objects in each chunk that were fetched successfully, and
+        adds the outcome for each object to the summary. Only one chunk is
+        loaded from the database at a time, so memory use is bounded.
+
+        """
+        objs = self.iterator(chunk_size=chunk_size)
+        with ThreadPoolExecutor(max(concurrency, 1)) as executor:
+            while chunk := list(islice(objs, chunk_size)):
+                fetched = []
+                for obj, error in zip(chunk, executor.map(_fetch, chunk)):
+                    if error is None:
+                        summary.add(obj)
+                        fetched.append(obj)
+                    else:
+                        logger.error(
+                            "Failed to fetch Amiqus object %s: %s", obj.amiqus_id, error
+                        )
+                        summary.add_error(obj, error)
+                yield fetched
+
+    def fetch(
+        self, *, concurrency: int | None = None, chunk_size: int = 100
+    ) -> PullSummary:
+        """
+        Call fetch method on all objects in the queryset.
+
+        If concurrency is set, up to that many objects are fetched at once (see
+        pull) - the API rate limit, if there is one, still applies.
+
+        """
+        summary = PullSummary()
+        if concurrency is not None:
+            for _ in self._fetch_chunks(summary, concurrency, chunk_size):
+                pass
+            return summary
         for obj in self:
             try:
-                obj.fetch()
-            except Exception:  # noqa: B902
+                summary.add(obj.fetch())
+            except Exception as ex:  # noqa: B902
                 logger.exception("Failed to fetch Amiqus object: %r", obj)
+                summary.add_error(obj, ex)
+        return summary
 
-    def pull(self) -> None:
-        """Call pull method on all objects in the queryset."""
-        for obj in self:
-            try:
-                obj.pull()
-            except Exception:  # noqa: B902
-                logger.exception("Failed to pull Amiqus object: %r", obj)
+    def pull(
+        self, *, concurrency: int | None = None, chunk_size: int = 100
+    ) -> PullSummary:
+        """
+        Call pull method on all objects in the queryset.
+
+        If concurrency is set, the objects are read from the database in
+        chunks of chunk_size, up to concurrency objects are fetched at once,
+        and the changed objects in each chunk (including those that are
+        identical, but whose ETag / Last-Modified have changed) are saved with
+        one bulk_update of their fetched_fields - so fields changed by
+        webhooks while the chunk was being fetched are not overwritten.
+        The API rate limit, if there is one, still applies. NB bulk_update
+        does not call save(), so no pre_save / post_save signals are sent.
+
+        """
+        summary = PullSummary()
+        if concurrency is None:
+            for obj in self:
+                try:
+                    summary.add(obj.pull())
+                except Exception as ex:  # noqa: B902
+                    logger.exception("Failed to pull Amiqus object: %r", obj)
+                    summary.add_error(obj, ex)
+            logger.info("Pulled Amiqus objects: %s", summary)
+            return summary
+
+        manager = self.model._default_manager
+        fields = [
+            f.name
+            for f in self.model._meta.concrete_fields
+            if f.name in self.model.fetched_fields
+        ]
+        for fetched in self._fetch_chunks(summary, concurrency, chunk_size):
+            if changed := [
+                obj for obj in fetched if not obj.unchanged or obj.validators_changed
+            ]:
+                manager.bulk_update(changed, fields)
+            if requested := [obj for obj in fetched if obj.pull_requested_at]:
+                # unless the object has been marked again since it was loaded
+                marked = models.Q()
+                for obj in requested:
+                    marked |= models.Q(
+                        pk=obj.pk, pull_requested_at=obj.pull_requested_at
+                    )
+                    obj.pull_requested_at = None
+                manager.filter(marked).update(pull_requested_at=None)
+        logger.info("Pulled Amiqus objects: %s", summary)
+        return summary
 
 
 class BaseStatusModel(BaseModel):
@@ -156,6 +435,45 @@ class BaseStatusModel(BaseModel):
             amiqus_id=self.amiqus_id, resource_type=self._meta.model_name
         )
 
+    def _older_than(self, event: Event) -> BaseQuerySet:
+        """Return a queryset matching this object, unless it is newer than the event."""
+        # triggered_at only has one second resolution, so events with the same
+        # timestamp are all applied (duplicate deliveries are not - see
+        # amiqus.deduplication)
+        return type(self).objects.filter(
+            models.Q(updated_at__isnull=True)
+            | models.Q(updated_at__lte=event.completed_at),
+            pk=self.pk,
+        )
+
+    def _claimed(self, event: Event, updated: int) -> bool:
+        if not updated:
+            logger.info("Ignoring stale Amiqus event %s: %r", event.action, self)
+            metrics.incr("webhooks.stale")
+        return bool(updated)
+
+    def claim_event(self, event: Event) -> bool:
+        """
+        Return False if the object has already been updated by a newer event.
+
+        Events can arrive out of order, so the event's timestamp is claimed
+        with a conditional UPDATE of updated_at - of any number of concurrent
+        events, only the newest (and any with the same timestamp) are applied.
+        Unsaved objects are not checked.
+
+        """
+        if self.pk is None:
+            return True
+        updated = self._older_than(event).update(updated_at=event.completed_at)
+        return self._claimed(event, updated)
+
+    async def aclaim_event(self, event: Event) -> bool:
+        """Async version of claim_event()."""
+        if self.pk is None:
+            return True
+        updated = await self._older_than(event).aupdate(updated_at=event.completed_at)
+        return self._claimed(event, updated)
+
     def update_status(self, event: Event) -> BaseStatusModel:
         """
         Update the status field of the object and fire signal(s).
@@ -172,6 +490,13 @@ class BaseStatusModel(BaseModel):
         something more useful - updating the status of the user, sending
         them an email etc.
 
+        Events that are older than the last event applied to the object are
+        ignored - the object is not pulled, no signals are fired, and `stale`
+        is set. The status of trusted events (see AMIQUS_WEBHOOK_TRUSTED_ALIASES)
+        is saved without pulling the object first. If the object cannot be
+        pulled, the status from the event is still saved, and the pull is left
+        to the worker (see defer_pull).
+
         Args:
             event: Event object containing the update information
 
@@ -182,17 +507,32 @@ class BaseStatusModel(BaseModel):
         # just ensures we do actually have a datetime at this point
         if not isinstance(event.completed_at, datetime.datetime):
             raise ValueError("event.completed_at is not a datetime object")
+        # events can arrive out of order - drop any older than the last one
+        self.stale = not self.claim_event(event)
+        if self.stale:
+            return self
         # swap statuses around so we record old / new
         self.status, old_status = event.status, self.status
         self.updated_at = event.completed_at
+        # the event means any cached response is out of date
+        invalidate(self.href)
         try:
-            self.pull()
+            if event.trusted:
+                self.defer_pull().save()
+            else:
+                self.pull()
+                if self.unchanged:
+                    # the remote object hasn't changed, but the event has
+                    self.parse(self.raw).save()
         except Exception:  # noqa: B902
             # even if we can't get latest, we should save the changes we
-            # have already made to the object
+            # have already made to the object - which no longer match the
+            # last fetch, so the next one must not be conditional - and
+            # leave the pull to the worker.
             logger.warning("Unable to pull latest from Amiqus: '%r'", self)
-            self.save()
-        on_status_change.send(
+            self.defer_pull().save()
+        send_on_commit(
+            on_status_change,
             self.__class__,
             instance=self,
             event=event.action,
@@ -200,9 +540,75 @@ class BaseStatusModel(BaseModel):
             status_after=event.status,
         )
         if event.status == self.Status.ACCEPTED.value:  # type: ignore[attr-defined]
-            on_completion.send(self.__class__, instance=self)
+            send_on_commit(on_completion, self.__class__, instance=self)
         return self
 
+    async def aupdate_status(self, event: Event) -> BaseStatusModel:
+        """
+        Async version of update_status() - requires the optional httpx dependency.
+
+        The async ORM does not support transactions, so the row cannot be
+        locked while the object is pulled. Instead the object is saved with a
+        conditional UPDATE (see _save_claimed) - if a newer event has been
+        applied in the meantime, this one is dropped, and `stale` is set.
+
+        """
+        # prevents circ. import
+        from ..aio import invalidate as ainvalidate
+
+        if not isinstance(event.completed_at, datetime.datetime):
+            raise ValueError("event.completed_at is not a datetime object")
+        self.stale = not await self.aclaim_event(event)
+        if self.stale:
+            return self
+        self.status, old_status = event.status, self.status
+        self.updated_at = event.completed_at
+        await ainvalidate(self.href)
+        try:
+            if event.trusted:
+                self.defer_pull()
+            else:
+                await self.afetch()
+                if self.unchanged:
+                    # the remote object hasn't changed, but the event has
+                    self.parse(self.raw)
+                self.pull_requested_at = None
+        except Exception:  # noqa: B902
+            logger.warning("Unable to pull latest from Amiqus: '%r'", self)
+            self.defer_pull()
+        self.stale = not await sync_to_async(self._save_claimed)(event)
+        if self.stale:
+            return self
+        await on_status_change.asend(
+            self.__class__,
+            instance=self,
+            event=event.action,
+            status_before=old_status,
+            status_after=event.status,
+        )
+        if event.status == self.Status.ACCEPTED.value:  # type: ignore[attr-defined]
+            await on_completion.asend(self.__class__, instance=self)
+        return self
+
+    def _save_claimed(self, event: Event) -> bool:
+        """
+        Save the object, unless a newer event has been applied since it was claimed.
+
+        Returns False if the object was not saved. NB this uses update(), so
+        no pre_save / post_save signals are sent.
+
+        """
+        if self.pk is None:
+            self.save()
+            return True
+        self.full_clean()
+        fields = {
+            f.attname: getattr(self, f.attname)
+            for f in self._meta.concrete_fields
+            if not f.primary_key
+        }
+        return self._claimed(event, self._older_than(event).update(**fields))
+
     def parse(self, raw_json: dict) -> BaseStatusModel:
         """Parse the raw value out into other properties.
 
@@ -37,6 +37,7 @@ class Check(BaseStatusModel):
         PAUSED = ("paused", _("Paused"))
 
     base_href = "checks"
+    fetched_fields = (*BaseStatusModel.fetched_fields, "check_type")
 
     class CheckType(models.TextChoices):
         """
@@ -90,19 +91,23 @@ class Check(BaseStatusModel):
 
     def __repr__(self) -> str:
         return "<Check id={} type='{}' user_id={}>".format(
-            self.id, self.check_type, self.user.id
+            self.id, self.check_type, self.user_id
         )
 
+    def scrub(self, raw_json: dict) -> dict:
+        """Remove sensitive data, using the scrub_check_data setting."""
+        return scrub_check_data(raw_json)
+
     def parse(self, raw_json: dict) -> Check:
         """
         Parse the raw value out into other properties.
 
-        Before parsing the data, this method will call the
-        scrub_check_data function to remove sensitive data
-        so that it is not saved into the local object.
+        Before parsing the data, this method will call scrub() to
+        remove sensitive data so that it is not saved into the local
+        object.
 
         """
-        super().parse(scrub_check_data(raw_json))
+        super().parse(self.scrub(raw_json))
         # Ensure that the check type conforms to Check.CheckType.
         # On Record/Check creation, the type will have the check.
         # prefix. But when pulling check data, there is no prefix.
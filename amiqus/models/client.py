@@ -8,8 +8,9 @@ from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from ..api import invalidate
 from ..settings import scrub_client_data
-from ..signals import on_completion, on_status_change
+from ..signals import on_completion, on_status_change, send_on_commit
 from .base import BaseModel, BaseQuerySet
 
 if TYPE_CHECKING:
@@ -61,18 +62,22 @@ class Client(BaseModel):
         return str(self.user)
 
     def __repr__(self) -> str:
-        return "<Client id={} user_id={}>".format(self.id, self.user.id)
+        return "<Client id={} user_id={}>".format(self.id, self.user_id)
+
+    def scrub(self, raw_json: dict) -> dict:
+        """Remove sensitive data, using the scrub_client_data setting."""
+        return scrub_client_data(raw_json)
 
     def parse(self, raw_json: dict) -> Client:
         """
         Parse the raw value out into other properties.
 
-        Before parsing the data, this method will call the
-        scrub_check_data function to remove sensitive data
-        so that it is not saved into the local object.
+        Before parsing the data, this method will call scrub() to
+        remove sensitive data so that it is not saved into the local
+        object.
 
         """
-        super().parse(scrub_client_data(raw_json))
+        super().parse(self.scrub(raw_json))
         self.status = self.raw["status"]
         return self
 
@@ -92,6 +97,12 @@ class Client(BaseModel):
         something more useful - updating the status of the user, sending
         them an email etc.
 
+        The status of trusted events (see AMIQUS_WEBHOOK_TRUSTED_ALIASES) is
+        saved without pulling the client first. If the client cannot be
+        pulled, the status from the event is still saved, and the pull is left
+        to the worker (see defer_pull) - the error is not raised, as that
+        would roll back the webhook's transaction.
+
         Args:
             event: Event object containing the update information
 
@@ -105,15 +116,56 @@ class Client(BaseModel):
         # swap statuses around so we record old / new
         self.status, old_status = event.status, self.status
         self.updated_at = event.completed_at
+        # the event means any cached response is out of date
+        invalidate(self.href)
         try:
-            self.pull()
-        except Exception as e:  # noqa: B902
+            if event.trusted:
+                self.defer_pull().save()
+            else:
+                self.pull()
+                if self.unchanged:
+                    # the remote object hasn't changed, but the event has
+                    self.parse(self.raw).save()
+        except Exception:  # noqa: B902
             # even if we can't get latest, we should save the changes we
-            # have already made to the object
+            # have already made to the object - which no longer match the
+            # last fetch, so the next one must not be conditional - and
+            # leave the pull to the worker.
+            logger.warning("Unable to pull latest from Amiqus: '%r'", self)
+            self.defer_pull().save()
+        send_on_commit(
+            on_status_change,
+            self.__class__,
+            instance=self,
+            event=event.action,
+            status_before=old_status,
+            status_after=event.status,
+        )
+        if event.status == self.ClientStatus.APPROVED.value:  # type: ignore[attr-defined]
+            send_on_commit(on_completion, self.__class__, instance=self)
+        return self
+
+    async def aupdate_status(self, event: Event) -> Client:
+        """Async version of update_status() - requires the optional httpx dependency."""
+        # prevents circ. import
+        from ..aio import invalidate as ainvalidate
+
+        if not isinstance(event.completed_at, datetime.datetime):
+            raise ValueError("event.completed_at is not a datetime object")
+        self.status, old_status = event.status, self.status
+        self.updated_at = event.completed_at
+        await ainvalidate(self.href)
+        try:
+            if event.trusted:
+                await self.defer_pull().asave()
+            else:
+                await self.apull()
+                if self.unchanged:
+                    await self.parse(self.raw).asave()
+        except Exception:  # noqa: B902
             logger.warning("Unable to pull latest from Amiqus: '%r'", self)
-            self.save()
-            raise e
-        on_status_change.send(
+            await self.defer_pull().asave()
+        await on_status_change.asend(
             self.__class__,
             instance=self,
             event=event.action,
@@ -121,5 +173,5 @@ class Client(BaseModel):
             status_after=event.status,
         )
         if event.status == self.ClientStatus.APPROVED.value:  # type: ignore[attr-defined]
-            on_completion.send(self.__class__, instance=self)
+            await on_completion.asend(self.__class__, instance=self)
         return self
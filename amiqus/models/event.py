@@ -1,13 +1,17 @@
 from __future__ import annotations
 
 import logging
+from datetime import timedelta
 from typing import TypeAlias
 
 from dateutil.parser import parse as date_parse
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from ..settings import WEBHOOK_TRUSTED_ALIASES
 from .client import Client
 from .record import Record
 
@@ -16,9 +20,34 @@ UserType: TypeAlias = settings.AUTH_USER_MODEL
 logger = logging.getLogger(__name__)
 
 
+class EventQuerySet(models.QuerySet):
+    """Event model queryset."""
+
+    def pending(self) -> EventQuerySet:
+        """
+        Return deferred events that are ready to be processed.
+
+        This includes events that were claimed by a worker, but not processed
+        before their claim expired (next_attempt_at).
+
+        """
+        return self.filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now()),
+            state__in=[Event.EventState.PENDING, Event.EventState.PROCESSING],
+        )
+
+
 class Event(models.Model):
     """Used to record callback events received from the API."""
 
+    class EventState(models.TextChoices):
+        """The processing state of an event."""
+
+        PENDING = ("pending", _("Pending"))
+        PROCESSING = ("processing", _("Processing"))
+        PROCESSED = ("processed", _("Processed"))
+        FAILED = ("failed", _("Failed"))
+
     # used to map the event name to the model it affects
     EVENT_ACTION_MAP = {
         "record.bounced": Record,
@@ -57,9 +86,34 @@ class Event(models.Model):
     raw = models.JSONField(
         help_text=_("The raw JSON returned from the API."), blank=True, null=True
     )
+    state = models.CharField(
+        max_length=10,
+        choices=EventState.choices,
+        default=EventState.PROCESSED,
+        help_text=_("Deferred events are pending until processed by the worker."),
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, help_text=_("The number of attempts made to process the event.")
+    )
+    last_error = models.TextField(
+        blank=True, help_text=_("The error raised by the last failed attempt.")
+    )
+    next_attempt_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text=_("Failed attempts are retried after this time."),
+    )
+    processed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text=_("The timestamp when the event was processed."),
+    )
+
+    objects = EventQuerySet.as_manager()
 
     class Meta:
         ordering = ["completed_at"]
+        indexes = [models.Index(fields=["state", "next_attempt_at"])]
 
     def __str__(self) -> str:
         return "{} event occurred on {}.{}".format(
@@ -83,6 +137,16 @@ class Event(models.Model):
         """Return the underlying Record or Check resource."""
         return self._resource_manager().get(amiqus_id=self.amiqus_id)
 
+    def lock_resource(self) -> Record | Client:
+        """Return the resource, locked (SELECT ... FOR UPDATE) in the transaction."""
+        return (
+            self._resource_manager().select_for_update().get(amiqus_id=self.amiqus_id)
+        )
+
+    async def aresource(self) -> Record | Client:
+        """Async version of the resource property."""
+        return await self._resource_manager().aget(amiqus_id=self.amiqus_id)
+
     @property
     def user(self) -> UserType:
         """Return the user to whom the resource refers."""
@@ -97,5 +161,32 @@ class Event(models.Model):
         self.action = trigger["alias"]
         obj = data[entity_type]
         self.amiqus_id = obj["id"]
+        self.status = (
+            obj.get("status") or WEBHOOK_TRUSTED_ALIASES.get(self.action) or ""
+        )
         self.completed_at = date_parse(trigger["triggered_at"])
         return self
+
+    @property
+    def trusted(self) -> bool:
+        """Return True if the status can be applied without pulling the object."""
+        return self.action in WEBHOOK_TRUSTED_ALIASES and bool(self.status)
+
+    def mark_processed(self) -> None:
+        """Record that the event has been processed."""
+        self.state = Event.EventState.PROCESSED
+        self.attempts += 1
+        self.last_error = ""
+        self.next_attempt_at = None
+        self.processed_at = now()
+
+    def mark_failed(self, error: Exception, retry_in: float | None = None) -> None:
+        """Record a failed attempt - the event is retried if retry_in is set."""
+        self.attempts += 1
+        self.last_error = f"{error.__class__.__name__}: {error}"
+        if retry_in is None:
+            self.state = Event.EventState.FAILED
+            self.next_attempt_at = None
+        else:
+            self.state = Event.EventState.PENDING
+            self.next_attempt_at = now() + timedelta(seconds=retry_in)
@@ -1,17 +1,23 @@
 from __future__ import annotations
 
+import datetime
 import logging
+from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
 from dateutil.parser import parse as date_parse
 from django.conf import settings
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils.translation import gettext_lazy as _
 
-from .base import BaseQuerySet, BaseStatusModel
+from ..signals import on_completion, on_status_change, send_on_commit
+from .base import BaseModel, BaseQuerySet, BaseStatusModel, hash_raw
 
 if TYPE_CHECKING:
+    from .check import Check
     from .client import Client
+    from .form import Form
+    from .step import Step
 
 logger = logging.getLogger(__name__)
 
@@ -20,56 +26,176 @@ class RecordQuerySet(BaseQuerySet):
     """Record model manager."""
 
     def create_record(self, client: Client, raw: dict) -> Record:
-        """Create a new Record object and its related objects from the API response."""
+        """
+        Create a new Record object and its related objects from the API response.
+
+        The record, and its steps and their checks / forms, are created in a
+        single transaction - with one bulk insert per model.
+
+        """
         logger.debug("Creating new Amiqus record from JSON: %s", raw)
 
-        # Create the base record
-        perform_url = raw.get("perform_url") or ""
-        record = Record.objects.create(
-            user=client.user,
-            client=client,
-            amiqus_id=raw["id"],
-            status=raw["status"],
-            created_at=date_parse(raw["created_at"]),
-            perform_url=perform_url,
-            raw=raw,
-        )
+        with transaction.atomic():
+            # Create the base record
+            perform_url = raw.get("perform_url") or ""
+            record = Record.objects.create(
+                user=client.user,
+                client=client,
+                amiqus_id=raw["id"],
+                status=raw["status"],
+                created_at=date_parse(raw["created_at"]),
+                perform_url=perform_url,
+                raw=raw,
+                raw_hash=hash_raw(raw),
+            )
 
-        # Create all related objects
-        self._create_steps_from_response(record, raw)
+            # Create all related objects
+            self._create_steps_from_response(record, raw)
 
         return record
 
     def _create_steps_from_response(self, record: Record, raw: dict) -> None:
         """Create Steps and their related Check/Form objects from API response."""
+        self._create_steps(record, raw.get("steps", []))
+
+    def _create_steps(
+        self,
+        record: Record,
+        steps_data: list,
+        checks_by_id: dict[str, Check] | None = None,
+        forms_by_id: dict[str, Form] | None = None,
+    ) -> list[Step]:
+        """
+        Bulk create Steps and their related Check/Form objects.
+
+        Each Check gets its status / updated_at from the step (see _check_state),
+        and its amiqus_id from the check - which may be expanded into an object.
+        Existing Checks / Forms (in checks_by_id / forms_by_id, by amiqus_id)
+        are linked to the new Steps instead of being created.
+
+        """
         from .check import Check
         from .form import Form
         from .step import Step
 
-        for step_data in raw.get("steps", []):
+        checks_by_id = checks_by_id or {}
+        forms_by_id = forms_by_id or {}
+        checks: list[Check] = []
+        forms: list[Form] = []
+        steps: list[Step] = []
+        for step_data in steps_data:
+            step = Step(amiqus_id=step_data["id"], record=record)
+            related_id = _related_id(step_data)
             if "check" in step_data.get("type"):
-                check = Check.objects.create(
-                    amiqus_id=step_data["check"],
+                if related_id in checks_by_id:
+                    step.amiqus_check = checks_by_id[related_id]
+                    steps.append(step)
+                    continue
+                status, updated_at = _check_state(step_data)
+                step.amiqus_check = Check(
+                    amiqus_id=related_id,
                     amiqus_record=record,
                     check_type=step_data["type"],
+                    status=status,
+                    updated_at=updated_at,
                     user=record.user,
                 )
-                Step.objects.create(
-                    amiqus_id=step_data["id"],
-                    amiqus_check=check,
-                    record=record,
-                )
+                # the related objects have been validated already
+                step.amiqus_check.clean_fields(exclude=["amiqus_record", "user"])
+                checks.append(step.amiqus_check)
             elif "form" in step_data.get("type"):
-                form = Form.objects.create(
-                    amiqus_id=step_data["form"],
+                if related_id in forms_by_id:
+                    step.form = forms_by_id[related_id]
+                    steps.append(step)
+                    continue
+                step.form = Form(
+                    amiqus_id=related_id,
                     record=record,
                     user=record.user,
                 )
-                Step.objects.create(
-                    amiqus_id=step_data["id"],
-                    form=form,
-                    record=record,
-                )
+                step.form.clean_fields(exclude=["record", "user"])
+                forms.append(step.form)
+            else:
+                continue
+            steps.append(step)
+
+        _bulk_create(Check, checks)
+        _bulk_create(Form, forms)
+        # the steps pick up the primary keys of their checks / forms
+        return Step.objects.bulk_create(steps)
+
+
+def _bulk_create(model: type[BaseModel], objs: list) -> None:
+    """Bulk insert objects, setting their primary keys."""
+    model.objects.bulk_create(objs)
+    if not objs or connection.features.can_return_rows_from_bulk_insert:
+        return
+    # the backend does not return primary keys from bulk inserts (e.g. MySQL)
+    pks = dict(
+        model.objects.filter(amiqus_id__in=[obj.amiqus_id for obj in objs]).values_list(
+            "amiqus_id", "pk"
+        )
+    )
+    for obj in objs:
+        obj.pk = pks[str(obj.amiqus_id)]
+
+
+@dataclass
+class SyncSummary:
+    """The outcome of syncing the steps of a record with the API response."""
+
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
+def _related_id(step_data: dict) -> str | None:
+    """Return the amiqus_id of the Check / Form of a step in a record response."""
+    related = step_data.get("check") or step_data.get("form")
+    if isinstance(related, dict):
+        related = related.get("id")
+    return None if related is None else str(related)
+
+
+def _check_state(step_data: dict) -> tuple[str | None, datetime.datetime | None]:
+    """
+    Return the check status / updated_at from a step in a record response.
+
+    The check may be expanded into an object, or just be its id - in which
+    case the status is taken from the step (if it has one), and updated_at
+    from when the step was completed.
+
+    """
+    check = step_data.get("check")
+    check = check if isinstance(check, dict) else {}
+    status = check.get("status") or step_data.get("status")
+    updated_at = check.get("updated_at") or step_data.get("completed_at")
+    return status, date_parse(updated_at) if updated_at else None
+
+
+def _update_checks(
+    steps: list[Step], steps_data: dict[str, dict]
+) -> list[tuple[Check, str | None]]:
+    """
+    Bulk update the status / updated_at of the Checks of Steps from the JSON.
+
+    Returns each Check that has changed, with its previous status.
+
+    """
+    from .check import Check
+
+    changed: list[tuple[Check, str | None]] = []
+    for step in steps:
+        if (check := step.amiqus_check) is None:
+            continue
+        old_status, old_updated_at = check.status, check.updated_at
+        status, updated_at = _check_state(steps_data[str(step.amiqus_id)])
+        check.status = status or check.status
+        check.updated_at = updated_at or check.updated_at
+        if (check.status, check.updated_at) != (old_status, old_updated_at):
+            changed.append((check, old_status))
+    Check.objects.bulk_update([check for check, _ in changed], ["status", "updated_at"])
+    return changed
 
 
 class Record(BaseStatusModel):
@@ -135,3 +261,141 @@ class Record(BaseStatusModel):
         return (
             f"<Record amiqus_id={self.amiqus_id} id={self.id} user_id={self.user_id}>"
         )
+
+    def sync(self) -> SyncSummary:
+        """Pull the record from the API, and sync its steps - see sync_steps."""
+        self.pull()
+        return self.sync_steps()
+
+    def sync_steps(self) -> SyncSummary:
+        """
+        Sync the Steps, and their Checks / Forms, with the record's raw JSON.
+
+        The steps in the JSON are matched to the existing Steps by amiqus_id -
+        or, for Steps created before they had one, by the amiqus_id of their
+        Check / Form. Missing steps are deleted and new ones created (linked
+        to any existing Check / Form with the same amiqus_id), and the status
+        / updated_at of each Check is set from its step - all in bulk, in one
+        transaction. The on_status_change signal (event "record.synced") is
+        sent for each Check whose status has changed (including new Checks
+        that have a status), once the transaction has been committed.
+
+        Reviews are not included in the record JSON, and are not synced.
+
+        """
+        from .check import Check
+
+        steps_data = {
+            str(step["id"]): step for step in (self.raw or {}).get("steps", [])
+        }
+        summary = SyncSummary()
+        with transaction.atomic():
+            existing, removed = self._match_steps(steps_data)
+            new = [data for pk, data in steps_data.items() if pk not in existing]
+            # the checks / forms of new steps may already exist (e.g. if the
+            # step has been replaced), in which case they are kept
+            new_ids = {_related_id(data) for data in new} - {None}
+            self._delete_steps(removed, keep=new_ids)
+            summary.deleted = len(removed)
+            checks_by_id, forms_by_id = self._unlinked(new_ids)
+            created = Record.objects.all()._create_steps(
+                self, new, checks_by_id, forms_by_id
+            )
+            summary.created = len(created)
+
+            relinked_pks = {check.pk for check in checks_by_id.values()}
+            relinked = [s for s in created if s.amiqus_check_id in relinked_pks]
+            changed = _update_checks([*existing.values(), *relinked], steps_data)
+            summary.updated = len(changed)
+            # new checks are created with their state
+            changed += [
+                (s.amiqus_check, None)
+                for s in created
+                if s not in relinked and s.amiqus_check and s.amiqus_check.status
+            ]
+            for check, old_status in changed:
+                if check.status == old_status:
+                    continue
+                send_on_commit(
+                    on_status_change,
+                    Check,
+                    instance=check,
+                    event="record.synced",
+                    status_before=old_status,
+                    status_after=check.status,
+                )
+                if check.status == Check.CheckStatus.ACCEPTED.value:  # type: ignore[attr-defined]
+                    send_on_commit(on_completion, Check, instance=check)
+        logger.debug("Synced steps of %r: %s", self, summary)
+        return summary
+
+    def _match_steps(
+        self, steps_data: dict[str, dict]
+    ) -> tuple[dict[str, Step], list[Step]]:
+        """
+        Match the existing Steps to the steps in the JSON, by amiqus_id.
+
+        Steps created before they had an amiqus_id are matched by the
+        amiqus_id of their Check / Form, and their amiqus_id is set. Returns
+        the matched Steps (by amiqus_id), and those that are not in the JSON.
+
+        """
+        from .step import Step
+
+        existing: dict[str, Step] = {}
+        legacy: list[Step] = []
+        for step in self.steps.select_related("amiqus_check", "form"):
+            if step.amiqus_id is None:
+                legacy.append(step)
+            else:
+                existing[step.amiqus_id] = step
+        removed = [s for pk, s in existing.items() if pk not in steps_data]
+        existing = {pk: s for pk, s in existing.items() if pk in steps_data}
+        unmatched = {
+            _related_id(data): pk
+            for pk, data in steps_data.items()
+            if pk not in existing
+        }
+        for step in legacy:
+            related = step.amiqus_check or step.form
+            pk = unmatched.pop(related.amiqus_id, None) if related else None
+            if pk is None:
+                removed.append(step)
+            else:
+                step.amiqus_id = pk
+                existing[pk] = step
+        Step.objects.bulk_update(
+            [step for step in legacy if step.amiqus_id is not None], ["amiqus_id"]
+        )
+        return existing, removed
+
+    def _delete_steps(self, steps: list[Step], keep: set) -> None:
+        """Delete Steps, and their Checks / Forms unless their amiqus_id is in keep."""
+        from .check import Check
+        from .form import Form
+
+        if not steps:
+            return
+        self.steps.filter(pk__in=[s.pk for s in steps]).delete()
+        Check.objects.filter(
+            pk__in=[s.amiqus_check_id for s in steps if s.amiqus_check_id]
+        ).exclude(amiqus_id__in=keep).delete()
+        Form.objects.filter(pk__in=[s.form_id for s in steps if s.form_id]).exclude(
+            amiqus_id__in=keep
+        ).delete()
+
+    def _unlinked(self, ids: set) -> tuple[dict[str, Check], dict[str, Form]]:
+        """Return this record's Checks / Forms (by amiqus_id) that have no Step."""
+        from .check import Check
+        from .form import Form
+
+        if not ids:
+            return {}, {}
+        return (
+            Check.objects.filter(
+                amiqus_record=self, amiqus_id__in=ids, step__isnull=True
+            ).in_bulk(field_name="amiqus_id"),
+            Form.objects.filter(
+                record=self, amiqus_id__in=ids, step__isnull=True
+            ).in_bulk(field_name="amiqus_id"),
+        )
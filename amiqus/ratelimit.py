@@ -0,0 +1,119 @@
+"""
+Client-side rate limiting of outgoing API requests.
+
+The Amiqus API enforces a request quota - bulk operations that exceed it
+just get 429 responses, so we limit our own request rate instead. The
+limit can be shared by all processes through a Django cache.
+
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter.
+
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens
+    per second. Each request takes a token - if the bucket is empty the
+    token is reserved (the bucket goes into deficit) and the caller waits
+    until it would have been refilled, so concurrent callers are queued
+    rather than all retrying at once.
+
+    If `cache_alias` is set, the bucket is stored in that Django cache, so
+    that the limit is shared by every process that uses the same cache (it
+    must be a cache shared between processes - e.g. Redis or Memcached).
+    Otherwise the bucket is local to this process.
+
+    """
+
+    # how long the shared lock may be held before it expires (seconds)
+    lock_timeout = 1
+    # how long to wait between attempts to take the shared lock (seconds)
+    lock_interval = 0.005
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        *,
+        cache_alias: str | None = None,
+        key: str = "amiqus:ratelimit",
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("Rate limit must be greater than zero.")
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.cache_alias = cache_alias
+        self.key = key
+        self._lock = threading.Lock()
+        self._state = (float(self.burst), time.time())
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the bucket lock - shared between processes if using a cache."""
+        with self._lock:
+            if self.cache_alias is None:
+                yield
+                return
+            cache = caches[self.cache_alias]
+            lock_key = f"{self.key}:lock"
+            while not cache.add(lock_key, 1, timeout=self.lock_timeout):
+                time.sleep(self.lock_interval)
+            try:
+                yield
+            finally:
+                cache.delete(lock_key)
+
+    def _load(self) -> tuple[float, float]:
+        if self.cache_alias is None:
+            return self._state
+        return caches[self.cache_alias].get(self.key) or (
+            float(self.burst),
+            time.time(),
+        )
+
+    def _save(self, state: tuple[float, float]) -> None:
+        if self.cache_alias is None:
+            self._state = state
+        else:
+            # expire once the bucket would have refilled - it's full again
+            timeout = int(self.burst / self.rate) + 60
+            caches[self.cache_alias].set(self.key, state, timeout=timeout)
+
+    def reserve(self) -> float:
+        """Take a token and return the number of seconds to wait before using it."""
+        with self._locked():
+            tokens, updated = self._load()
+            now = time.time()
+            tokens = min(self.burst, tokens + (now - updated) * self.rate) - 1
+            self._save((tokens, now))
+        return max(0.0, -tokens / self.rate)
+
+    def record_wait(self, delay: float) -> None:
+        """Update the metrics for a request that has waited for a token."""
+        metrics.incr("ratelimit.requests")
+        if delay > 0:
+            logger.debug("Amiqus API rate limit reached, waiting %.2fs", delay)
+            metrics.incr("ratelimit.waits")
+            metrics.incr("ratelimit.wait_seconds", delay)
+
+    def acquire(self) -> float:
+        """Wait for a token and return the number of seconds waited."""
+        delay = self.reserve()
+        self.record_wait(delay)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
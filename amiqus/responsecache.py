@@ -0,0 +1,105 @@
+"""
+Read-through cache of API GET responses.
+
+The same resource is often fetched several times within a few seconds -
+by a webhook, by someone clicking through the admin site, and to display
+it. Caching the responses for a short time saves the duplicate requests.
+
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def resource_type(href: str) -> str:
+    """
+    Return the type of resource an href refers to.
+
+    This is the name of the last collection in the path - e.g. "records"
+    for "records/123", and "reviews" for "records/123/steps/4/reviews".
+
+    """
+    parts = href.strip("/").split("/")
+    return parts[-1] if len(parts) % 2 else parts[-2]
+
+
+class ResponseCache:
+    """
+    Cache of API responses, stored in a Django cache.
+
+    Responses are cached per href, for the TTL (in seconds) configured for
+    the type of resource - resource types without a TTL are not cached.
+    Entries are invalidated when the same href is changed with a POST /
+    PATCH request, or when a webhook reports that the resource has changed.
+
+    """
+
+    def __init__(
+        self,
+        ttls: dict[str, int],
+        *,
+        cache_alias: str = "default",
+        prefix: str = "amiqus:response",
+    ) -> None:
+        self.ttls = ttls
+        self.cache_alias = cache_alias
+        self.prefix = prefix
+
+    @property
+    def _cache(self) -> BaseCache:
+        return caches[self.cache_alias]
+
+    def key(self, href: str) -> str:
+        """Return the cache key for an href."""
+        return f"{self.prefix}:{href.strip('/')}"
+
+    def ttl(self, href: str) -> int:
+        """Return the TTL for an href - 0 if it should not be cached."""
+        return self.ttls.get(resource_type(href), 0)
+
+    def _record(self, href: str, value: Any) -> Any:
+        if value is None:
+            metrics.incr("responsecache.misses")
+        else:
+            logger.debug("Amiqus API response cache hit: %s", href)
+            metrics.incr("responsecache.hits")
+        return value
+
+    def get(self, href: str) -> Any:
+        """Return the cached response for an href, or None."""
+        if not self.ttl(href):
+            return None
+        return self._record(href, self._cache.get(self.key(href)))
+
+    def set(self, href: str, value: Any) -> None:
+        """Cache the response for an href."""
+        if ttl := self.ttl(href):
+            self._cache.set(self.key(href), value, timeout=ttl)
+
+    def invalidate(self, href: str) -> None:
+        """Remove the cached response for an href."""
+        self._cache.delete(self.key(href))
+
+    async def aget(self, href: str) -> Any:
+        """Async version of get()."""
+        if not self.ttl(href):
+            return None
+        return self._record(href, await self._cache.aget(self.key(href)))
+
+    async def aset(self, href: str, value: Any) -> None:
+        """Async version of set()."""
+        if ttl := self.ttl(href):
+            await self._cache.aset(self.key(href), value, timeout=ttl)
+
+    async def ainvalidate(self, href: str) -> None:
+        """Async version of invalidate()."""
+        await self._cache.adelete(self.key(href))
@@ -10,6 +10,9 @@ def _setting(key, default):
         return getenv(key, default)
 
 
+# The API HTTP root url - can be pointed at amiqus.fakeapi for load testing
+API_ROOT = _setting("AMIQUS_API_ROOT", "https://id.amiqus.co/api/v2/")
+
 # API key from environment by default
 API_KEY = _setting("AMIQUS_ACCESS_TOKEN", None)
 
@@ -23,6 +26,40 @@ WEBHOOK_SECURITY_TOKEN = (
 # Set to False to turn off event logging
 LOG_EVENTS = _setting("AMIQUS_LOG_EVENTS", True)
 
+# Set to True to store webhooks and return immediately, leaving them to be
+# processed by the amiqus_process_events worker. Events that fail are retried
+# up to AMIQUS_WEBHOOK_MAX_ATTEMPTS times, with exponential backoff starting
+# at AMIQUS_WEBHOOK_RETRY_BACKOFF seconds.
+DEFER_WEBHOOKS = _setting("AMIQUS_DEFER_WEBHOOKS", False)
+WEBHOOK_MAX_ATTEMPTS = int(_setting("AMIQUS_WEBHOOK_MAX_ATTEMPTS", 5))
+WEBHOOK_RETRY_BACKOFF = float(_setting("AMIQUS_WEBHOOK_RETRY_BACKOFF", 30))
+# Events claimed by a worker are marked as processing - if they have not been
+# processed after this many seconds (e.g. the worker was killed), they are
+# claimed again.
+WEBHOOK_CLAIM_TIMEOUT = float(_setting("AMIQUS_WEBHOOK_CLAIM_TIMEOUT", 300))
+
+# Deferred events are held for this many seconds before they are processed,
+# and all the pending events for the same resource are then processed as one
+# - so a burst of webhooks for a record results in a single pull / save.
+# Disabled by default (0).
+WEBHOOK_COALESCE_WINDOW = float(_setting("AMIQUS_WEBHOOK_COALESCE_WINDOW", 0))
+
+# Webhook aliases whose status is trusted - the object is updated and the
+# signals fired without first pulling it from the API. Maps each alias to the
+# status it implies, which is used if the webhook body does not include one
+# (e.g. {"record.finished": "pending"}). Events without a status are pulled
+# as usual. If AMIQUS_WEBHOOK_RECONCILE is set, the objects are pulled later
+# by the amiqus_process_events worker - otherwise they are not pulled at all.
+# This also applies to objects that could not be pulled when an event was
+# processed (e.g. because the API was unavailable).
+WEBHOOK_TRUSTED_ALIASES = _setting("AMIQUS_WEBHOOK_TRUSTED_ALIASES", {})
+if isinstance(WEBHOOK_TRUSTED_ALIASES, str):
+    # e.g. "record.finished=pending,client.status"
+    WEBHOOK_TRUSTED_ALIASES = dict(
+        alias.partition("=")[::2] for alias in WEBHOOK_TRUSTED_ALIASES.split(",")
+    )
+WEBHOOK_RECONCILE = _setting("AMIQUS_WEBHOOK_RECONCILE", True)
+
 # Set to True to bypass request verification (NOT RECOMMENDED)
 TEST_MODE = _setting("AMIQUS_TEST_MODE", True)
 
@@ -47,3 +84,81 @@ scrub_client_data = (
 )
 
 DEFAULT_REQUESTS_TIMEOUT = _setting("DEFAULT_REQUESTS_TIMEOUT", 30)
+
+# Connection pooling for API requests - the number of pooled hosts, and the
+# maximum number of keep-alive connections kept open per host.
+POOL_CONNECTIONS = int(_setting("AMIQUS_POOL_CONNECTIONS", 1))
+POOL_MAXSIZE = int(_setting("AMIQUS_POOL_MAXSIZE", 10))
+
+# Set to True to open a pooled connection to the API when the app is loaded.
+# Do not enable this if the app is loaded before the server forks workers
+# (e.g. gunicorn --preload), as the open socket would be shared by all of them.
+WARM_UP_SESSION = _setting("AMIQUS_WARM_UP_SESSION", False)
+
+# Maximum number of concurrent connections made by the async client (amiqus.aio)
+ASYNC_MAX_CONNECTIONS = int(_setting("AMIQUS_ASYNC_MAX_CONNECTIONS", 100))
+
+# Maximum number of concurrent requests made to fetch the reviews for the
+# steps of a record (when a record.reviewed webhook is received)
+REVIEW_FETCH_CONCURRENCY = int(_setting("AMIQUS_REVIEW_FETCH_CONCURRENCY", 4))
+
+# Retry policy for idempotent (GET/PATCH) API requests. Failed requests are
+# retried with jittered exponential backoff (or after the Retry-After period
+# if one is returned), up to a maximum number of attempts and a total
+# deadline in seconds. Set AMIQUS_RETRY_MAX_ATTEMPTS to 1 to disable retries.
+RETRY_MAX_ATTEMPTS = int(_setting("AMIQUS_RETRY_MAX_ATTEMPTS", 3))
+RETRY_BACKOFF = float(_setting("AMIQUS_RETRY_BACKOFF", 0.5))
+RETRY_BACKOFF_MAX = float(_setting("AMIQUS_RETRY_BACKOFF_MAX", 10))
+RETRY_DEADLINE = float(_setting("AMIQUS_RETRY_DEADLINE", 60))
+RETRY_STATUS_CODES = _setting("AMIQUS_RETRY_STATUS_CODES", (429, 502, 503, 504))
+if isinstance(RETRY_STATUS_CODES, str):
+    RETRY_STATUS_CODES = tuple(int(c) for c in RETRY_STATUS_CODES.split(","))
+
+# Client-side rate limit for API requests, in requests per second, and the
+# number of requests that may be made in a burst. Set AMIQUS_RATE_LIMIT_CACHE
+# to the alias of a Django cache that is shared between processes to share
+# the limit between all of them. Disabled by default (0).
+RATE_LIMIT = float(_setting("AMIQUS_RATE_LIMIT", 0))
+RATE_LIMIT_BURST = int(_setting("AMIQUS_RATE_LIMIT_BURST", 10))
+RATE_LIMIT_CACHE = _setting("AMIQUS_RATE_LIMIT_CACHE", None)
+
+# Circuit breaker for API requests. After AMIQUS_CIRCUIT_BREAKER_THRESHOLD
+# consecutive failures (connection errors, timeouts and 5xx responses),
+# requests fail immediately for AMIQUS_CIRCUIT_BREAKER_RESET_TIMEOUT seconds,
+# after which a single request is let through to see if the API has recovered.
+# The state is kept in the AMIQUS_CIRCUIT_BREAKER_CACHE Django cache, so all
+# processes sharing that cache trip together. Disabled by default (0).
+CIRCUIT_BREAKER_THRESHOLD = int(_setting("AMIQUS_CIRCUIT_BREAKER_THRESHOLD", 0))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    _setting("AMIQUS_CIRCUIT_BREAKER_RESET_TIMEOUT", 30)
+)
+CIRCUIT_BREAKER_CACHE = _setting("AMIQUS_CIRCUIT_BREAKER_CACHE", "default")
+
+# Read-through cache for API GET responses, stored in the Django cache
+# AMIQUS_RESPONSE_CACHE. AMIQUS_RESPONSE_CACHE_TTLS maps resource types to
+# the number of seconds to cache them for - e.g. {"records": 10, "reviews": 60}.
+# Resource types that are not listed are not cached. Disabled by default.
+RESPONSE_CACHE = _setting("AMIQUS_RESPONSE_CACHE", "default")
+RESPONSE_CACHE_TTLS = _setting("AMIQUS_RESPONSE_CACHE_TTLS", {})
+
+# Coalesce concurrent GET requests for the same resource into one request.
+# Set AMIQUS_SINGLE_FLIGHT_CACHE to the alias of a Django cache shared between
+# processes to also coalesce requests made by different processes, waiting up
+# to AMIQUS_SINGLE_FLIGHT_TIMEOUT seconds for the result.
+SINGLE_FLIGHT = _setting("AMIQUS_SINGLE_FLIGHT", True)
+SINGLE_FLIGHT_CACHE = _setting("AMIQUS_SINGLE_FLIGHT_CACHE", None)
+SINGLE_FLIGHT_TIMEOUT = float(_setting("AMIQUS_SINGLE_FLIGHT_TIMEOUT", 5))
+
+# API requests that take longer than this many seconds are logged as a warning
+SLOW_REQUEST_THRESHOLD = float(_setting("AMIQUS_SLOW_REQUEST_THRESHOLD", 5))
+
+# JSON codec used for webhook bodies and API requests / responses - "orjson"
+# or "json" (the stdlib). By default orjson is used if it is installed.
+JSON_CODEC = _setting("AMIQUS_JSON_CODEC", None)
+
+# De-duplicate webhook deliveries - Amiqus retries deliveries, so the same
+# event may be received more than once. Deliveries are remembered in the
+# AMIQUS_WEBHOOK_DEDUPLICATION_CACHE Django cache for this many seconds, and
+# duplicates are acknowledged without being processed. Disabled by default (0).
+WEBHOOK_DEDUPLICATION_TTL = int(_setting("AMIQUS_WEBHOOK_DEDUPLICATION_TTL", 0))
+WEBHOOK_DEDUPLICATION_CACHE = _setting("AMIQUS_WEBHOOK_DEDUPLICATION_CACHE", "default")
@@ -7,6 +7,9 @@ See https://developers.amiqus.co/guides/webhooks.html
 
 """
 
+from typing import Any
+
+from django.db import transaction
 from django.dispatch import Signal
 
 # fired after the status of a check /record is updated
@@ -23,3 +26,29 @@ on_completion = Signal()
 
 # Signal that will be sent when a record is reviewed
 record_reviewed = Signal()
+
+# Signals sent before and after every request made to the Amiqus API (by
+# amiqus.api or amiqus.aio, which is the sender). The path is templated, with
+# ids replaced - e.g. "records/{id}/steps/{id}/reviews" - so that it can be
+# used to aggregate metrics per endpoint. The status is None if no response
+# was received (the exception is passed instead), the duration (in seconds)
+# and the number of retries include all retries of the request, and the size
+# is the length of the response body in bytes.
+# providing_args=["method", "path"]
+api_request_started = Signal()
+# providing_args=[
+#     "method", "path", "status", "duration", "size", "retries", "exception"
+# ]
+api_request_finished = Signal()
+
+
+def send_on_commit(signal: Signal, sender: Any, **kwargs: Any) -> None:
+    """
+    Send a signal once the current transaction has been committed.
+
+    The status / review signals are sent like this, so that receivers see
+    the committed state - and are not sent at all if it is rolled back.
+    Outside of a transaction the signal is sent immediately.
+
+    """
+    transaction.on_commit(lambda: signal.send(sender, **kwargs))
@@ -0,0 +1,145 @@
+"""
+Coalescing of concurrent identical API requests.
+
+Amiqus often sends several webhooks for the same record within a few
+milliseconds, each of which pulls the record from the API. Rather than
+making the same request several times over, concurrent requests for the
+same resource share the response of the first one.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Awaitable
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into a single call.
+
+    The first caller for a key (the leader) makes the call, and any others
+    that arrive while it is in flight wait for, and share, its result - or
+    its exception. Callers that share a result get their own copy of it.
+
+    If `cache_alias` is set, calls are also coalesced across processes that
+    share that Django cache: the leader takes a short-lived lock in the
+    cache and stores its result there for the others to pick up. If the
+    leader fails, or takes longer than `timeout` seconds, the others go
+    ahead and make the call themselves.
+
+    NB a caller that arrives while a call is in flight gets its result,
+    even though the call was started (a few ms) before it arrived.
+
+    """
+
+    # how often to check for the result of a call in another process
+    poll_interval = 0.01
+
+    def __init__(self, *, cache_alias: str | None = None, timeout: float = 5) -> None:
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+        self._async_calls: dict[tuple[asyncio.AbstractEventLoop, str], Future] = {}
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        """Call func, or wait for the result of a call with the same key."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if future is None:
+                future = self._calls[key] = Future()
+        if not leader:
+            logger.debug("Sharing in-flight Amiqus API request: %s", key)
+            metrics.incr("singleflight.shared")
+            return copy.deepcopy(future.result())
+        try:
+            if self.cache_alias is None:
+                result = func()
+            else:
+                result = self._do_shared(self.cache_alias, key, func)
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    @staticmethod
+    def lock_key(key: str) -> str:
+        """
+        Return the shared cache key used to lock a call.
+
+        The key is hashed, as it may contain characters (e.g. the spaces in a
+        Last-Modified value) that some cache backends do not allow.
+
+        """
+        return f"amiqus:singleflight:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def _do_shared(self, cache_alias: str, key: str, func: Callable[[], Any]) -> Any:
+        """Call func, or wait for the result of a call in another process."""
+        cache = caches[cache_alias]
+        lock_key = self.lock_key(key)
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, timeout=self.timeout):
+            try:
+                result = func()
+                cache.set(f"{lock_key}:{token}", result, timeout=self.timeout)
+                return result
+            finally:
+                cache.delete(lock_key)
+        deadline = time.monotonic() + self.timeout
+        while (token := cache.get(lock_key)) and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            if (result := cache.get(f"{lock_key}:{token}")) is not None:
+                logger.debug("Sharing Amiqus API request from other process: %s", key)
+                metrics.incr("singleflight.shared")
+                return result
+        return func()
+
+    async def ado(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async version of do() - only coalesces calls within this process.
+
+        Calls are coalesced per event loop (there is normally only one).
+
+        """
+        loop_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            future = self._async_calls.get(loop_key)
+            leader = future is None
+            if future is None:
+                future = self._async_calls[loop_key] = Future()
+        if not leader:
+            logger.debug("Sharing in-flight Amiqus API request: %s", key)
+            metrics.incr("singleflight.shared")
+            return copy.deepcopy(await asyncio.wrap_future(future))
+        try:
+            result = await func()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._async_calls[loop_key]
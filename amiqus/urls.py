@@ -1,9 +1,10 @@
 from django.urls import path
 
-from .views import status_update
+from .views import async_status_update, status_update
 
 app_name = "amiqus"
 
 urlpatterns = [
     path("webhook/", status_update, name="status_update"),
+    path("webhook/async/", async_status_update, name="async_status_update"),
 ]
@@ -2,49 +2,126 @@
 Amiqus webhook handler.
 
 The Amiqus API will send a webhook to the configured URL when an event
-occurs, which we then use to update the relevant object.
+occurs, which we then use to update the relevant object. If DEFER_WEBHOOKS
+is set, the event is stored and processed later by the worker instead (see
+amiqus.worker).
+
+async_status_update is an async version of the view, for use under ASGI,
+which updates the object using the async ORM and amiqus.aio.
+
+If AMIQUS_WEBHOOK_DEDUPLICATION_TTL is set, deliveries of the same event are
+acknowledged without being processed again (see amiqus.deduplication).
 
 """
 
 from __future__ import annotations
 
-import json
 import logging
 
+from django.db import transaction
 from django.http import HttpRequest, HttpResponse
 from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 
+from . import codec
+from .deduplication import WebhookDeduplicator
 from .decorators import verify_signature
 from .models import Client, Event, Record
-from .settings import LOG_EVENTS
-from .signals import record_reviewed
+from .settings import (
+    DEFER_WEBHOOKS,
+    LOG_EVENTS,
+    WEBHOOK_DEDUPLICATION_CACHE,
+    WEBHOOK_DEDUPLICATION_TTL,
+)
+from .signals import record_reviewed, send_on_commit
 from .helpers import create_or_update_reviews
 
 logger = logging.getLogger(__name__)
 
+# used to acknowledge duplicate deliveries - None if it is disabled
+DEDUPLICATOR = (
+    WebhookDeduplicator(
+        WEBHOOK_DEDUPLICATION_TTL, cache_alias=WEBHOOK_DEDUPLICATION_CACHE
+    )
+    if WEBHOOK_DEDUPLICATION_TTL
+    else None
+)
 
-@csrf_exempt
-@verify_signature()
-def status_update(request: HttpRequest) -> HttpResponse:  # noqa: C901
+
+def process_events(events: list[Event]) -> Record | Client:
     """
-    Handle event callbacks from the API.
+    Update the resource of one or more parsed events, and send the signals.
 
-    This is the request handler which does little other than log the
-    request and call the _webhook function which does the processing.
-    Done like this to make it easier to test without having to set up
-    request objects.
+    The events must all be for the same resource. They are applied as a
+    single status transition - from the status before the first, to that of
+    the newest - with one pull and save, and one record_reviewed signal (for
+    the newest record.reviewed event) if any of them is a record.reviewed.
+    If the newest event is stale (see BaseStatusModel.update_status), the
+    events are dropped without fetching reviews or sending record_reviewed.
 
-    NB This view function will always return a 200 status - in order to
-    prevent Amiqus from endlessly retrying. The only exceptions to this
-    are caused by the verify_signature decorator - if it cannot verify
-    the callback, then it will return a 403 - which should be ok, as if
-    Amiqus sends the request it should never fail...
+    The resource row is locked for the duration, so that concurrent updates
+    to it are applied one after the other, and the signals are sent once the
+    transaction has been committed.
 
     """
+    event = max(events, key=lambda e: e.completed_at)
+    with transaction.atomic():
+        # serialises concurrent updates to the same resource
+        resource = event.lock_resource()
+        resource.update_status(event)
+        if resource.stale:
+            return resource
+
+        # Send signal for record.reviewed events
+        if reviewed := [e for e in events if e.action == "record.reviewed"]:
+            event = max(reviewed, key=lambda e: e.completed_at)
+            logger.debug("Sending record_reviewed signal for record %s", resource.id)
+            create_or_update_reviews(event, record=resource)
+            send_on_commit(
+                record_reviewed,
+                sender=resource.__class__,
+                record=resource,
+                event=event,
+                data=event.raw,
+            )
+    return resource
+
+
+def process_event(event: Event) -> Record | Client:
+    """Update the resource of a parsed event, and send the signals."""
+    return process_events([event])
+
+
+def _error_response(event: Event, ex: Exception) -> HttpResponse:
+    """Log an error processing an event, and return the webhook response."""
+    if isinstance(ex, KeyError):
+        logger.exception("Missing Amiqus event content.", exc_info=ex)
+        return HttpResponse("Unexpected event content.")
+    if isinstance(ex, ValueError):
+        logger.exception("Unknown Amiqus resource type: %s", event.resource_type)
+        return HttpResponse("Unknown resource type.")
+    if isinstance(ex, Record.DoesNotExist):
+        # TODO(source-of-truth) Create Record when *new* request is spawned from Amiqus
+        # Missing Records can be synchronised as we utilise a reference shared
+        # between the user, and Amiqus itself.
+        logger.exception("Amiqus record does not exist: %s", event.amiqus_id)
+        # 1. Get Record from API.
+        # 2. Get Client attached to Record
+        # 3. Use their reference to match with a user on system
+        # 4. Create record as normal
+        return HttpResponse("Record not found.")
+    if isinstance(ex, Client.DoesNotExist):
+        logger.warning("Amiqus client does not exist: %s", event.amiqus_id)
+        return HttpResponse("Client not found.")
+    logger.exception("Amiqus update could not be processed.")
+    return HttpResponse("Unknown error.")
+
+
+def _parse_webhook(request: HttpRequest) -> Event | HttpResponse:
+    """Parse the webhook into an (unsaved) Event, or return the error response."""
     received_at = now()
     logger.debug("Received Amiqus callback: %s", request.body)
-    if not (data := json.loads(request.body)):
+    if not (data := codec.loads(request.body)):
         logger.exception("Received empty Amiqus webhook body.")
         return HttpResponse("Empty webhook.")
     try:
@@ -59,41 +136,80 @@ def status_update(request: HttpRequest) -> HttpResponse:  # noqa: C901
         logger.error("Invalid entity_type: %s", entity_type)
         return HttpResponse("Invalid event trigger.")
     event = Event(received_at=received_at)
+    try:
+        event = event.parse(data, entity_type=entity_type)
+    except Exception as ex:  # noqa: B902
+        return _error_response(event, ex)
+    if DEFER_WEBHOOKS:
+        event.state = Event.EventState.PENDING
+    return event
+
+
+@csrf_exempt
+@verify_signature()
+def status_update(request: HttpRequest) -> HttpResponse:
+    """
+    Handle event callbacks from the API.
+
+    This is the request handler which does little other than log the
+    request and call the _webhook function which does the processing.
+    Done like this to make it easier to test without having to set up
+    request objects.
 
+    NB This view function will always return a 200 status - in order to
+    prevent Amiqus from endlessly retrying. The only exceptions to this
+    are caused by the verify_signature decorator - if it cannot verify
+    the callback, then it will return a 403 - which should be ok, as if
+    Amiqus sends the request it should never fail...
+
+    """
+    if isinstance(event := _parse_webhook(request), HttpResponse):
+        return event
+    if DEDUPLICATOR and not DEDUPLICATOR.claim(event):
+        return HttpResponse("Duplicate webhook.")
     try:
-        resource = event.parse(data, entity_type=entity_type).resource
-        resource.update_status(event)
+        if DEFER_WEBHOOKS:
+            event.save()
+            return HttpResponse("Update queued.")
+        with transaction.atomic():
+            process_event(event)
+            if LOG_EVENTS:
+                event.save()
+        return HttpResponse("Update processed.")
+    except Exception as ex:  # noqa: B902
+        if DEDUPLICATOR:
+            DEDUPLICATOR.release(event)
+        return _error_response(event, ex)
 
-        # Send signal for record.reviewed events
-        if alias == "record.reviewed":
-            logger.debug("Sending record_reviewed signal for record %s", resource.id)
-            create_or_update_reviews(event)
-            record_reviewed.send(
-                sender=resource.__class__, record=resource, event=event, data=data
-            )
 
+@csrf_exempt
+@verify_signature()
+async def async_status_update(request: HttpRequest) -> HttpResponse:
+    """
+    Async version of status_update - requires the optional httpx dependency.
+
+    Under ASGI, status_update runs in the thread-sensitive executor, which
+    serialises the processing of concurrent webhooks. This view updates the
+    object using the async ORM and amiqus.aio instead, so that many webhooks
+    can be processed concurrently.
+
+    """
+    # prevents importing httpx unless the view is used
+    from .aio import process_event as aprocess_event
+
+    if isinstance(event := _parse_webhook(request), HttpResponse):
+        return event
+    if DEDUPLICATOR and not await DEDUPLICATOR.aclaim(event):
+        return HttpResponse("Duplicate webhook.")
+    try:
+        if DEFER_WEBHOOKS:
+            await event.asave()
+            return HttpResponse("Update queued.")
+        await aprocess_event(event)
         if LOG_EVENTS:
-            event.save()
+            await event.asave()
         return HttpResponse("Update processed.")
-    except KeyError as ex:
-        logger.exception("Missing Amiqus event content.", exc_info=ex)
-        return HttpResponse("Unexpected event content.")
-    except ValueError:
-        logger.exception("Unknown Amiqus resource type: %s", event.resource_type)
-        return HttpResponse("Unknown resource type.")
-    except Record.DoesNotExist:
-        # TODO(source-of-truth) Create Record when *new* request is spawned from Amiqus
-        # Missing Records can be synchronised as we utilise a reference shared
-        # between the user, and Amiqus itself.
-        logger.exception("Amiqus record does not exist: %s", event.amiqus_id)
-        # 1. Get Record from API.
-        # 2. Get Client attached to Record
-        # 3. Use their reference to match with a user on system
-        # 4. Create record as normal
-        return HttpResponse("Record not found.")
-    except Client.DoesNotExist:
-        logger.warning("Amiqus client does not exist: %s", event.amiqus_id)
-        return HttpResponse("Client not found.")
-    except Exception:  # noqa: B902
-        logger.exception("Amiqus update could not be processed.")
-        return HttpResponse("Unknown error.")
+    except Exception as ex:  # noqa: B902
+        if DEDUPLICATOR:
+            await DEDUPLICATOR.arelease(event)
+        return _error_response(event, ex)
@@ -0,0 +1,234 @@
+"""
+Deferred webhook processing.
+
+If DEFER_WEBHOOKS is set, the webhook view stores each event as pending
+and returns immediately. The amiqus_process_events management command
+then claims pending events in batches - using SELECT ... FOR UPDATE SKIP
+LOCKED, so that any number of workers can run at once - and processes
+them with the same logic as the view. A batch is claimed in a short
+transaction that marks its events as processing, and then each event (or
+group of events) is processed in its own transaction - so the resources
+are only locked, and the signals delayed, while that event is processed.
+Claims expire after WEBHOOK_CLAIM_TIMEOUT, in case the worker dies.
+
+Events that fail because the resource does not exist, or the event is
+malformed, are marked as failed immediately. Other errors (e.g. the
+reviews of a record not being fetched) are retried with exponential
+backoff, up to WEBHOOK_MAX_ATTEMPTS times. If an object cannot be pulled,
+the event still succeeds - the status from the event is saved, and the
+object is pulled later (see pull_requested).
+
+If WEBHOOK_COALESCE_WINDOW is set, events are held for that long, and then
+all of the pending events for a resource are processed together - as one
+status change, with a single pull and save of the resource.
+
+Objects updated from trusted webhooks (see WEBHOOK_TRUSTED_ALIASES) are
+not pulled when the event is processed - the worker pulls them afterwards.
+
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from . import metrics
+from .models import Check, Client, Event, Record
+from .models.base import BaseModel
+from .settings import (
+    LOG_EVENTS,
+    WEBHOOK_CLAIM_TIMEOUT,
+    WEBHOOK_COALESCE_WINDOW,
+    WEBHOOK_MAX_ATTEMPTS,
+    WEBHOOK_RETRY_BACKOFF,
+)
+from .views import process_events
+
+logger = logging.getLogger(__name__)
+
+# errors that will not go away if the event is retried
+PERMANENT_ERRORS = (KeyError, ValueError, Record.DoesNotExist, Client.DoesNotExist)
+
+
+def _retry_in(event: Event, error: Exception) -> float | None:
+    """Return the seconds to wait before retrying a failed event, if at all."""
+    attempt = event.attempts + 1
+    if isinstance(error, PERMANENT_ERRORS) or attempt >= WEBHOOK_MAX_ATTEMPTS:
+        return None
+    return WEBHOOK_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+
+def _mark_failed(event: Event, error: Exception) -> None:
+    """Record a failed attempt to process an event."""
+    retry_in = _retry_in(event, error)
+    event.mark_failed(error, retry_in)
+    event.save()
+    if retry_in is None:
+        logger.exception("Amiqus event %s failed: %s", event.pk, event.last_error)
+        metrics.incr("webhooks.failed")
+    else:
+        logger.warning(
+            "Amiqus event %s failed, retrying in %ss: %s",
+            event.pk,
+            retry_in,
+            event.last_error,
+        )
+        metrics.incr("webhooks.retried")
+
+
+def handle_events(events: list[Event]) -> bool:
+    """
+    Process claimed events for the same resource as one, and record the outcome.
+
+    Return True if they were processed. All of the events are logged (if
+    LOG_EVENTS is set) - but the resource is only updated once.
+
+    """
+    try:
+        with transaction.atomic():
+            process_events(events)
+    except Exception as ex:  # noqa: B902
+        for event in events:
+            _mark_failed(event, ex)
+        return False
+    for event in events:
+        event.mark_processed()
+        if LOG_EVENTS:
+            event.save()
+        else:
+            event.delete()
+    metrics.incr("webhooks.processed", len(events))
+    if len(events) > 1:
+        metrics.incr("webhooks.coalesced", len(events) - 1)
+    return True
+
+
+def handle_event(event: Event) -> bool:
+    """Process a claimed event, and record the outcome. Return True if processed."""
+    return handle_events([event])
+
+
+def _select_events(batch_size: int) -> list[Event]:
+    """
+    Select (and lock) a batch of pending events, oldest first.
+
+    If WEBHOOK_COALESCE_WINDOW is set, only events received at least that
+    long ago are selected - along with all of the other pending events for
+    the same resources, so that they can be processed together.
+
+    """
+    pending = Event.objects.pending().select_for_update(skip_locked=True)
+    if not WEBHOOK_COALESCE_WINDOW:
+        return list(pending.order_by("received_at")[:batch_size])
+    cutoff = now() - timedelta(seconds=WEBHOOK_COALESCE_WINDOW)
+    events = list(
+        pending.filter(received_at__lte=cutoff).order_by("received_at")[:batch_size]
+    )
+    if not events:
+        return events
+    resources = Q()
+    for event in events:
+        resources |= Q(resource_type=event.resource_type, amiqus_id=event.amiqus_id)
+    return events + list(
+        pending.filter(resources)
+        .exclude(pk__in=[event.pk for event in events])
+        .order_by("received_at")
+    )
+
+
+def _claim_events(batch_size: int) -> list[Event]:
+    """Claim a batch of pending events, marking them as processing."""
+    with transaction.atomic():
+        events = _select_events(batch_size)
+        Event.objects.filter(pk__in=[event.pk for event in events]).update(
+            state=Event.EventState.PROCESSING,
+            next_attempt_at=now() + timedelta(seconds=WEBHOOK_CLAIM_TIMEOUT),
+        )
+    return events
+
+
+def _group_events(events: list[Event]) -> list[list[Event]]:
+    """Group events by resource, in the order the resources were first seen."""
+    groups: dict[tuple[str, str], list[Event]] = {}
+    for event in events:
+        groups.setdefault((event.resource_type, event.amiqus_id), []).append(event)
+    return list(groups.values())
+
+
+def process_pending_events(batch_size: int = 50) -> int:
+    """Claim a batch of pending events and process them. Return the batch size."""
+    events = _claim_events(batch_size)
+    if WEBHOOK_COALESCE_WINDOW:
+        for group in _group_events(events):
+            handle_events(group)
+    else:
+        for event in events:
+            handle_event(event)
+    return len(events)
+
+
+def _claim_pulls(model: type[BaseModel], batch_size: int) -> list[int]:
+    """
+    Claim a batch of objects to pull, by moving their pull_requested_at on.
+
+    Objects that are not pulled successfully (which clears pull_requested_at)
+    are claimed again once the claim has expired, after WEBHOOK_CLAIM_TIMEOUT.
+
+    """
+    with transaction.atomic():
+        pks = list(
+            model.objects.filter(pull_requested_at__lte=now())
+            .select_for_update(skip_locked=True)
+            .order_by("pull_requested_at")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        model.objects.filter(pk__in=pks).update(
+            pull_requested_at=now() + timedelta(seconds=WEBHOOK_CLAIM_TIMEOUT)
+        )
+    return pks
+
+
+def pull_requested(batch_size: int = 50) -> int:
+    """
+    Pull a batch of objects that were updated from trusted webhooks.
+
+    The objects are claimed in a short transaction, and then pulled without
+    holding any locks. Returns the number of objects pulled - objects that
+    could not be pulled are retried once their claim has expired, so that
+    they do not hold up the others.
+
+    """
+    pulled = 0
+    for model in (Client, Record, Check):
+        if pks := _claim_pulls(model, batch_size):
+            # saves just the fetched fields, and only clears pull_requested_at
+            # if the object has not been marked again in the meantime
+            summary = model.objects.filter(pk__in=pks).pull(concurrency=1)
+            pulled += summary.succeeded
+    return pulled
+
+
+def run(batch_size: int = 50, poll_interval: float = 1, once: bool = False) -> int:
+    """
+    Process pending events until interrupted, and return the number processed.
+
+    Batches are processed back to back while there are pending events (or
+    objects to pull, see pull_requested), and the queue is polled every
+    poll_interval seconds when it is empty. If once is set, return as soon
+    as there are no pending events.
+
+    """
+    total = 0
+    while True:
+        count = process_pending_events(batch_size)
+        total += count
+        if pull_requested(batch_size) or count:
+            continue
+        if once:
+            return total
+        time.sleep(poll_interval)
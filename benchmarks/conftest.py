@@ -0,0 +1,77 @@
+"""
+Shared fixtures for the benchmarks.
+
+The benchmarks use pytest-benchmark, and are not run as part of the test
+suite - run them with `tox -e bench`, which saves each run in .benchmarks/.
+Pass `--benchmark-compare --benchmark-compare-fail=mean:20%` to compare a
+run with the last saved one, failing if any benchmark has regressed (see
+README). Payloads are benchmarked at realistic small and very large (150
+steps) sizes.
+
+"""
+
+import copy
+
+import pytest
+from django.contrib.auth import get_user_model
+
+from amiqus.models import Client
+from tests.conftest import TEST_CHECK_PHOTO_ID, TEST_CLIENT, TEST_RECORD
+
+# the number of steps in the small and large payloads
+PAYLOAD_SIZES = {"small": len(TEST_RECORD["steps"]), "large": 150}
+
+
+def large_record(steps: int = 50) -> dict:
+    """Return a realistic record payload with the given number of steps."""
+    record = copy.deepcopy(TEST_RECORD)
+    templates = TEST_RECORD["steps"]
+    record["steps"] = []
+    for i in range(steps):
+        step = copy.deepcopy(templates[i % len(templates)])
+        step["id"] = i + 1
+        if "check" in step:
+            step["check"] = 1000000 + i
+        else:
+            step["form"] = f"form-{i}"
+        record["steps"].append(step)
+    return record
+
+
+def large_client(size: int = 50) -> dict:
+    """Return a client payload with the given number of extra properties."""
+    client = copy.deepcopy(TEST_CLIENT)
+    client["documents"] = [
+        {"object": "document", "id": i, "type": "passport", "created_at": None}
+        for i in range(size)
+    ]
+    return client
+
+
+@pytest.fixture(params=PAYLOAD_SIZES.keys())
+def payload_size(request):
+    return request.param
+
+
+@pytest.fixture
+def record_payload(payload_size):
+    return large_record(PAYLOAD_SIZES[payload_size])
+
+
+@pytest.fixture
+def client_payload(payload_size):
+    return large_client(PAYLOAD_SIZES[payload_size])
+
+
+@pytest.fixture
+def check_payload(payload_size):
+    check = copy.deepcopy(TEST_CHECK_PHOTO_ID)
+    check["email"] = "marty@example.com"
+    check["documents"] = large_client(PAYLOAD_SIZES[payload_size])["documents"]
+    return check
+
+
+@pytest.fixture
+def client(db):
+    user = get_user_model().objects.create_user("fred", email="fred@example.com")
+    return Client.objects.create_client(user=user, raw=copy.deepcopy(TEST_CLIENT))
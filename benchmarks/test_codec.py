@@ -0,0 +1,26 @@
+import pytest
+
+from amiqus.codec import CODECS, orjson
+
+pytestmark = pytest.mark.parametrize(
+    "codec",
+    [
+        CODECS["json"](),
+        pytest.param(
+            CODECS["orjson"](),
+            marks=pytest.mark.skipif(orjson is None, reason="orjson not installed"),
+        ),
+    ],
+    ids=lambda codec: codec.name,
+)
+
+
+def test_loads(benchmark, codec, record_payload):
+    body = codec.dumps(record_payload)
+    benchmark.group = "codec.loads"
+    assert benchmark(codec.loads, body) == record_payload
+
+
+def test_dumps(benchmark, codec, record_payload):
+    benchmark.group = "codec.dumps"
+    benchmark(codec.dumps, record_payload)
@@ -0,0 +1,18 @@
+import pytest
+
+from amiqus.models import Record
+
+
+@pytest.mark.django_db
+def test_create_record(benchmark, client, record_payload):
+    def setup():
+        Record.objects.all().delete()
+
+    benchmark.group = "create_record"
+    record = benchmark.pedantic(
+        Record.objects.create_record,
+        args=(client, record_payload),
+        setup=setup,
+        rounds=20,
+    )
+    assert record.steps.count() == len(record_payload["steps"])
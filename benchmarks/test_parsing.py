@@ -0,0 +1,52 @@
+import copy
+
+import pytest
+from django.utils.timezone import now
+
+from amiqus.models import Check, Client, Event, Record
+from amiqus.settings import scrub_check_data, scrub_client_data
+from tests.conftest import TEST_EVENT_RECORD_FINISHED
+
+
+@pytest.fixture
+def event_payload(record_payload):
+    # webhooks are small, but the data may include the full resource
+    event = copy.deepcopy(TEST_EVENT_RECORD_FINISHED)
+    event["data"]["record"].update(record_payload)
+    return event
+
+
+def test_event_parse(benchmark, event_payload):
+    benchmark.group = "parse"
+    event = benchmark(
+        lambda: Event(received_at=now()).parse(event_payload, entity_type="record")
+    )
+    assert event.action == "record.finished"
+
+
+def test_record_parse(benchmark, record_payload):
+    benchmark.group = "parse"
+    record = benchmark(lambda: Record().parse(record_payload))
+    assert record.status == record_payload["status"]
+
+
+def test_check_parse(benchmark, check_payload):
+    benchmark.group = "parse"
+    check = benchmark(lambda: Check().parse(check_payload))
+    assert check.check_type == "check.photo_id"
+
+
+def test_client_parse(benchmark, client_payload):
+    benchmark.group = "parse"
+    client = benchmark(lambda: Client().parse(client_payload))
+    assert client.status == client_payload["status"]
+
+
+def test_scrub_check_data(benchmark, check_payload):
+    benchmark.group = "scrub"
+    benchmark(scrub_check_data, check_payload)
+
+
+def test_scrub_client_data(benchmark, client_payload):
+    benchmark.group = "scrub"
+    benchmark(scrub_client_data, client_payload)
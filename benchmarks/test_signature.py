@@ -0,0 +1,16 @@
+import json
+from base64 import b64encode
+
+from amiqus.decorators import _hmac, _match
+
+TOKEN = b"webhook-security-token"
+
+
+def test_match(benchmark, rf, record_payload):
+    body = json.dumps({"data": {"record": record_payload}}).encode()
+    signature = b64encode(_hmac(TOKEN, body)).decode()
+    request = rf.post(
+        "/", body, content_type="application/json", HTTP_X_AQID_SIGNATURE=signature
+    )
+    benchmark.group = "signature"
+    assert benchmark(_match, TOKEN, request)
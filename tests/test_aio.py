@@ -0,0 +1,308 @@
+from datetime import datetime
+from unittest import mock
+
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.utils.timezone import now
+
+from amiqus import aio
+from amiqus.api import ApiError, ConditionalResponse, RetryPolicy, _url
+from amiqus.circuitbreaker import CircuitBreaker, CircuitOpenError
+from amiqus.responsecache import ResponseCache
+from amiqus.models import Client, Event, Record, Review
+from amiqus.models.base import BaseModel
+from amiqus.signals import api_request_finished
+
+
+def mock_client(handler):
+    """Return an httpx client that routes all requests to handler."""
+    return mock.patch.object(
+        aio,
+        "get_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+class TestWireOperations:
+    """amiqus.aio get/post/patch tests."""
+
+    def test_get(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"id": 1})
+
+        with mock_client(handler):
+            assert async_to_sync(aio.get)("records/1") == {"id": 1}
+        assert requests[0].method == "GET"
+        assert str(requests[0].url) == _url("records/1")
+        assert requests[0].headers["Authorization"].startswith("Bearer ")
+
+    def test_get__signals(self):
+        finished = mock.Mock()
+        api_request_finished.connect(finished)
+        try:
+            with mock_client(lambda request: httpx.Response(200, json={"id": 1})):
+                async_to_sync(aio.get)("records/1")
+        finally:
+            api_request_finished.disconnect(finished)
+        kwargs = finished.call_args.kwargs
+        assert kwargs["sender"] == "amiqus.aio"
+        assert kwargs["path"] == "records/{id}"
+        assert kwargs["status"] == 200
+        assert kwargs["size"] == len(b'{"id":1}')
+
+    def test_get_conditional(self):
+        def handler(request):
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, json={"id": 1}, headers={"ETag": '"v1"'})
+
+        with mock_client(handler):
+            response = async_to_sync(aio.get_conditional)("records/1")
+            assert response == ConditionalResponse({"id": 1}, '"v1"', "")
+            response = async_to_sync(aio.get_conditional)("records/1", etag='"v1"')
+            assert response == ConditionalResponse(None, '"v1"', "")
+
+    def test_post(self):
+        def handler(request):
+            assert request.method == "POST"
+            assert request.content == b'{"foo":"bar"}'
+            return httpx.Response(201, json={"id": 1})
+
+        with mock_client(handler):
+            assert async_to_sync(aio.post)("clients", data={"foo": "bar"}) == {"id": 1}
+
+    def test_patch(self):
+        def handler(request):
+            assert request.method == "PATCH"
+            return httpx.Response(200, json={"id": 1})
+
+        with mock_client(handler):
+            assert async_to_sync(aio.patch)("clients/1", data={}) == {"id": 1}
+
+    def test_error(self):
+        def handler(request):
+            return httpx.Response(400, json={"error": {"type": "bar"}})
+
+        with mock_client(handler):
+            with pytest.raises(ApiError):
+                async_to_sync(aio.get)("records/1")
+
+    @mock.patch("amiqus.aio.asyncio.sleep")
+    def test_get__retry(self, mock_sleep):
+        responses = [
+            httpx.Response(503, json={"error": {"type": "unavailable"}}),
+            httpx.ConnectError("boom"),
+            httpx.Response(200, json={"id": 1}),
+        ]
+
+        def handler(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        policy = RetryPolicy(max_attempts=3, backoff=0.1)
+        with mock_client(handler), mock.patch("amiqus.api.RETRY_POLICY", policy):
+            assert async_to_sync(aio.get)("records/1") == {"id": 1}
+        assert mock_sleep.call_count == 2
+
+    def test_post__no_retry(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(503, json={"error": {"type": "unavailable"}})
+
+        with mock_client(handler):
+            with pytest.raises(ApiError):
+                async_to_sync(aio.post)("clients", data={})
+        assert len(requests) == 1
+
+    def test_circuit_breaker(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(500, json={"error": {"type": "error"}})
+
+        breaker = CircuitBreaker(1, 30, key="test_aio:circuit")
+        with mock_client(handler), mock.patch("amiqus.api.CIRCUIT_BREAKER", breaker):
+            with pytest.raises(ApiError):
+                async_to_sync(aio.post)("clients", data={})
+            with pytest.raises(CircuitOpenError):
+                async_to_sync(aio.post)("clients", data={})
+        assert len(requests) == 1
+
+    def test_response_cache(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"id": 1}, headers={"ETag": '"v1"'})
+
+        backend = ResponseCache({"records": 10}, prefix="test_aio:response")
+        with (
+            mock_client(handler),
+            mock.patch("amiqus.api.RESPONSE_CACHE_BACKEND", backend),
+        ):
+            assert async_to_sync(aio.get)("records/1") == {"id": 1}
+            response = async_to_sync(aio.get_conditional)("records/1", etag='"v1"')
+            assert response == ConditionalResponse(None, '"v1"', "")
+            assert len(requests) == 1
+            async_to_sync(aio.patch)("records/1", data={})
+            assert async_to_sync(aio.get)("records/1") == {"id": 1}
+            assert len(requests) == 3
+
+    def test_get_client(self):
+        async def clients():
+            client = aio.get_client()
+            same = aio.get_client()
+            await aio.close_client()
+            return client, same
+
+        client, same = async_to_sync(clients)()
+        assert client is same
+        assert client.is_closed
+
+
+@pytest.mark.django_db
+class TestHelpers:
+    """amiqus.aio helper function tests."""
+
+    @mock.patch("amiqus.aio.post")
+    def test_create_client(self, mock_post, client_data, user):
+        mock_post.return_value = client_data
+        client = async_to_sync(aio.create_client)(user, dob="2016-01-01")
+        mock_post.assert_called_once_with(
+            "clients",
+            data={
+                "name": {"first_name": user.first_name, "last_name": user.last_name},
+                "email": user.email,
+                "dob": "2016-01-01",
+            },
+        )
+        assert client.amiqus_id == str(client_data["id"])
+        assert Client.objects.get() == client
+
+    @mock.patch("amiqus.aio.post")
+    def test_create_record(self, mock_post, record_data, client):
+        mock_post.return_value = record_data
+        record = async_to_sync(aio.create_record)(client, steps=[])
+        mock_post.assert_called_once_with(
+            "records",
+            data={
+                "client": client.amiqus_id,
+                "notification": "email",
+                "reminder": True,
+                "steps": [],
+            },
+        )
+        assert record.amiqus_id == str(record_data["id"])
+        assert record.steps.count() == 3
+
+    @mock.patch("amiqus.aio.get")
+    def test_create_or_update_reviews(self, mock_get, record):
+        async def get_reviews(href):
+            step_id = href.split("/")[-2]
+            return {
+                "data": [
+                    {
+                        "id": f"review-{step_id}",
+                        "status": "approved",
+                        "created_at": "2023-04-06T15:17:50+00:00",
+                    }
+                ]
+            }
+
+        mock_get.side_effect = get_reviews
+        event = Event(
+            action="record.reviewed",
+            received_at=now(),
+            raw={"data": {"record": {"id": record.amiqus_id}}},
+        )
+        async_to_sync(aio.create_or_update_reviews)(event)
+        assert mock_get.call_count == 3
+        for step in record.steps.all():
+            review = Review.objects.get(amiqus_id=f"review-{step.amiqus_id}")
+            assert review.step == step
+            assert review.status == "approved"
+
+    @mock.patch("amiqus.aio.patch")
+    def test_update_client_status(self, mock_patch, client_data, client):
+        client_data["status"] = "approved"
+        mock_patch.return_value = client_data
+        async_to_sync(aio.update_client_status)(client, Client.ClientStatus.APPROVED)
+        mock_patch.assert_called_once_with(
+            f"clients/{client.amiqus_id}", data={"status": "approved"}
+        )
+        client.refresh_from_db()
+        assert client.status == "approved"
+
+    @mock.patch("amiqus.aio.patch")
+    def test_update_record_expired_at_date(self, mock_patch, record_data, record):
+        mock_patch.return_value = record_data
+        async_to_sync(aio.update_record_expired_at_date)(record, datetime(2022, 6, 10))
+        mock_patch.assert_called_once_with(
+            f"records/{record.amiqus_id}",
+            data={"expired_at": "2022-06-10T00:00:00Z"},
+        )
+
+
+@pytest.mark.django_db
+class TestBaseModelAsync:
+    """BaseModel.afetch / apull tests."""
+
+    @mock.patch.object(BaseModel, "save")
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_afetch(self, mock_get, mock_save, record, record_data):
+        record_data["status"] = "complete"
+        mock_get.return_value = ConditionalResponse(record_data, '"v1"', "")
+        assert async_to_sync(record.afetch)() == record
+        mock_get.assert_called_once_with(record.href, etag="", last_modified="")
+        assert record.status == "complete"
+        assert record.etag == '"v1"'
+        mock_save.assert_not_called()
+
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_apull(self, mock_get, record, record_data):
+        record_data["status"] = "complete"
+        mock_get.return_value = ConditionalResponse(record_data, '"v1"', "")
+        assert async_to_sync(record.apull)() == record
+        assert Record.objects.get().status == "complete"
+
+    @mock.patch.object(BaseModel, "save")
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_apull__unchanged(self, mock_get, mock_save, record):
+        mock_get.return_value = ConditionalResponse(None, "", "")
+        async_to_sync(record.apull)()
+        assert record.unchanged
+        mock_save.assert_not_called()
+
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_aupdate_status(self, mock_get, client, client_data, client_status_event):
+        client_data["status"] = "approved"
+        mock_get.return_value = ConditionalResponse(client_data, '"v1"', "")
+        event = Event(received_at=now()).parse(
+            client_status_event, entity_type="client"
+        )
+        assert async_to_sync(client.aupdate_status)(event) == client
+        client.refresh_from_db()
+        assert client.status == "approved"
+
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_aupdate_status__error(self, mock_get, client, client_status_event):
+        mock_get.side_effect = httpx.ConnectError("down")
+        client.etag = '"v1"'
+        event = Event(received_at=now()).parse(
+            client_status_event, entity_type="client"
+        )
+        event.status = "approved"
+        # the status is still saved, and the error is not raised
+        assert async_to_sync(client.aupdate_status)(event) == client
+        client.refresh_from_db()
+        assert client.etag == ""
+        assert client.status == "approved"
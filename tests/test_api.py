@@ -1,9 +1,33 @@
+import threading
+from datetime import timedelta
 from unittest import mock
 
+import requests
 from django.test import TestCase
+from django.utils.http import http_date
+from django.utils.timezone import now
 
-from amiqus.api import ApiError, _headers, _respond, _url, get, post, patch
+import amiqus
+from amiqus import api
+from amiqus.api import (
+    ApiError,
+    ConditionalResponse,
+    RetryPolicy,
+    _headers,
+    _respond,
+    _url,
+    close_session,
+    get,
+    get_conditional,
+    get_session,
+    patch,
+    path_template,
+    post,
+    warm_up,
+)
+from amiqus.apps import AmiqusAppConfig
 from amiqus.settings import DEFAULT_REQUESTS_TIMEOUT
+from amiqus.signals import api_request_finished, api_request_started
 
 
 class ApiTests(TestCase):
@@ -18,59 +42,300 @@ class ApiTests(TestCase):
 
     def test__respond(self):
         """Test the _respond function handles 2xx."""
-        response = mock.Mock()
+        response = mock.Mock(content=b'{"foo": "bar"}')
         response.status_code = 200
-        self.assertEqual(_respond(response), response.json.return_value)
+        self.assertEqual(_respond(response), {"foo": "bar"})
         # non-2xx should raise error
         response.status_code = 400
-        response.json.return_value = {"error": {"message": "foo", "type": "bar"}}
+        response.content = b'{"error": {"message": "foo", "type": "bar"}}'
         self.assertRaises(ApiError, _respond, response)
+        # non-JSON error bodies should still raise an ApiError
+        response.status_code = 502
+        response.content = b"<html>Bad Gateway</html>"
+        response.text = "<html>Bad Gateway</html>"
+        with self.assertRaises(ApiError) as ctx:
+            _respond(response)
+        self.assertEqual(ctx.exception.error_type, "<html>Bad Gateway</html>")
 
-    @mock.patch("requests.get")
+    @mock.patch("amiqus.api.get_session")
     @mock.patch("amiqus.api._headers")
-    def test_get(self, mock_headers, mock_get):
+    def test_get(self, mock_headers, mock_session):
         """Test the get function calls API."""
-        response = mock.Mock()
+        response = mock.Mock(content=b"{}")
         response.status_code = 200
         headers = mock_headers.return_value
+        mock_get = mock_session.return_value.request
         mock_get.return_value = response
-        self.assertEqual(get("/"), response.json.return_value)
+        self.assertEqual(get("/"), {})
         mock_get.assert_called_once_with(
+            "GET",
             _url("/"),
             headers=headers,
             timeout=DEFAULT_REQUESTS_TIMEOUT,
         )
 
-    @mock.patch("requests.post")
+    @mock.patch("amiqus.api.get_session")
+    def test_get_conditional(self, mock_session):
+        """Test the get_conditional function sends validators."""
+        mock_request = mock_session.return_value.request
+        response = mock_request.return_value
+        response.status_code = 200
+        response.content = b'{"id": 1}'
+        response.headers = {"ETag": '"v2"', "Last-Modified": "bar"}
+        self.assertEqual(
+            get_conditional("/"),
+            ConditionalResponse({"id": 1}, '"v2"', "bar"),
+        )
+        headers = mock_request.call_args.kwargs["headers"]
+        self.assertNotIn("If-None-Match", headers)
+        self.assertNotIn("If-Modified-Since", headers)
+
+        response.status_code = 304
+        self.assertEqual(
+            get_conditional("/", etag='"v1"', last_modified="foo"),
+            ConditionalResponse(None, '"v1"', "foo"),
+        )
+        headers = mock_request.call_args.kwargs["headers"]
+        self.assertEqual(headers["If-None-Match"], '"v1"')
+        self.assertEqual(headers["If-Modified-Since"], "foo")
+        self.assertEqual(headers["Authorization"], _headers()["Authorization"])
+
+    @mock.patch("amiqus.api.get_session")
     @mock.patch("amiqus.api._headers")
-    def test_post(self, mock_headers, mock_post):
+    def test_post(self, mock_headers, mock_session):
         """Test the get function calls API."""
-        response = mock.Mock()
+        response = mock.Mock(content=b"{}")
         response.status_code = 200
         headers = mock_headers.return_value
         data = {"foo": "bar"}
+        mock_post = mock_session.return_value.request
         mock_post.return_value = response
-        self.assertEqual(post("/", data=data), response.json.return_value)
+        self.assertEqual(post("/", data=data), {})
         mock_post.assert_called_once_with(
+            "POST",
             _url("/"),
             headers=headers,
-            json=data,
+            data=b'{"foo":"bar"}',
             timeout=DEFAULT_REQUESTS_TIMEOUT,
         )
 
-    @mock.patch("requests.patch")
+    @mock.patch("amiqus.api.get_session")
     @mock.patch("amiqus.api._headers")
-    def test_patch(self, mock_headers, mock_patch):
+    def test_patch(self, mock_headers, mock_session):
         """Test the patch function calls API correctly."""
-        response = mock.Mock()
+        response = mock.Mock(content=b"{}")
         response.status_code = 200
         headers = mock_headers.return_value
         data = {"foo": "bar"}
+        mock_patch = mock_session.return_value.request
         mock_patch.return_value = response
-        self.assertEqual(patch("/", data=data), response.json.return_value)
+        self.assertEqual(patch("/", data=data), {})
         mock_patch.assert_called_once_with(
+            "PATCH",
             _url("/"),
             headers=headers,
-            json=data,
+            data=b'{"foo":"bar"}',
             timeout=DEFAULT_REQUESTS_TIMEOUT,
         )
+
+
+class SessionTests(TestCase):
+    """amiqus.api session pooling tests."""
+
+    def tearDown(self):
+        close_session()
+
+    def test_get_session(self):
+        """Test the session is reused within a thread."""
+        session = get_session()
+        self.assertIsInstance(session, requests.Session)
+        self.assertIs(get_session(), session)
+        self.assertIs(session.get_adapter(_url("/")), api._get_adapter())
+
+    def test_get_session__threads(self):
+        """Test each thread gets its own session sharing one pool."""
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(get_session()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], get_session())
+        self.assertIs(
+            sessions[0].get_adapter(_url("/")), get_session().get_adapter(_url("/"))
+        )
+
+    def test_close_session(self):
+        """Test closing the pool creates a new session on next use."""
+        session = get_session()
+        close_session()
+        self.assertIsNot(get_session(), session)
+
+    @mock.patch("amiqus.api.get_session")
+    def test_warm_up(self, mock_session):
+        warm_up()
+        mock_session.return_value.head.assert_called_once_with(
+            api.API_ROOT, timeout=DEFAULT_REQUESTS_TIMEOUT
+        )
+        # connection errors are logged, not raised
+        mock_session.return_value.head.side_effect = requests.ConnectionError()
+        warm_up()
+
+    @mock.patch("amiqus.api.warm_up")
+    def test_ready(self, mock_warm_up):
+        config = AmiqusAppConfig("amiqus", amiqus)
+        with mock.patch("amiqus.settings.WARM_UP_SESSION", False):
+            config.ready()
+        mock_warm_up.assert_not_called()
+        with mock.patch("amiqus.settings.WARM_UP_SESSION", True):
+            config.ready()
+        mock_warm_up.assert_called_once_with()
+
+
+def _response(status_code, headers=None):
+    return mock.Mock(
+        status_code=status_code,
+        headers=headers or {},
+        content=b'{"error": {"type": "error"}}',
+    )
+
+
+class RetryPolicyTests(TestCase):
+    """amiqus.api.RetryPolicy tests."""
+
+    def test_next_delay(self):
+        policy = RetryPolicy(max_attempts=3, backoff=1, backoff_max=10, deadline=60)
+        with mock.patch("random.uniform", return_value=0.5) as mock_uniform:
+            self.assertEqual(policy.next_delay("GET", 1, 0, _response(503)), 0.5)
+            mock_uniform.assert_called_once_with(0, 1)
+            self.assertEqual(policy.next_delay("PATCH", 2, 0, _response(429)), 0.5)
+            mock_uniform.assert_called_with(0, 2)
+            # connection errors / timeouts have no response
+            self.assertEqual(policy.next_delay("GET", 1, 0), 0.5)
+        # non-idempotent methods are never retried
+        self.assertIsNone(policy.next_delay("POST", 1, 0, _response(503)))
+        # non-transient errors are not retried
+        self.assertIsNone(policy.next_delay("GET", 1, 0, _response(400)))
+        self.assertIsNone(policy.next_delay("GET", 1, 0, _response(200)))
+        # nor is anything once we run out of attempts
+        self.assertIsNone(policy.next_delay("GET", 3, 0, _response(503)))
+
+    def test_next_delay__backoff_max(self):
+        policy = RetryPolicy(max_attempts=10, backoff=1, backoff_max=5, deadline=60)
+        with mock.patch("random.uniform", return_value=0) as mock_uniform:
+            policy.next_delay("GET", 8, 0, _response(503))
+        mock_uniform.assert_called_once_with(0, 5)
+
+    def test_next_delay__retry_after(self):
+        policy = RetryPolicy(max_attempts=3, deadline=60)
+        response = _response(429, {"Retry-After": "7"})
+        self.assertEqual(policy.next_delay("GET", 1, 0, response), 7)
+        retry_at = http_date((now() + timedelta(seconds=30)).timestamp())
+        response = _response(503, {"Retry-After": retry_at})
+        self.assertAlmostEqual(policy.next_delay("GET", 1, 0, response), 30, delta=2)
+        # unparseable values fall back to backoff
+        response = _response(503, {"Retry-After": "soon"})
+        self.assertLessEqual(policy.next_delay("GET", 1, 0, response), policy.backoff)
+
+    def test_next_delay__deadline(self):
+        policy = RetryPolicy(max_attempts=3, deadline=10)
+        response = _response(429, {"Retry-After": "7"})
+        self.assertEqual(policy.next_delay("GET", 1, 2, response), 7)
+        self.assertIsNone(policy.next_delay("GET", 1, 3, response))
+
+
+@mock.patch("amiqus.api.time.sleep")
+@mock.patch("amiqus.api.get_session")
+class RetryTests(TestCase):
+    """amiqus.api request retry tests."""
+
+    def test_get__retry(self, mock_session, mock_sleep):
+        mock_request = mock_session.return_value.request
+        success = _response(200)
+        mock_request.side_effect = [_response(503), requests.ConnectionError(), success]
+        policy = RetryPolicy(max_attempts=3, backoff=0.1, deadline=60)
+        with mock.patch("amiqus.api.RETRY_POLICY", policy):
+            self.assertEqual(get("/"), {"error": {"type": "error"}})
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_get__retries_exhausted(self, mock_session, mock_sleep):
+        mock_request = mock_session.return_value.request
+        mock_request.return_value = _response(503)
+        with mock.patch("amiqus.api.RETRY_POLICY", RetryPolicy(max_attempts=2)):
+            self.assertRaises(ApiError, get, "/")
+        self.assertEqual(mock_request.call_count, 2)
+
+        mock_request.reset_mock()
+        mock_request.side_effect = requests.Timeout()
+        with mock.patch("amiqus.api.RETRY_POLICY", RetryPolicy(max_attempts=2)):
+            self.assertRaises(requests.Timeout, get, "/")
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_post__no_retry(self, mock_session, mock_sleep):
+        mock_request = mock_session.return_value.request
+        mock_request.return_value = _response(503)
+        self.assertRaises(ApiError, post, "/", data={})
+        mock_request.assert_called_once()
+        mock_sleep.assert_not_called()
+
+
+@mock.patch("amiqus.api.time.sleep")
+@mock.patch("amiqus.api.get_session")
+class InstrumentationTests(TestCase):
+    """amiqus.api request signal tests."""
+
+    def setUp(self):
+        self.started = mock.Mock()
+        self.finished = mock.Mock()
+        api_request_started.connect(self.started)
+        api_request_finished.connect(self.finished)
+
+    def tearDown(self):
+        api_request_started.disconnect(self.started)
+        api_request_finished.disconnect(self.finished)
+
+    def test_path_template(self, mock_session, mock_sleep):
+        self.assertEqual(path_template("records"), "records")
+        self.assertEqual(path_template("/records/1/"), "records/{id}")
+        self.assertEqual(
+            path_template("records/1/steps/2/reviews"),
+            "records/{id}/steps/{id}/reviews",
+        )
+
+    def test_signals(self, mock_session, mock_sleep):
+        mock_request = mock_session.return_value.request
+        success = _response(200)
+        mock_request.side_effect = [_response(503), success]
+        with mock.patch("amiqus.api.RETRY_POLICY", RetryPolicy(max_attempts=2)):
+            get("records/1")
+        self.started.assert_called_once_with(
+            signal=api_request_started,
+            sender="amiqus.api",
+            method="GET",
+            path="records/{id}",
+        )
+        self.finished.assert_called_once()
+        kwargs = self.finished.call_args.kwargs
+        self.assertEqual(kwargs["path"], "records/{id}")
+        self.assertEqual(kwargs["status"], 200)
+        self.assertEqual(kwargs["size"], len(success.content))
+        self.assertEqual(kwargs["retries"], 1)
+        self.assertIsNone(kwargs["exception"])
+        self.assertGreaterEqual(kwargs["duration"], 0)
+
+    def test_signals__exception(self, mock_session, mock_sleep):
+        error = requests.ConnectionError()
+        mock_session.return_value.request.side_effect = error
+        with mock.patch("amiqus.api.RETRY_POLICY", RetryPolicy(max_attempts=1)):
+            self.assertRaises(requests.ConnectionError, post, "records", data={})
+        kwargs = self.finished.call_args.kwargs
+        self.assertEqual(kwargs["method"], "POST")
+        self.assertIsNone(kwargs["status"])
+        self.assertEqual(kwargs["size"], 0)
+        self.assertEqual(kwargs["exception"], error)
+
+    def test_slow_request(self, mock_session, mock_sleep):
+        mock_session.return_value.request.return_value = _response(200)
+        with mock.patch("amiqus.api.SLOW_REQUEST_THRESHOLD", 0):
+            with self.assertLogs("amiqus.api", "WARNING") as logs:
+                get("records/1")
+        self.assertIn("Slow Amiqus API request: GET records/{id}", logs.output[0])
@@ -0,0 +1,112 @@
+from unittest import mock
+
+import pytest
+import requests
+from django.core.cache import cache
+
+from amiqus import metrics
+from amiqus.api import ApiError, RetryPolicy, get
+from amiqus.circuitbreaker import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    metrics.reset()
+    cache.clear()
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker(2, 30)
+
+
+@mock.patch("amiqus.circuitbreaker.time.time", return_value=1000.0)
+class TestCircuitBreaker:
+    """amiqus.circuitbreaker.CircuitBreaker tests."""
+
+    def test_invalid_threshold(self, mock_time):
+        with pytest.raises(ValueError):
+            CircuitBreaker(0, 30)
+
+    def test_is_failure(self, mock_time, breaker):
+        assert breaker.is_failure(500)
+        assert breaker.is_failure(503)
+        assert not breaker.is_failure(200)
+        assert not breaker.is_failure(404)
+
+    def test_open(self, mock_time, breaker):
+        assert breaker.state == "closed"
+        breaker.record_failure()
+        breaker.before_request()
+        assert breaker.state == "closed"
+        breaker.record_failure()
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        assert metrics.snapshot() == {
+            "circuitbreaker.opened": 1,
+            "circuitbreaker.rejected": 1,
+        }
+
+    def test_success_resets_failures(self, mock_time, breaker):
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == "closed"
+
+    def test_half_open(self, mock_time, breaker):
+        breaker.record_failure()
+        breaker.record_failure()
+        mock_time.return_value = 1030.0
+        assert breaker.state == "half-open"
+        # a single probe request is allowed through
+        breaker.before_request()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        # if it fails the circuit re-opens
+        breaker.record_failure()
+        assert breaker.state == "open"
+        mock_time.return_value = 1060.0
+        breaker.before_request()
+        # if it succeeds the circuit closes
+        breaker.record_success()
+        assert breaker.state == "closed"
+        breaker.before_request()
+        breaker.before_request()
+
+    def test_shared_state(self, mock_time, breaker):
+        """Test that breakers using the same cache trip together."""
+        other = CircuitBreaker(2, 30)
+        breaker.record_failure()
+        other.record_failure()
+        assert breaker.state == other.state == "open"
+
+
+@mock.patch("amiqus.api.time.sleep")
+@mock.patch("amiqus.api.get_session")
+class TestApiCircuitBreaker:
+    """Test amiqus.api requests go through the circuit breaker."""
+
+    def test_failures_open_circuit(self, mock_session, mock_sleep, breaker):
+        mock_request = mock_session.return_value.request
+        mock_request.side_effect = requests.ConnectionError()
+        with (
+            mock.patch("amiqus.api.CIRCUIT_BREAKER", breaker),
+            mock.patch("amiqus.api.RETRY_POLICY", RetryPolicy(max_attempts=5)),
+        ):
+            # the circuit opens after the second attempt, so the third fails fast
+            with pytest.raises(CircuitOpenError):
+                get("/")
+            with pytest.raises(CircuitOpenError):
+                get("/")
+        assert mock_request.call_count == 2
+
+    def test_errors_do_not_open_circuit(self, mock_session, mock_sleep, breaker):
+        mock_request = mock_session.return_value.request
+        mock_request.return_value.status_code = 404
+        mock_request.return_value.content = b'{"error": "not found"}'
+        with mock.patch("amiqus.api.CIRCUIT_BREAKER", breaker):
+            for _ in range(3):
+                with pytest.raises(ApiError):
+                    get("/")
+        assert breaker.state == "closed"
@@ -0,0 +1,38 @@
+from unittest import mock
+
+import pytest
+
+from amiqus import codec
+from amiqus.codec import JsonCodec, OrjsonCodec, get_codec
+
+DATA = {"id": 1, "steps": [{"type": "check.photo_id", "completed_at": None}]}
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_codec(name):
+    codec = get_codec(name)
+    assert codec.name == name
+    body = codec.dumps(DATA)
+    assert body == b'{"id":1,"steps":[{"type":"check.photo_id","completed_at":null}]}'
+    assert codec.loads(body) == DATA
+    assert codec.loads(body.decode()) == DATA
+    with pytest.raises(ValueError):
+        codec.loads(b"<html>")
+
+
+def test_get_codec():
+    assert isinstance(get_codec(), OrjsonCodec)
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+@mock.patch("amiqus.codec.orjson", None)
+def test_get_codec__orjson_not_installed():
+    assert type(get_codec()) is JsonCodec
+    with pytest.raises(ImportError):
+        get_codec("orjson")
+
+
+def test_loads_dumps():
+    with mock.patch("amiqus.codec.CODEC", JsonCodec()):
+        assert codec.loads(codec.dumps(DATA)) == DATA
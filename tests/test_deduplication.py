@@ -0,0 +1,88 @@
+import json
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from amiqus import metrics
+from amiqus.deduplication import WebhookDeduplicator, delivery_id
+from amiqus.models import Event, Record
+from amiqus.views import async_status_update, status_update
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    metrics.reset()
+
+
+@pytest.fixture
+def event(record_finished_event):
+    return Event(received_at=now()).parse(record_finished_event, entity_type="record")
+
+
+@pytest.fixture
+def deduplicator():
+    deduplicator = WebhookDeduplicator(60)
+    with mock.patch("amiqus.views.DEDUPLICATOR", deduplicator):
+        yield deduplicator
+
+
+def test_delivery_id(event):
+    assert delivery_id(event) == (
+        f"record:{event.amiqus_id}:record.finished:2023-04-06T15:17:50+00:00"
+    )
+    event.raw["id"] = "delivery-1"
+    assert delivery_id(event) == "delivery-1"
+
+
+def test_claim(deduplicator, event, record_finished_event):
+    assert deduplicator.claim(event)
+    assert not deduplicator.claim(event)
+    assert metrics.get("webhooks.duplicates") == 1
+    # a new trigger of the same event is not a duplicate
+    record_finished_event["trigger"]["triggered_at"] = "2023-04-07T00:00:00+00:00"
+    assert deduplicator.claim(
+        Event(received_at=now()).parse(record_finished_event, entity_type="record")
+    )
+    deduplicator.release(event)
+    assert deduplicator.claim(event)
+
+
+def test_aclaim(deduplicator, event):
+    assert async_to_sync(deduplicator.aclaim)(event)
+    assert not async_to_sync(deduplicator.aclaim)(event)
+    async_to_sync(deduplicator.arelease)(event)
+    assert async_to_sync(deduplicator.aclaim)(event)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("view", [status_update, async_to_sync(async_status_update)])
+def test_status_update(deduplicator, rf, record, record_finished_event, view):
+    def post():
+        request = rf.post(
+            "/",
+            data=json.dumps(record_finished_event),
+            content_type="application/json",
+        )
+        return view(request).content
+
+    with (
+        mock.patch.object(Record, "update_status") as mock_update,
+        mock.patch.object(Record, "aupdate_status") as mock_aupdate,
+    ):
+        assert post() == b"Update processed."
+        assert post() == b"Duplicate webhook."
+    assert mock_update.call_count + mock_aupdate.call_count == 1
+
+
+@pytest.mark.django_db
+def test_status_update__failed(deduplicator, rf, record_finished_event):
+    # the record does not exist, so the delivery is released to be retried
+    request = rf.post(
+        "/", data=json.dumps(record_finished_event), content_type="application/json"
+    )
+    assert status_update(request).content == b"Record not found."
+    assert status_update(request).content == b"Record not found."
@@ -0,0 +1,93 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from amiqus import api
+from amiqus.api import ApiError, RetryPolicy, close_session, get, get_conditional
+from amiqus.fakeapi import FakeAmiqusApi, lognormal, serve, uniform
+from amiqus.helpers import create_client, create_or_update_reviews, create_record
+from amiqus.models import Event, Record
+
+
+@pytest.fixture
+def fake_api():
+    return FakeAmiqusApi()
+
+
+@pytest.fixture
+def api_root(fake_api):
+    with serve(fake_api) as url, mock.patch.object(api, "API_ROOT", url):
+        yield url
+    close_session()
+
+
+def test_latency_distributions():
+    assert 0.1 <= uniform(0.1, 0.2)() <= 0.2
+    assert lognormal(0.1)() > 0
+
+
+def test_unauthorized(api_root):
+    assert requests.get(f"{api_root}records/1", timeout=1).status_code == 401
+
+
+def test_not_found(api_root):
+    with pytest.raises(ApiError) as ex:
+        get("foo/1")
+    assert ex.value.status_code == 404
+
+
+def test_get__generated(api_root, fake_api):
+    record = get("records/1")
+    assert record["id"] == 1
+    assert [step["type"] for step in record["steps"]] == [
+        "check.photo_id",
+        "check.watchlist",
+    ]
+    assert get(f"checks/{record['steps'][0]['check']}")["record"] == 1
+    assert get("records/1") == record
+    assert fake_api.requests == [
+        ("GET", "/records/1"),
+        ("GET", f"/checks/{record['steps'][0]['check']}"),
+        ("GET", "/records/1"),
+    ]
+
+
+def test_get_conditional(api_root, fake_api):
+    response = get_conditional("clients/1")
+    assert response.etag
+    assert get_conditional("clients/1", etag=response.etag).data is None
+    fake_api.set_status("clients", 1, "approved")
+    assert get_conditional("clients/1", etag=response.etag).data["status"] == (
+        "approved"
+    )
+
+
+@pytest.mark.django_db
+def test_helpers(api_root, fake_api, user):
+    client = create_client(user)
+    assert fake_api.clients[int(client.amiqus_id)]["email"] == user.email
+    steps = [{"type": "check.photo_id", "preferences": {"report_type": "standard"}}]
+    record = create_record(client, steps)
+    assert record.steps.count() == 1
+    assert record.checks.count() == 1
+    fake_api.set_status("records", int(record.amiqus_id), "complete")
+    record.pull()
+    assert Record.objects.get().status == "complete"
+    event = Event(raw={"data": {"record": {"id": record.amiqus_id}}})
+    create_or_update_reviews(event)
+    assert record.steps.get().reviews.count() == 1
+
+
+@mock.patch("amiqus.api.time.sleep")
+def test_faults(mock_sleep, api_root, fake_api):
+    fake_api.throttle_rate = 1
+    with mock.patch.object(api, "RETRY_POLICY", RetryPolicy(max_attempts=2)):
+        with pytest.raises(ApiError) as ex:
+            get("records/1")
+    assert ex.value.status_code == 429
+    mock_sleep.assert_called_once_with(1)
+    fake_api.throttle_rate, fake_api.error_rate = 0, 1
+    with pytest.raises(ApiError) as ex:
+        api.post("records", data={})
+    assert ex.value.status_code in (500, 503)
@@ -0,0 +1,92 @@
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from django.contrib.auth import get_user_model
+
+from amiqus import api
+from amiqus.models import Client, Event, Record
+from amiqus.management.commands.amiqus_webhook_load import (
+    parse_mix,
+    percentile,
+    webhook,
+)
+
+
+def test_parse_mix():
+    assert parse_mix("record.finished=2, client.status=1") == {
+        "record.finished": 2,
+        "client.status": 1,
+    }
+    with pytest.raises(CommandError):
+        parse_mix("record.finished")
+    with pytest.raises(CommandError):
+        parse_mix("check.updated=1")
+
+
+def test_percentile():
+    latencies = [i / 100 for i in range(1, 101)]
+    assert percentile(latencies, 50) == pytest.approx(0.505)
+    assert percentile(latencies, 99) == pytest.approx(0.9901)
+    assert percentile([0.1], 99) == 0.1
+    assert percentile([], 99) == 0
+
+
+def test_webhook():
+    body = webhook("client.status", "1", "2")
+    assert body["trigger"]["alias"] == "client.status"
+    assert body["data"] == {
+        "client": {"id": "2", "show": "https://id.amiqus.co/api/clients/2"}
+    }
+    assert webhook("record.finished", "1", "2")["data"]["record"]["id"] == "1"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_amiqus_webhook_load(record):
+    """Test webhooks are sent for throwaway objects, which are then deleted."""
+    raw, users = record.raw, get_user_model().objects.count()
+    out = StringIO()
+    root = api.API_ROOT
+    call_command(
+        "amiqus_webhook_load",
+        "--requests=20",
+        "--concurrency=2",
+        "--fake-api",
+        "--fake-api-latency=0.001",
+        "--mix=record.finished=1,client.status=1",
+        stdout=out,
+        stderr=StringIO(),
+    )
+    assert api.API_ROOT == root
+    output = out.getvalue()
+    assert "Webhooks sent: 20 " in output
+    assert "p50=" in output
+    assert "200 Update processed." in output
+    # the existing record is untouched
+    record.refresh_from_db()
+    assert (record.raw, record.updated_at) == (raw, None)
+    assert Record.objects.get() == record
+    assert Client.objects.get() == record.client
+    assert get_user_model().objects.count() == users
+    assert not Event.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+@mock.patch("requests.Session.post")
+def test_amiqus_webhook_load__url(mock_post):
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.text = "Record not found."
+    out, err = StringIO(), StringIO()
+    call_command(
+        "amiqus_webhook_load",
+        "--requests=5",
+        "--url=http://localhost/webhook/",
+        "--use-existing",
+        stdout=out,
+        stderr=err,
+    )
+    assert "No local records" in err.getvalue()
+    assert "5  200 Record not found." in out.getvalue()
+    assert mock_post.call_args.args == ("http://localhost/webhook/",)
@@ -0,0 +1,12 @@
+from amiqus import metrics
+
+
+def test_counters():
+    metrics.reset()
+    assert metrics.get("foo") == 0
+    metrics.incr("foo")
+    metrics.incr("foo", 2.5)
+    assert metrics.get("foo") == 3.5
+    assert metrics.snapshot() == {"foo": 3.5}
+    metrics.reset()
+    assert metrics.snapshot() == {}
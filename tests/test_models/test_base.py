@@ -5,10 +5,11 @@ import pytest
 from dateutil.parser import parse as date_parse
 from django.db.models import Model, query
 from django.test import TestCase
+from django.utils.timezone import now
 
-from amiqus.api import ApiError
-from amiqus.models import Client, Event
-from amiqus.models.base import BaseModel, BaseStatusModel
+from amiqus.api import ApiError, ConditionalResponse
+from amiqus.models import Client, Event, Record
+from amiqus.models.base import BaseModel, BaseStatusModel, PullSummary, hash_raw
 
 
 class BaseModelInstance(BaseModel):
@@ -61,7 +62,7 @@ class BaseModelTests(TestCase):
         self.assertEqual(obj.created_at, date_parse(data["created_at"]))
 
     @mock.patch.object(BaseModel, "save")
-    @mock.patch("amiqus.models.base.get")
+    @mock.patch("amiqus.models.base.get_conditional")
     def test_fetch(self, mock_get, mock_save):
         """Test the fetch method calls the API."""
         data = {
@@ -72,11 +73,14 @@ class BaseModelTests(TestCase):
             "result": "clear",
             "href": "/",
         }
-        mock_get.return_value = data
+        mock_get.return_value = ConditionalResponse(data, '"v1"', "")
         obj = BaseModelInstance(raw={"href": "/"})
         obj.fetch()
+        mock_get.assert_called_once_with("test_models/", etag="", last_modified="")
         # record that it has update raw, but parsed the return value
         self.assertEqual(obj.raw, data)
+        self.assertEqual(obj.etag, '"v1"')
+        self.assertFalse(obj.unchanged)
         self.assertEqual(obj.amiqus_id, data["id"])
         self.assertEqual(obj.created_at, date_parse(data["created_at"]))
         # record that it has **not** called the save method
@@ -96,6 +100,59 @@ class BaseModelTests(TestCase):
         mock_get.side_effect = ApiError(response)
         self.assertRaises(ApiError, obj.pull)
 
+    @mock.patch.object(BaseModel, "parse")
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_fetch__not_modified(self, mock_get, mock_parse):
+        """Test the fetch method sends validators and handles a 304."""
+        obj = BaseModelInstance(amiqus_id="1", etag='"v1"', last_modified="foo")
+        mock_get.return_value = ConditionalResponse(None, '"v1"', "foo")
+        self.assertEqual(obj.fetch(), obj)
+        mock_get.assert_called_once_with(obj.href, etag='"v1"', last_modified="foo")
+        self.assertTrue(obj.unchanged)
+        mock_parse.assert_not_called()
+
+    def test_hash_raw(self):
+        """Test the hash of raw JSON does not depend on the order of keys."""
+        assert hash_raw({"id": "1", "status": "x"}) == hash_raw(
+            {"status": "x", "id": "1"}
+        )
+        assert hash_raw({"id": "1"}) != hash_raw({"id": "2"})
+        obj = BaseModelInstance().parse({"id": "1"})
+        assert obj.raw_hash == hash_raw({"id": "1"})
+
+    @mock.patch("amiqus.models.base.metrics")
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_fetch__identical(self, mock_get, mock_metrics):
+        """Test the fetch method does not parse a payload that is unchanged."""
+        obj = BaseModelInstance().parse({"id": "1", "status": "x", "href": "/"})
+        obj.status = "y"
+        mock_get.return_value = ConditionalResponse(
+            {"href": "/", "status": "x", "id": "1"}, '"v2"', ""
+        )
+        with mock.patch.object(BaseModel, "parse") as mock_parse:
+            obj.fetch()
+        mock_parse.assert_not_called()
+        mock_metrics.incr.assert_called_once_with("fetch.identical")
+        self.assertTrue(obj.unchanged)
+        self.assertEqual(obj.etag, '"v2"')
+        self.assertEqual(obj.status, "y")
+
+        # clearing the validators also clears the hash
+        obj.clear_validators()
+        obj.fetch()
+        self.assertFalse(obj.unchanged)
+        self.assertEqual(obj.status, "x")
+
+    @mock.patch.object(BaseModel, "save")
+    @mock.patch.object(BaseModel, "fetch")
+    def test_pull__unchanged(self, mock_fetch, mock_save):
+        """Test the pull method does not save an unchanged object."""
+        obj = BaseModelInstance(raw={"href": "/"})
+        obj.unchanged = True
+        mock_fetch.return_value = obj
+        obj.pull()
+        mock_save.assert_not_called()
+
     @mock.patch.object(BaseModel, "save")
     @mock.patch.object(BaseModel, "fetch")
     def test_pull(self, mock_fetch, mock_save):
@@ -107,6 +164,17 @@ class BaseModelTests(TestCase):
         mock_fetch.assert_called_once_with()
         mock_save.assert_called_once_with()
 
+    @mock.patch.object(BaseModel, "save")
+    @mock.patch.object(BaseModel, "fetch")
+    def test_pull__requested(self, mock_fetch, mock_save):
+        """Test the pull method clears pull_requested_at, even if unchanged."""
+        obj = BaseModelInstance(raw={"href": "/"}, pull_requested_at=now())
+        obj.unchanged = True
+        mock_fetch.return_value = obj
+        obj.pull()
+        assert obj.pull_requested_at is None
+        mock_save.assert_called_once_with()
+
     def test_parse_with_none_created_at(self):
         """Test parsing when created_at is None."""
         data = {
@@ -129,8 +197,10 @@ class TestBaseQuerySet:
 
     @mock.patch.object(BaseModel, "fetch")
     def test_fetch(self, mock_fetch, client):
-        Client.objects.all().fetch()
+        mock_fetch.return_value = client
+        summary = Client.objects.all().fetch()
         assert mock_fetch.call_count == 1
+        assert summary == PullSummary(updated=1)
 
     @mock.patch.object(BaseModel, "fetch")
     def test_fetch__empty(self, mock_fetch):
@@ -141,13 +211,79 @@ class TestBaseQuerySet:
     def test_fetch__error(self, mock_fetch, client):
         # record that an error doesn't blow up everything
         mock_fetch.side_effect = Exception("Something went wrong")
-        Client.objects.all().fetch()
+        summary = Client.objects.all().fetch()
         assert mock_fetch.call_count == 1
+        assert summary == PullSummary(failed=1)
+        assert summary.errors == {client.amiqus_id: "Exception: Something went wrong"}
 
     @mock.patch.object(BaseModel, "pull")
     def test_pull(self, mock_pull, client):
-        Client.objects.all().pull()
+        mock_pull.return_value = client
+        summary = Client.objects.all().pull()
         assert mock_pull.call_count == 1
+        assert summary == PullSummary(updated=1)
+
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_pull__unchanged(self, mock_get, client, user, client_data):
+        client_data["status"] = "approved"
+        mock_get.return_value = ConditionalResponse(client_data, '"v1"', "")
+        # the first pull stores the ETag
+        assert Client.objects.all().pull() == PullSummary(updated=1)
+        mock_get.assert_called_once_with(client.href, etag="", last_modified="")
+        mock_get.reset_mock()
+        mock_get.return_value = ConditionalResponse(None, '"v1"', "")
+        # which is sent with the next one
+        assert Client.objects.all().pull() == PullSummary(unchanged=1)
+        mock_get.assert_called_once_with(client.href, etag='"v1"', last_modified="")
+        client.refresh_from_db()
+        assert client.status == "approved"
+
+    @mock.patch.object(BaseModel, "save")
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_pull__identical(self, mock_get, mock_save, client, client_data):
+        # the stored raw JSON has been scrubbed, but the API response has not
+        assert client.raw_hash == hash_raw(client.raw)
+        client_data["email"] = "fred@example.com"
+        mock_get.return_value = ConditionalResponse(client_data, '"v1"', "")
+        assert Client.objects.all().pull() == PullSummary(unchanged=1)
+        mock_save.assert_not_called()
+        # but the new ETag is stored, and sent with the next request
+        mock_get.reset_mock()
+        mock_get.return_value = ConditionalResponse(None, '"v1"', "")
+        assert Client.objects.get().pull().unchanged
+        mock_get.assert_called_once_with(client.href, etag='"v1"', last_modified="")
+        mock_save.assert_not_called()
+
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_pull__concurrent_webhook(self, mock_get, record, record_data):
+        """Test fields changed while the objects are fetched are not overwritten."""
+        requested_at = now() - datetime.timedelta(minutes=1)
+        Record.objects.update(pull_requested_at=requested_at)
+
+        def get_conditional(href, etag, last_modified):
+            # a trusted webhook is applied while the record is fetched
+            Record.objects.update(updated_at=now(), pull_requested_at=now())
+            return ConditionalResponse({**record_data, "status": "complete"}, "", "")
+
+        mock_get.side_effect = get_conditional
+        # fetch in this thread, so that the webhook can write to the test database
+        with mock.patch(
+            "amiqus.models.base.ThreadPoolExecutor",
+            return_value=mock.MagicMock(**{"__enter__.return_value.map": map}),
+        ):
+            summary = Record.objects.all().pull(concurrency=1)
+        assert summary == PullSummary(updated=1)
+        record.refresh_from_db()
+        assert record.status == "complete"
+        assert record.updated_at > requested_at
+        assert record.pull_requested_at > requested_at
+
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_pull__identical_concurrent(self, mock_get, client, client_data):
+        mock_get.return_value = ConditionalResponse(client_data, '"v1"', "")
+        summary = Client.objects.all().pull(concurrency=2)
+        assert summary == PullSummary(unchanged=1)
+        assert Client.objects.get().etag == '"v1"'
 
     @mock.patch.object(BaseModel, "pull")
     def test_pull__empty(self, mock_pull):
@@ -160,6 +296,49 @@ class TestBaseQuerySet:
         Client.objects.all().pull()
         assert mock_pull.call_count == 1
 
+    @pytest.fixture
+    def clients(self, user, client_data):
+        return [
+            Client.objects.create_client(user, {**client_data, "id": f"client-{i}"})
+            for i in range(5)
+        ]
+
+    @staticmethod
+    def get_conditional(href, etag, last_modified):
+        amiqus_id = href.split("/")[-1]
+        if amiqus_id == "client-3":
+            raise Exception("Something went wrong")
+        if amiqus_id == "client-4":
+            return ConditionalResponse(None, etag, last_modified)
+        data = {"id": amiqus_id, "status": "approved", "created_at": None}
+        return ConditionalResponse(data, '"v1"', "")
+
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_fetch__concurrent(self, mock_get, clients):
+        mock_get.side_effect = self.get_conditional
+        summary = Client.objects.all().fetch(concurrency=3)
+        assert summary == PullSummary(updated=3, unchanged=1, failed=1)
+        assert not Client.objects.filter(status="approved").exists()
+
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_pull__concurrent(self, mock_get, clients, django_assert_num_queries):
+        mock_get.side_effect = self.get_conditional
+        Client.objects.filter(amiqus_id="client-0").update(pull_requested_at=now())
+        # one select, one update for each of the two chunks that changed, and
+        # one to clear pull_requested_at
+        with django_assert_num_queries(4):
+            summary = Client.objects.order_by("amiqus_id").pull(
+                concurrency=3, chunk_size=2
+            )
+        assert summary == PullSummary(updated=3, unchanged=1, failed=1)
+        assert summary.succeeded == 4
+        assert summary.errors == {"client-3": "Exception: Something went wrong"}
+        assert list(
+            Client.objects.filter(status="approved")
+            .order_by("amiqus_id")
+            .values_list("amiqus_id", "etag", "pull_requested_at")
+        ) == [(f"client-{i}", '"v1"', None) for i in range(3)]
+
 
 class BaseStatusModelTests(TestCase):
     """amiqus.models.BaseStatusModel tests."""
@@ -217,7 +396,8 @@ class BaseStatusModelTests(TestCase):
 
         event, obj = reset()
         event.completed_at = now
-        obj = obj.update_status(event)
+        with self.captureOnCommitCallbacks(execute=True):
+            obj = obj.update_status(event)
         self.assertEqual(obj.status, event.status)
         self.assertEqual(obj.updated_at, now)
         mock_pull.assert_called_once_with()
@@ -234,7 +414,8 @@ class BaseStatusModelTests(TestCase):
         # if we send 'complete' as the status we should fire the second signal
         event, obj = reset()
         event.status = BaseStatusModel.Status.ACCEPTED
-        obj = obj.update_status(event)
+        with self.captureOnCommitCallbacks(execute=True):
+            obj = obj.update_status(event)
         self.assertEqual(obj.status, event.status)
         self.assertEqual(obj.updated_at, now)
         mock_pull.assert_called_once_with()
@@ -251,7 +432,8 @@ class BaseStatusModelTests(TestCase):
         # test that we can handle the API failing on pull()
         event, obj = reset()
         mock_pull.side_effect = Exception("Something went wrong in the API")
-        obj = obj.update_status(event)
+        with self.captureOnCommitCallbacks(execute=True):
+            obj = obj.update_status(event)
         self.assertEqual(obj.status, event.status)
         self.assertEqual(obj.updated_at, now)
         mock_pull.assert_called_once_with()
@@ -265,6 +447,72 @@ class BaseStatusModelTests(TestCase):
         )
         mock_complete.assert_not_called()
 
+    @mock.patch.object(BaseStatusModel, "save")
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_update_status__unchanged(self, mock_get, mock_save):
+        """Test update_status saves the event if the remote object is unchanged."""
+        now = datetime.datetime.now()
+        event = Event(action="record.updated", amiqus_id="foo", completed_at=now)
+        obj = BaseStatusModelInstance(
+            amiqus_id="foo", status="pending", raw={"id": "foo", "status": "pending"}
+        )
+        mock_get.return_value = ConditionalResponse(None, "", "")
+        obj.update_status(event)
+        self.assertTrue(obj.unchanged)
+        self.assertEqual(obj.status, "pending")
+        self.assertEqual(obj.updated_at, now)
+        mock_save.assert_called_once_with()
+
+    @mock.patch.object(BaseStatusModel, "save")
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_update_status__clears_validators(self, mock_get, mock_save):
+        """Test a failed pull means the next fetch is unconditional."""
+        event = Event(action="record.updated", completed_at=datetime.datetime.now())
+        obj = BaseStatusModelInstance(amiqus_id="foo", etag='"v1"', last_modified="x")
+        mock_get.side_effect = Exception("Something went wrong in the API")
+        obj.update_status(event)
+        self.assertEqual(obj.etag, "")
+        self.assertEqual(obj.last_modified, "")
+        mock_save.assert_called_once_with()
+
+    @mock.patch("amiqus.models.event.WEBHOOK_TRUSTED_ALIASES", {"record.finished": ""})
+    @mock.patch("amiqus.signals.on_status_change.send")
+    @mock.patch.object(BaseStatusModel, "pull")
+    @mock.patch.object(BaseStatusModel, "save")
+    def test_update_status__trusted(self, mock_save, mock_pull, mock_update):
+        """Test the status of a trusted event is saved without a pull."""
+        event = Event(action="record.finished", status="accepted", completed_at=now())
+        obj = BaseStatusModelInstance(status="pending", etag='"v1"')
+        with self.captureOnCommitCallbacks(execute=True):
+            obj.update_status(event)
+        mock_pull.assert_not_called()
+        mock_save.assert_called_once_with()
+        self.assertEqual(obj.status, "accepted")
+        self.assertEqual(obj.etag, "")
+        self.assertIsNotNone(obj.pull_requested_at)
+        mock_update.assert_called_once_with(
+            BaseStatusModelInstance,
+            instance=obj,
+            event="record.finished",
+            status_before="pending",
+            status_after="accepted",
+        )
+        # no status to trust
+        event.status = ""
+        obj.update_status(event)
+        mock_pull.assert_called_once_with()
+
+    @mock.patch("amiqus.models.base.WEBHOOK_RECONCILE", False)
+    @mock.patch("amiqus.models.event.WEBHOOK_TRUSTED_ALIASES", {"record.finished": ""})
+    @mock.patch.object(BaseStatusModel, "pull")
+    @mock.patch.object(BaseStatusModel, "save")
+    def test_update_status__trusted_not_reconciled(self, mock_save, mock_pull):
+        event = Event(action="record.finished", status="accepted", completed_at=now())
+        obj = BaseStatusModelInstance(status="pending")
+        obj.update_status(event)
+        mock_pull.assert_not_called()
+        self.assertIsNone(obj.pull_requested_at)
+
     @mock.patch.object(query.QuerySet, "filter")
     def test_events(self, mock_filter):
         """Test the events method."""
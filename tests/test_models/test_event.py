@@ -1,6 +1,9 @@
 import copy
+from datetime import timedelta
+from unittest import mock
 
 import pytest
+from django.utils.timezone import now
 
 from amiqus.models import Client, Event, Record
 
@@ -47,3 +50,60 @@ class TestEventModel:
         # assert event.completed_at == (
         #     date_parse(data["payload"]["object"]["completed_at_iso8601"])
         # )
+
+    def test_parse__status(self):
+        data = copy.deepcopy(TEST_EVENT_RECORD_REVIEWED)
+        data["data"]["record"]["status"] = "accepted"
+        assert Event().parse(data, entity_type="record").status == "accepted"
+
+    @mock.patch(
+        "amiqus.models.event.WEBHOOK_TRUSTED_ALIASES",
+        {"record.reviewed": "accepted", "record.finished": ""},
+    )
+    def test_trusted(self):
+        data = copy.deepcopy(TEST_EVENT_RECORD_REVIEWED)
+        event = Event().parse(data, entity_type="record")
+        assert event.status == "accepted"
+        assert event.trusted
+        # the status in the payload takes precedence
+        data["data"]["record"]["status"] = "refer"
+        assert Event().parse(data, entity_type="record").status == "refer"
+        assert not Event(action="record.finished").trusted
+        assert Event(action="record.finished", status="pending").trusted
+        assert not Event(action="record.updated", status="pending").trusted
+
+    def test_mark_processed(self):
+        event = Event(attempts=1, last_error="foo", next_attempt_at=now())
+        event.mark_processed()
+        assert event.state == Event.EventState.PROCESSED
+        assert event.attempts == 2
+        assert event.last_error == ""
+        assert event.next_attempt_at is None
+        assert event.processed_at is not None
+
+    def test_mark_failed(self):
+        event = Event(state=Event.EventState.PENDING)
+        event.mark_failed(KeyError("data"), retry_in=60)
+        assert event.state == Event.EventState.PENDING
+        assert event.attempts == 1
+        assert event.last_error == "KeyError: 'data'"
+        assert event.next_attempt_at > now() + timedelta(seconds=55)
+        event.mark_failed(ValueError("foo"))
+        assert event.state == Event.EventState.FAILED
+        assert event.attempts == 2
+        assert event.next_attempt_at is None
+
+    def test_pending(self):
+        def create(**kwargs):
+            return Event.objects.create(received_at=now(), **kwargs)
+
+        pending = create(state=Event.EventState.PENDING)
+        retry = create(
+            state=Event.EventState.PENDING, next_attempt_at=now() - timedelta(seconds=1)
+        )
+        create(
+            state=Event.EventState.PENDING, next_attempt_at=now() + timedelta(hours=1)
+        )
+        create(state=Event.EventState.PROCESSED)
+        create(state=Event.EventState.FAILED)
+        assert set(Event.objects.pending()) == {pending, retry}
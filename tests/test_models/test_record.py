@@ -1,9 +1,21 @@
 import copy
+from datetime import timedelta
+from unittest import mock
 
 import pytest
 from dateutil.parser import parse as date_parse
+from asgiref.sync import async_to_sync
 from django.core.exceptions import ValidationError
-from amiqus.models import Record
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from amiqus import metrics
+from amiqus.api import ConditionalResponse
+from amiqus.models import Check, Event, Record
+from amiqus.models.record import SyncSummary, _related_id
+from amiqus.signals import on_status_change
+from amiqus.views import process_event
 from ..conftest import TEST_RECORD, TEST_RECORD_ID, TEST_CHECK_ID, TEST_CHECK_ID_2
 
 
@@ -81,6 +93,43 @@ class TestRecordManager:
         record = Record.objects.create_record(client=client, raw=data)
         assert record.checks.count() == 0
 
+    @pytest.mark.parametrize("can_return_rows", [True, False])
+    def test_create_record__queries(self, user, client, can_return_rows):
+        """Test the record graph is created in a constant number of queries."""
+        features = mock.patch.object(
+            type(connection.features),
+            "can_return_rows_from_bulk_insert",
+            new_callable=mock.PropertyMock,
+            return_value=can_return_rows,
+        )
+        queries = []
+        for steps in (3, 20):
+            data = copy.deepcopy(TEST_RECORD)
+            data["id"] = f"record-{steps}"
+            data["steps"] = [
+                {"id": i, "type": "check.watchlist", "check": f"{steps}-{i}"}
+                if i % 2
+                else {"id": i, "type": "form", "form": f"{steps}-{i}"}
+                for i in range(steps)
+            ]
+            with features, CaptureQueriesContext(connection) as context:
+                record = Record.objects.create_record(client=client, raw=data)
+            queries.append(len(context))
+            assert record.steps.count() == steps
+            assert record.steps.filter(amiqus_check__isnull=False).count() == steps // 2
+            assert not record.steps.filter(
+                amiqus_check__isnull=True, form__isnull=True
+            ).exists()
+        assert queries[0] == queries[1]
+
+    def test_create_record__rolled_back(self, user, client):
+        """Test a record is not left half-created."""
+        data = copy.deepcopy(TEST_RECORD)
+        data["steps"][0]["type"] = "check.unknown"
+        with pytest.raises(ValidationError):
+            Record.objects.create_record(client=client, raw=data)
+        assert not Record.objects.exists()
+
     def test_create_record_with_no_perform_url(self, user, client):
         """Test record creation works when perform_url is not returned from Amiqus."""
         data = copy.deepcopy(TEST_RECORD)
@@ -102,3 +151,219 @@ class TestRecordModel:
         assert record.raw == TEST_RECORD
         assert record.created_at is None
         assert record.status is None
+
+
+@pytest.mark.django_db
+class TestRecordUpdateStatus:
+    """Record.update_status out-of-order event tests."""
+
+    def event(self, completed_at):
+        return Event(action="record.updated", completed_at=completed_at)
+
+    def test_claim_event(self, record):
+        metrics.reset()
+        newer, older = now(), now() - timedelta(minutes=1)
+        assert record.claim_event(self.event(newer))
+        assert Record.objects.get().updated_at == newer
+        assert not record.claim_event(self.event(older))
+        # events with the same timestamp are all applied
+        assert record.claim_event(self.event(newer))
+        assert Record.objects.get().updated_at == newer
+        assert metrics.get("webhooks.stale") == 1
+        assert Record(updated_at=newer).claim_event(self.event(older))
+
+    def test_aclaim_event(self, record):
+        newer, older = now(), now() - timedelta(minutes=1)
+        assert async_to_sync(record.aclaim_event)(self.event(newer))
+        assert not async_to_sync(record.aclaim_event)(self.event(older))
+
+    @mock.patch("amiqus.signals.on_status_change.send")
+    @mock.patch.object(Record, "pull")
+    def test_update_status__stale(
+        self, mock_pull, mock_signal, record, django_capture_on_commit_callbacks
+    ):
+        with django_capture_on_commit_callbacks(execute=True):
+            record.update_status(self.event(now()))
+        mock_pull.assert_called_once_with()
+        mock_signal.assert_called_once()
+        assert not record.stale
+        with django_capture_on_commit_callbacks(execute=True):
+            record.update_status(self.event(now() - timedelta(minutes=1)))
+        mock_pull.assert_called_once_with()
+        mock_signal.assert_called_once()
+        assert record.stale
+
+    def test_aupdate_status__overtaken(self, record, record_data):
+        """Test an event is dropped if a newer one is applied while it is pulled."""
+        older, newer = now() - timedelta(minutes=1), now()
+
+        async def get_conditional(href, etag, last_modified):
+            # a newer event is applied while the record is being pulled
+            await Record.objects.filter(pk=record.pk).aupdate(
+                status="complete", updated_at=newer
+            )
+            return ConditionalResponse({**record_data, "status": "started"}, "", "")
+
+        handler = mock.Mock()
+        on_status_change.connect(handler)
+        try:
+            with mock.patch("amiqus.aio.get_conditional", get_conditional):
+                async_to_sync(record.aupdate_status)(self.event(older))
+        finally:
+            on_status_change.disconnect(handler)
+        assert record.stale
+        handler.assert_not_called()
+        record.refresh_from_db()
+        assert (record.status, record.updated_at) == ("complete", newer)
+
+    @mock.patch("amiqus.views.create_or_update_reviews")
+    @mock.patch.object(Record, "pull")
+    def test_process_events__same_timestamp(
+        self,
+        mock_pull,
+        mock_reviews,
+        record,
+        record_finished_event,
+        record_reviewed_event,
+        django_capture_on_commit_callbacks,
+    ):
+        """Test events sharing a (one second resolution) timestamp are applied."""
+        handler = mock.Mock()
+        on_status_change.connect(handler)
+        try:
+            with django_capture_on_commit_callbacks(execute=True):
+                for data in (record_finished_event, record_reviewed_event):
+                    process_event(Event().parse(data, entity_type="record"))
+        finally:
+            on_status_change.disconnect(handler)
+        assert [c.kwargs["event"] for c in handler.call_args_list] == [
+            "record.finished",
+            "record.reviewed",
+        ]
+        mock_reviews.assert_called_once()
+
+    @mock.patch("amiqus.views.create_or_update_reviews")
+    @mock.patch.object(Record, "pull")
+    def test_process_events__stale_reviewed(
+        self, mock_pull, mock_reviews, record, record_reviewed_event
+    ):
+        """Test a stale record.reviewed event does not fetch reviews."""
+        event = Event().parse(record_reviewed_event, entity_type="record")
+        Record.objects.update(updated_at=event.completed_at + timedelta(seconds=1))
+        with mock.patch("amiqus.views.send_on_commit") as mock_send:
+            assert process_event(event).stale
+        mock_pull.assert_not_called()
+        mock_reviews.assert_not_called()
+        mock_send.assert_not_called()
+
+
+@pytest.mark.django_db
+class TestRecordSync:
+    """Record.sync_steps tests."""
+
+    def test_sync_steps(self, record, django_capture_on_commit_callbacks):
+        data = copy.deepcopy(record.raw)
+        steps = data["steps"]
+        # the first check is accepted, the second is unchanged, the third
+        # step is removed, and a new form step is added
+        steps[0]["check"] = {
+            "id": steps[0]["check"],
+            "status": "accepted",
+            "updated_at": "2023-04-06T15:17:50+00:00",
+        }
+        removed = steps.pop()
+        steps.append({"id": 5, "type": "form", "form": "form-5"})
+        record.raw = data
+        handler = mock.Mock()
+        on_status_change.connect(handler)
+        try:
+            with django_capture_on_commit_callbacks(execute=True):
+                summary = record.sync_steps()
+        finally:
+            on_status_change.disconnect(handler)
+        assert summary == SyncSummary(created=1, updated=1, deleted=1)
+        check = Check.objects.get(amiqus_id=TEST_CHECK_ID)
+        assert check.status == "accepted"
+        assert check.updated_at == date_parse("2023-04-06T15:17:50+00:00")
+        assert not Check.objects.filter(amiqus_id=removed["check"]).exists()
+        assert sorted(record.steps.values_list("amiqus_id", flat=True)) == [
+            "2",
+            "3",
+            "5",
+        ]
+        assert record.steps.get(amiqus_id="5").form.amiqus_id == "form-5"
+        handler.assert_called_once()
+        assert handler.call_args.kwargs == {
+            "signal": on_status_change,
+            "sender": Check,
+            "instance": check,
+            "event": "record.synced",
+            "status_before": None,
+            "status_after": "accepted",
+        }
+
+    def test_sync_steps__new_check(self, record, django_capture_on_commit_callbacks):
+        """Test a new check step is created with its status / updated_at."""
+        record.raw["steps"].append(
+            {
+                "id": 6,
+                "type": "check.watchlist",
+                "check": {
+                    "id": 6543210,
+                    "status": "accepted",
+                    "updated_at": "2023-04-06T15:17:50+00:00",
+                },
+            }
+        )
+        handler = mock.Mock()
+        on_status_change.connect(handler)
+        try:
+            with django_capture_on_commit_callbacks(execute=True):
+                summary = record.sync_steps()
+        finally:
+            on_status_change.disconnect(handler)
+        assert summary == SyncSummary(created=1)
+        check = Check.objects.get(amiqus_id="6543210")
+        assert check.status == "accepted"
+        assert check.updated_at == date_parse("2023-04-06T15:17:50+00:00")
+        assert record.steps.get(amiqus_id="6").amiqus_check == check
+        handler.assert_called_once()
+        assert handler.call_args.kwargs["status_before"] is None
+        assert handler.call_args.kwargs["status_after"] == "accepted"
+
+    def test_sync_steps__legacy(self, record):
+        """Test steps without an amiqus_id are matched by their check."""
+        record.steps.update(amiqus_id=None)
+        checks = dict(Check.objects.values_list("amiqus_id", "pk"))
+        steps = record.raw["steps"]
+        steps[0]["check"] = {"id": steps[0]["check"], "status": "accepted"}
+        removed = steps.pop()
+        assert record.sync_steps() == SyncSummary(updated=1, deleted=1)
+        assert dict(
+            record.steps.values_list("amiqus_id", "amiqus_check__amiqus_id")
+        ) == {str(step["id"]): str(_related_id(step)) for step in steps}
+        # the remaining checks have been kept
+        del checks[str(removed["check"])]
+        assert dict(Check.objects.values_list("amiqus_id", "pk")) == checks
+        assert Check.objects.get(amiqus_id=TEST_CHECK_ID).status == "accepted"
+
+    def test_sync_steps__replaced(self, record):
+        """Test a check is kept if its step is replaced by a new one."""
+        check = Check.objects.get(amiqus_id=TEST_CHECK_ID)
+        step = next(s for s in record.raw["steps"] if s["check"] == TEST_CHECK_ID)
+        step["id"] = 99
+        step["status"] = "accepted"
+        assert record.sync_steps() == SyncSummary(created=1, updated=1, deleted=1)
+        check.refresh_from_db()
+        assert check.status == "accepted"
+        assert record.steps.get(amiqus_id="99").amiqus_check == check
+
+    def test_sync_steps__unchanged(self, record, django_assert_num_queries):
+        # savepoint, select the steps, release savepoint
+        with django_assert_num_queries(3):
+            assert record.sync_steps() == SyncSummary()
+
+    @mock.patch.object(Record, "pull")
+    def test_sync(self, mock_pull, record):
+        assert record.sync() == SyncSummary()
+        mock_pull.assert_called_once_with()
@@ -0,0 +1,75 @@
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+
+from amiqus import metrics
+from amiqus.ratelimit import RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    metrics.reset()
+    cache.clear()
+
+
+class TestRateLimiter:
+    """amiqus.ratelimit.RateLimiter tests."""
+
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            RateLimiter(0)
+
+    @pytest.mark.parametrize("cache_alias", [None, "default"])
+    @mock.patch("amiqus.ratelimit.time.time")
+    def test_reserve(self, mock_time, cache_alias):
+        mock_time.return_value = 1000.0
+        limiter = RateLimiter(2, burst=2, cache_alias=cache_alias)
+        # the bucket starts full, so we can burst
+        assert limiter.reserve() == 0
+        assert limiter.reserve() == 0
+        # then each request reserves the next token
+        assert limiter.reserve() == 0.5
+        assert limiter.reserve() == 1.0
+        # and the bucket refills over time
+        mock_time.return_value = 1002.0
+        assert limiter.reserve() == 0
+        # but never beyond the burst size
+        mock_time.return_value = 1100.0
+        assert limiter.reserve() == 0
+        assert limiter.reserve() == 0
+        assert limiter.reserve() == 0.5
+
+    @mock.patch("amiqus.ratelimit.time.time", return_value=1000.0)
+    def test_reserve__shared(self, mock_time):
+        """Test that limiters using the same cache share a bucket."""
+        limiter1 = RateLimiter(1, burst=1, cache_alias="default")
+        limiter2 = RateLimiter(1, burst=1, cache_alias="default")
+        assert limiter1.reserve() == 0
+        assert limiter2.reserve() == 1
+
+    @mock.patch("amiqus.ratelimit.time.sleep")
+    @mock.patch("amiqus.ratelimit.time.time", return_value=1000.0)
+    def test_acquire(self, mock_time, mock_sleep):
+        limiter = RateLimiter(4, burst=1)
+        assert limiter.acquire() == 0
+        mock_sleep.assert_not_called()
+        assert limiter.acquire() == 0.25
+        mock_sleep.assert_called_once_with(0.25)
+        assert metrics.snapshot() == {
+            "ratelimit.requests": 2,
+            "ratelimit.waits": 1,
+            "ratelimit.wait_seconds": 0.25,
+        }
+
+
+@mock.patch("amiqus.api.get_session")
+def test_api_requests_are_limited(mock_session):
+    from amiqus.api import get
+
+    mock_session.return_value.request.return_value.status_code = 200
+    mock_session.return_value.request.return_value.content = b"{}"
+    limiter = mock.Mock(spec=RateLimiter)
+    with mock.patch("amiqus.api.RATE_LIMITER", limiter):
+        get("/")
+    limiter.acquire.assert_called_once_with()
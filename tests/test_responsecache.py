@@ -0,0 +1,125 @@
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+
+from amiqus import metrics
+from amiqus.api import ConditionalResponse, get, get_conditional, patch, post
+from amiqus.responsecache import ResponseCache, resource_type
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    metrics.reset()
+    cache.clear()
+
+
+@pytest.fixture
+def response_cache():
+    backend = ResponseCache({"records": 10, "reviews": 60})
+    with mock.patch("amiqus.api.RESPONSE_CACHE_BACKEND", backend):
+        yield backend
+
+
+@pytest.fixture
+def mock_request():
+    with mock.patch("amiqus.api.get_session") as mock_session:
+        mock_request = mock_session.return_value.request
+        response = mock_request.return_value
+        response.status_code = 200
+        response.content = b'{"id": 1}'
+        response.headers = {"ETag": '"v1"'}
+        yield mock_request
+
+
+@pytest.mark.parametrize(
+    "href,expected",
+    [
+        ("records", "records"),
+        ("records/1", "records"),
+        ("/records/1/", "records"),
+        ("records/1/steps/2/reviews", "reviews"),
+        ("records/1/steps/2", "steps"),
+    ],
+)
+def test_resource_type(href, expected):
+    assert resource_type(href) == expected
+
+
+class TestResponseCache:
+    """amiqus.responsecache.ResponseCache tests."""
+
+    def test_ttl(self, response_cache):
+        assert response_cache.ttl("records/1") == 10
+        assert response_cache.ttl("records/1/steps/2/reviews") == 60
+        assert response_cache.ttl("clients/1") == 0
+
+    def test_get_set(self, response_cache):
+        assert response_cache.get("records/1") is None
+        response_cache.set("records/1", {"id": 1})
+        assert response_cache.get("records/1") == {"id": 1}
+        response_cache.invalidate("records/1")
+        assert response_cache.get("records/1") is None
+        assert metrics.snapshot() == {
+            "responsecache.hits": 1,
+            "responsecache.misses": 2,
+        }
+
+    def test_uncached_resource(self, response_cache):
+        response_cache.set("clients/1", {"id": 1})
+        assert response_cache.get("clients/1") is None
+        assert metrics.snapshot() == {}
+
+
+class TestApiResponseCache:
+    """Test amiqus.api GET responses are cached."""
+
+    def test_get(self, response_cache, mock_request):
+        assert get("records/1") == {"id": 1}
+        assert get("records/1") == {"id": 1}
+        mock_request.assert_called_once()
+        # uncached resource types are always fetched
+        get("clients/1")
+        get("clients/1")
+        assert mock_request.call_count == 3
+
+    def test_get_conditional(self, response_cache, mock_request):
+        expected = ConditionalResponse({"id": 1}, '"v1"', "")
+        assert get_conditional("records/1") == expected
+        assert get_conditional("records/1") == expected
+        # a cached response with a matching ETag is not modified
+        assert get_conditional("records/1", etag='"v1"') == ConditionalResponse(
+            None, '"v1"', ""
+        )
+        mock_request.assert_called_once()
+
+    def test_get_conditional__not_modified(self, response_cache, mock_request):
+        """Test that 304 responses are not cached."""
+        mock_request.return_value.status_code = 304
+        get_conditional("records/1", etag='"v1"')
+        assert response_cache.get("records/1") is None
+
+    def test_get_disabled(self, mock_request):
+        get("records/1")
+        get("records/1")
+        assert mock_request.call_count == 2
+
+    @pytest.mark.parametrize("func", [post, patch])
+    def test_invalidate(self, response_cache, mock_request, func):
+        get("records/1")
+        func("records/1", data={})
+        get("records/1")
+        assert mock_request.call_count == 3
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_update_status_invalidates(
+        self, mock_get, response_cache, record, record_data, record_finished_event
+    ):
+        from amiqus.models import Event
+
+        response_cache.set(record.href, (record_data, "", ""))
+        mock_get.return_value = ConditionalResponse(record_data, "", "")
+        event = Event().parse(record_finished_event, entity_type="record")
+        record.update_status(event)
+        assert response_cache.get(record.href) is None
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import CacheKeyWarning, cache
+
+from amiqus import metrics
+from amiqus.api import get
+from amiqus.singleflight import SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    metrics.reset()
+    cache.clear()
+
+
+def run_concurrently(count, func, started):
+    """Run func in count threads, once the first call has started."""
+    with ThreadPoolExecutor(count) as executor:
+        leader = executor.submit(func)
+        started.wait(1)
+        followers = [executor.submit(func) for _ in range(count - 1)]
+        return [f.result() for f in [leader, *followers]]
+
+
+class TestSingleFlight:
+    """amiqus.singleflight.SingleFlight tests."""
+
+    def test_do(self):
+        group = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return {"id": 1}
+
+        def do():
+            return group.do("key", call)
+
+        # release the leader once the followers are waiting
+        threading.Timer(0.1, release.set).start()
+        results = run_concurrently(4, do, started)
+        assert len(calls) == 1
+        assert results == [{"id": 1}] * 4
+        # followers get their own copy of the result
+        assert len({id(r) for r in results}) == 4
+        assert metrics.get("singleflight.shared") == 3
+
+    def test_do__sequential(self):
+        group = SingleFlight()
+        func = mock.Mock(return_value=1)
+        assert group.do("key", func) == 1
+        assert group.do("key", func) == 1
+        assert func.call_count == 2
+
+    def test_do__exception(self):
+        group = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def call():
+            started.set()
+            release.wait(1)
+            raise ValueError("boom")
+
+        def do():
+            try:
+                group.do("key", call)
+            except ValueError as ex:
+                return str(ex)
+
+        threading.Timer(0.1, release.set).start()
+        assert run_concurrently(2, do, started) == ["boom", "boom"]
+
+    def test_do__shared_cache(self):
+        """Test calls are coalesced across instances sharing a cache."""
+        leader_group = SingleFlight(cache_alias="default")
+        follower_group = SingleFlight(cache_alias="default")
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return {"id": 1}
+
+        with ThreadPoolExecutor(2) as executor:
+            leader = executor.submit(leader_group.do, "key", call)
+            started.wait(1)
+            follower = executor.submit(follower_group.do, "key", call)
+            threading.Timer(0.1, release.set).start()
+            assert leader.result() == follower.result() == {"id": 1}
+        assert len(calls) == 1
+
+    def test_do__shared_cache_leader_failed(self):
+        """Test followers make the call if the leader in another process fails."""
+        group = SingleFlight(cache_alias="default")
+        cache.add(group.lock_key("key"), "token")
+        threading.Timer(0.05, cache.delete, [group.lock_key("key")]).start()
+        assert group.do("key", lambda: 2) == 2
+
+    def test_lock_key(self):
+        """Test the lock key is safe for all cache backends (e.g. memcached)."""
+        key = 'records/1:"v1":Wed, 21 Oct 2015 07:28:00 GMT'
+        lock_key = SingleFlight.lock_key(key)
+        assert lock_key.startswith("amiqus:singleflight:")
+        assert " " not in lock_key and len(lock_key) < 250
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            assert SingleFlight(cache_alias="default").do(key, lambda: 1) == 1
+
+    def test_ado(self):
+        group = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"id": 1}
+
+        async def main():
+            return await asyncio.gather(*[group.ado("key", call) for _ in range(3)])
+
+        assert async_to_sync(main)() == [{"id": 1}] * 3
+        assert len(calls) == 1
+
+
+@mock.patch("amiqus.api.get_session")
+def test_api_get_is_coalesced(mock_session):
+    started, release = threading.Event(), threading.Event()
+
+    def request(*args, **kwargs):
+        started.set()
+        release.wait(1)
+        return mock.Mock(status_code=200, headers={}, content=b'{"id": 1}')
+
+    mock_session.return_value.request.side_effect = request
+    threading.Timer(0.1, release.set).start()
+    with mock.patch("amiqus.api.SINGLE_FLIGHT_GROUP", SingleFlight()):
+        results = run_concurrently(3, lambda: get("records/1"), started)
+    assert results == [{"id": 1}] * 3
+    assert mock_session.return_value.request.call_count == 1
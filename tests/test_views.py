@@ -1,11 +1,15 @@
 import json
+from base64 import b64encode
 from unittest import mock
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.test import RequestFactory
 
-from amiqus.models import Check, Event, Record
-from amiqus.views import status_update
+from amiqus.api import ConditionalResponse
+from amiqus.models import Check, Client, Event, Record, Review
+from amiqus.signals import on_status_change, record_reviewed
+from amiqus.views import async_status_update, status_update
 
 
 class TestStatusUpdateView:
@@ -35,7 +39,7 @@ class TestStatusUpdateView:
         self, rf: RequestFactory, record_finished_event: dict
     ) -> None:
         with mock.patch.object(Record, "objects") as mock_manager:
-            mock_manager.get.side_effect = Record.DoesNotExist()
+            mock_manager.select_for_update().get.side_effect = Record.DoesNotExist()
             self.assert_update(rf, record_finished_event, "Record not found.")
 
     @pytest.mark.django_db
@@ -50,3 +54,161 @@ class TestStatusUpdateView:
         with mock.patch.object(Event, "parse") as mock_parse:
             mock_parse.side_effect = Exception("foobar")
             self.assert_update(rf, client_status_event, "Unknown error.")
+
+    @pytest.mark.django_db
+    @mock.patch.object(Record, "pull")
+    def test_update__signals_on_commit(
+        self,
+        mock_pull,
+        rf,
+        record,
+        record_finished_event,
+        django_capture_on_commit_callbacks,
+    ):
+        """Test signals are only sent once the update has been committed."""
+        handler = mock.Mock()
+        on_status_change.connect(handler)
+        try:
+            with django_capture_on_commit_callbacks() as callbacks:
+                self.assert_update(rf, record_finished_event, "Update processed.")
+            handler.assert_not_called()
+            assert Event.objects.get().action == "record.finished"
+            for callback in callbacks:
+                callback()
+        finally:
+            on_status_change.disconnect(handler)
+        assert handler.call_args.kwargs["instance"] == record
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.views.LOG_EVENTS", True)
+    @mock.patch.object(Record, "pull")
+    def test_update__rolled_back(
+        self,
+        mock_pull,
+        rf,
+        record,
+        record_finished_event,
+        django_capture_on_commit_callbacks,
+    ):
+        """Test a failed update is rolled back, and no signals are sent."""
+        with (
+            mock.patch.object(Event, "save", side_effect=Exception("foobar")),
+            django_capture_on_commit_callbacks() as callbacks,
+        ):
+            self.assert_update(rf, record_finished_event, "Unknown error.")
+        assert callbacks == []
+        record.refresh_from_db()
+        assert record.updated_at is None
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.models.base.get_conditional")
+    def test_update__api_down(
+        self,
+        mock_get,
+        rf,
+        client,
+        client_status_event,
+        django_capture_on_commit_callbacks,
+    ):
+        """Test the client status is still saved if the client cannot be pulled."""
+        client.etag = '"v1"'
+        client.save()
+        client_status_event["data"]["client"]["status"] = "approved"
+        mock_get.side_effect = Exception("API down")
+        with django_capture_on_commit_callbacks(execute=True):
+            self.assert_update(rf, client_status_event, "Update processed.")
+        client.refresh_from_db()
+        assert client.status == Client.ClientStatus.APPROVED
+        assert client.etag == ""
+        assert client.pull_requested_at is not None
+
+
+class TestAsyncStatusUpdateView:
+    """amiqus.views.async_status_update tests."""
+
+    def post(self, rf, data):
+        request = rf.post("/", data=json.dumps(data), content_type="application/json")
+        response = async_to_sync(async_status_update)(request)
+        assert response.status_code == 200, response.status_code
+        return response.content.decode("utf-8")
+
+    def test_empty_content(self, rf: RequestFactory):
+        assert self.post(rf, {}) == "Empty webhook."
+
+    @pytest.mark.django_db
+    def test_unknown_record(self, rf: RequestFactory, record_finished_event: dict):
+        assert self.post(rf, record_finished_event) == "Record not found."
+        assert not Event.objects.exists()
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_update(self, mock_get, rf, record, record_data, record_finished_event):
+        record_data["status"] = "complete"
+        mock_get.return_value = ConditionalResponse(record_data, '"v1"', "")
+        handler = mock.Mock()
+        on_status_change.connect(handler)
+        try:
+            assert self.post(rf, record_finished_event) == "Update processed."
+        finally:
+            on_status_change.disconnect(handler)
+        record.refresh_from_db()
+        assert record.status == "complete"
+        assert record.etag == '"v1"'
+        assert handler.call_args.kwargs["instance"] == record
+        assert Event.objects.get().action == "record.finished"
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_update__api_down(self, mock_get, rf, client, client_status_event):
+        """Test the client status is still saved if the client cannot be pulled."""
+        client_status_event["data"]["client"]["status"] = "approved"
+        mock_get.side_effect = Exception("API down")
+        assert self.post(rf, client_status_event) == "Update processed."
+        client.refresh_from_db()
+        assert client.status == Client.ClientStatus.APPROVED
+        assert client.pull_requested_at is not None
+        assert Event.objects.get().action == "client.status"
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.aio.get")
+    @mock.patch("amiqus.aio.get_conditional")
+    def test_update__reviewed(
+        self, mock_get, mock_get_reviews, rf, record, record_data, record_reviewed_event
+    ):
+        mock_get.return_value = ConditionalResponse(record_data, "", "")
+        mock_get_reviews.side_effect = lambda href: {
+            "data": [
+                {
+                    "id": f"review-{href.split('/')[-2]}",
+                    "status": "approved",
+                    "created_at": "2023-04-06T15:17:50+00:00",
+                }
+            ]
+        }
+        handler = mock.Mock()
+        record_reviewed.connect(handler)
+        try:
+            assert self.post(rf, record_reviewed_event) == "Update processed."
+        finally:
+            record_reviewed.disconnect(handler)
+        assert Review.objects.count() == record.steps.count()
+        assert handler.call_args.kwargs["data"] == record_reviewed_event
+
+    @pytest.mark.django_db
+    @mock.patch("amiqus.views.DEFER_WEBHOOKS", True)
+    def test_deferred(self, rf: RequestFactory, record_finished_event: dict):
+        assert self.post(rf, record_finished_event) == "Update queued."
+        assert Event.objects.get().state == Event.EventState.PENDING
+
+    @mock.patch("amiqus.decorators.TEST_MODE", False)
+    @mock.patch("amiqus.decorators.WEBHOOK_SECURITY_TOKEN", b"token")
+    def test_verify_signature(self, rf: RequestFactory, record_finished_event: dict):
+        body = json.dumps(record_finished_event)
+        request = rf.post(
+            "/",
+            data=body,
+            content_type="application/json",
+            headers={"X-AQID-Signature": b64encode(b"invalid").decode()},
+        )
+        response = async_to_sync(async_status_update)(request)
+        assert response.status_code == 403
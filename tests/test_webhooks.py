@@ -5,6 +5,8 @@ from unittest import mock
 from django.utils.timezone import now
 
 import pytest
+from django.core.exceptions import ValidationError
+from django.db import connection
 
 from amiqus.models import Review, Record, Event
 from amiqus.views import status_update
@@ -19,7 +21,13 @@ class TestRecordReviewedWebhook:
     @mock.patch("amiqus.models.Record.update_status")
     @mock.patch("amiqus.models.Event.parse")
     def test_record_reviewed_signal(
-        self, mock_parse, mock_update, rf, record_reviewed_event, record
+        self,
+        mock_parse,
+        mock_update,
+        rf,
+        record_reviewed_event,
+        record,
+        django_capture_on_commit_callbacks,
     ):
         """Test that record.reviewed events trigger the signal."""
         # Mock the event parse to return an event with our record
@@ -28,10 +36,11 @@ class TestRecordReviewedWebhook:
             resource_type="record",
             action="record.reviewed",
             received_at=now(),
+            raw=record_reviewed_event,
         )
         # Mock the _resource_manager to return a manager that will return our record
         mock_manager = mock.Mock()
-        mock_manager.get.return_value = record
+        mock_manager.select_for_update().get.return_value = record
         mock_event._resource_manager = mock.Mock(return_value=mock_manager)
         mock_parse.return_value = mock_event
 
@@ -45,7 +54,8 @@ class TestRecordReviewedWebhook:
                 data=json.dumps(record_reviewed_event),
                 content_type="application/json",
             )
-            response = status_update(request)
+            with django_capture_on_commit_callbacks(execute=True):
+                response = status_update(request)
 
             assert response.status_code == 200
             assert response.content.decode("utf-8") == "Update processed."
@@ -105,3 +115,81 @@ class TestRecordReviewedWebhook:
             review = Review.objects.get(amiqus_id=f"review-{step.amiqus_id}")
             assert review.step == step
             assert review.status == "approved"
+
+    @mock.patch("amiqus.helpers.get")
+    def test_update_reviews(self, mock_get, record, django_assert_num_queries):
+        """Test reviews are upserted in a fixed number of queries."""
+        steps = list(record.steps.all())
+        changed, unchanged = (f"review-{step.amiqus_id}" for step in steps[:2])
+        Review(step=steps[0], amiqus_id=changed, status="pending").save()
+        Review(step=steps[1], amiqus_id=unchanged, status="approved").save()
+        mock_get.side_effect = lambda href: {
+            "data": [
+                {
+                    "id": f"review-{href.split('/')[-2]}",
+                    "status": "approved",
+                    "created_at": "2023-04-06T15:17:50+00:00",
+                }
+            ]
+        }
+        event = Event(raw={"data": {"record": {"id": record.amiqus_id}}})
+        # select steps, select existing reviews, upsert changed reviews
+        with django_assert_num_queries(3):
+            create_or_update_reviews(event, record=record)
+        assert mock_get.call_count == len(steps)
+        assert dict(Review.objects.values_list("amiqus_id", "status")) == {
+            f"review-{step.amiqus_id}": "approved" for step in steps
+        }
+        assert Review.objects.get(amiqus_id=changed).raw["status"] == "approved"
+        assert Review.objects.get(amiqus_id=unchanged).raw is None
+
+    @mock.patch("amiqus.helpers.REVIEW_FETCH_CONCURRENCY", 1)
+    @mock.patch("amiqus.helpers.get")
+    def test_create_reviews__sequential(self, mock_get, record):
+        mock_get.return_value = {"data": []}
+        event = Event(raw={"data": {"record": {"id": record.amiqus_id}}})
+        create_or_update_reviews(event)
+        assert mock_get.call_count == record.steps.count()
+        assert not Review.objects.exists()
+
+    @mock.patch("amiqus.helpers.get")
+    def test_update_reviews__no_upsert(
+        self, mock_get, record, django_assert_num_queries
+    ):
+        """Test reviews are inserted / updated separately if upserts are not supported."""
+        steps = list(record.steps.all())
+        changed = f"review-{steps[0].amiqus_id}"
+        Review(step=steps[0], amiqus_id=changed, status="pending").save()
+        mock_get.side_effect = lambda href: {
+            "data": [
+                {
+                    "id": f"review-{href.split('/')[-2]}",
+                    "status": "approved",
+                    "created_at": "2023-04-06T15:17:50+00:00",
+                }
+            ]
+        }
+        event = Event(raw={"data": {"record": {"id": record.amiqus_id}}})
+        with mock.patch.object(
+            type(connection.features),
+            "supports_update_conflicts_with_target",
+            new_callable=mock.PropertyMock,
+            return_value=False,
+        ):
+            # select steps, select existing reviews, insert new, update changed
+            with django_assert_num_queries(4):
+                create_or_update_reviews(event, record=record)
+        assert dict(Review.objects.values_list("amiqus_id", "status")) == {
+            f"review-{step.amiqus_id}": "approved" for step in steps
+        }
+        assert Review.objects.get(amiqus_id=changed).raw["status"] == "approved"
+
+    @mock.patch("amiqus.helpers.get")
+    def test_update_reviews__invalid(self, mock_get, record):
+        mock_get.return_value = {
+            "data": [{"id": "review-1", "status": "foo", "created_at": None}]
+        }
+        event = Event(raw={"data": {"record": {"id": record.amiqus_id}}})
+        with pytest.raises(ValidationError):
+            create_or_update_reviews(event, record=record)
+        assert not Review.objects.exists()
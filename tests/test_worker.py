@@ -0,0 +1,248 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.utils.timezone import now
+
+from amiqus import metrics
+from amiqus.api import ApiError, ConditionalResponse
+from amiqus.models import Event, Record
+from amiqus.views import status_update
+from amiqus.signals import on_status_change
+from amiqus.worker import (
+    _claim_events,
+    handle_event,
+    process_pending_events,
+    pull_requested,
+    run,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+@pytest.fixture
+def pending_event(record, record_finished_event):
+    event = Event(state=Event.EventState.PENDING, received_at=now())
+    event.parse(record_finished_event, entity_type="record").save()
+    return event
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.views.DEFER_WEBHOOKS", True)
+@mock.patch("amiqus.views.process_event")
+def test_status_update__deferred(mock_process, rf, record_finished_event):
+    request = rf.post(
+        "/", data=json.dumps(record_finished_event), content_type="application/json"
+    )
+    assert status_update(request).content == b"Update queued."
+    mock_process.assert_not_called()
+    event = Event.objects.get()
+    assert event.state == Event.EventState.PENDING
+    assert event.action == "record.finished"
+    assert event.raw == record_finished_event
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.worker.process_events")
+class TestHandleEvent:
+    def test_processed(self, mock_process, pending_event):
+        assert handle_event(pending_event)
+        mock_process.assert_called_once_with([pending_event])
+        pending_event.refresh_from_db()
+        assert pending_event.state == Event.EventState.PROCESSED
+        assert pending_event.attempts == 1
+        assert metrics.get("webhooks.processed") == 1
+
+    @mock.patch("amiqus.worker.LOG_EVENTS", False)
+    def test_processed__not_logged(self, mock_process, pending_event):
+        assert handle_event(pending_event)
+        assert not Event.objects.exists()
+
+    def test_retried(self, mock_process, pending_event):
+        response = mock.Mock(status_code=503, content=b'{"error": "unavailable"}')
+        mock_process.side_effect = ApiError(response)
+        assert not handle_event(pending_event)
+        pending_event.refresh_from_db()
+        assert pending_event.state == Event.EventState.PENDING
+        assert pending_event.attempts == 1
+        assert pending_event.last_error == "ApiError: unavailable"
+        assert pending_event.next_attempt_at > now()
+        assert metrics.get("webhooks.retried") == 1
+
+    @mock.patch("amiqus.worker.WEBHOOK_MAX_ATTEMPTS", 2)
+    def test_retries_exhausted(self, mock_process, pending_event):
+        mock_process.side_effect = ConnectionError()
+        pending_event.attempts = 1
+        assert not handle_event(pending_event)
+        assert pending_event.state == Event.EventState.FAILED
+        assert metrics.get("webhooks.failed") == 1
+
+    def test_failed(self, mock_process, pending_event):
+        mock_process.side_effect = Record.DoesNotExist()
+        assert not handle_event(pending_event)
+        pending_event.refresh_from_db()
+        assert pending_event.state == Event.EventState.FAILED
+        assert pending_event.next_attempt_at is None
+        assert pending_event.last_error.startswith("DoesNotExist")
+
+
+@pytest.mark.django_db
+@mock.patch.object(Record, "update_status")
+def test_process_pending_events(mock_update, pending_event):
+    assert process_pending_events() == 1
+    mock_update.assert_called_once()
+    assert process_pending_events() == 0
+    assert Event.objects.get().state == Event.EventState.PROCESSED
+
+
+@pytest.mark.django_db
+def test_claim_events(pending_event):
+    assert _claim_events(50) == [pending_event]
+    pending_event.refresh_from_db()
+    assert pending_event.state == Event.EventState.PROCESSING
+    # the claim is not claimed again until it expires
+    assert _claim_events(50) == []
+    Event.objects.update(next_attempt_at=now())
+    assert _claim_events(50) == [pending_event]
+
+
+@pytest.mark.django_db(transaction=True)
+@mock.patch.object(Record, "pull")
+def test_process_pending_events__commits_each_event(
+    mock_pull, record, record_finished_event
+):
+    """Test each event is committed, and its signals sent, before the next."""
+    for _ in range(2):
+        event = Event(state=Event.EventState.PENDING, received_at=now())
+        event.parse(record_finished_event, entity_type="record").save()
+    handler = mock.Mock()
+    sent = []
+    mock_pull.side_effect = lambda: sent.append(handler.call_count)
+    on_status_change.connect(handler)
+    try:
+        assert process_pending_events() == 2
+    finally:
+        on_status_change.disconnect(handler)
+    assert sent == [0, 1]
+    assert handler.call_count == 2
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.worker.time.sleep")
+@mock.patch("amiqus.worker.process_pending_events")
+def test_run(mock_process, mock_sleep):
+    mock_process.side_effect = [2, 1, 0, 0, KeyboardInterrupt()]
+    assert run(once=True) == 3
+    mock_sleep.assert_not_called()
+    with pytest.raises(KeyboardInterrupt):
+        run(poll_interval=5)
+    mock_sleep.assert_called_once_with(5)
+
+
+@pytest.mark.django_db
+@mock.patch.object(Record, "update_status")
+def test_amiqus_process_events(mock_update, pending_event):
+    out = StringIO()
+    call_command("amiqus_process_events", "--once", stdout=out)
+    assert out.getvalue() == "Processed 1 Amiqus events.\n"
+    mock_update.assert_called_once()
+
+
+@pytest.fixture
+def burst(pending_event, record_finished_event):
+    """Return a burst of pending events for the same record."""
+    events = [pending_event]
+    for seconds in (1, 2):
+        event = Event(state=Event.EventState.PENDING, received_at=now())
+        event.parse(record_finished_event, entity_type="record")
+        event.completed_at += timedelta(seconds=seconds)
+        event.save()
+        events.append(event)
+    return events
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.worker.WEBHOOK_COALESCE_WINDOW", 10)
+@mock.patch.object(Record, "update_status")
+class TestCoalescing:
+    def test_held_in_window(self, mock_update, burst):
+        assert process_pending_events() == 0
+        mock_update.assert_not_called()
+
+    def test_coalesced(self, mock_update, burst):
+        # only the first event has been held for the window
+        Event.objects.filter(pk=burst[0].pk).update(
+            received_at=now() - timedelta(seconds=10)
+        )
+        assert process_pending_events() == 3
+        # the record is updated once, to the status of the latest event
+        mock_update.assert_called_once_with(burst[-1])
+        assert all(
+            e.state == Event.EventState.PROCESSED and e.attempts == 1
+            for e in Event.objects.all()
+        )
+        assert metrics.get("webhooks.processed") == 3
+        assert metrics.get("webhooks.coalesced") == 2
+
+    def test_failed(self, mock_update, burst):
+        mock_update.side_effect = ConnectionError()
+        Event.objects.update(received_at=now() - timedelta(seconds=10))
+        assert process_pending_events() == 3
+        assert set(Event.objects.values_list("state", "attempts")) == {
+            (Event.EventState.PENDING, 1)
+        }
+        assert metrics.get("webhooks.retried") == 3
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.models.base.get_conditional")
+def test_pull_requested(mock_get, record, record_data):
+    mock_get.return_value = ConditionalResponse(record_data, '"v2"', "")
+    Record.objects.update(pull_requested_at=now())
+    assert pull_requested() == 1
+    mock_get.assert_called_once_with(record.href, etag="", last_modified="")
+    record.refresh_from_db()
+    assert record.pull_requested_at is None
+    assert record.etag == '"v2"'
+    assert pull_requested() == 0
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.models.base.get_conditional")
+def test_pull_requested__failed(mock_get, record):
+    """Test objects that cannot be pulled are claimed again once the claim expires."""
+    mock_get.side_effect = Exception("Not found")
+    Record.objects.update(pull_requested_at=now())
+    assert pull_requested() == 0
+    record.refresh_from_db()
+    assert record.pull_requested_at > now()
+    # it is not claimed again until then - so it does not hold up the others
+    assert pull_requested() == 0
+    assert mock_get.call_count == 1
+    Record.objects.update(pull_requested_at=now())
+    pull_requested()
+    assert mock_get.call_count == 2
+
+
+@pytest.mark.django_db
+@mock.patch("amiqus.models.base.get_conditional")
+def test_process_pending_events__api_down(mock_get, pending_event, record, record_data):
+    """Test an event succeeds if the record cannot be pulled - and it is pulled later."""
+    mock_get.side_effect = Exception("API down")
+    assert process_pending_events() == 1
+    assert Event.objects.get().state == Event.EventState.PROCESSED
+    record.refresh_from_db()
+    assert record.status == pending_event.status
+    assert record.pull_requested_at is not None
+    mock_get.side_effect = None
+    mock_get.return_value = ConditionalResponse(record_data, '"v2"', "")
+    Record.objects.update(pull_requested_at=now())
+    assert pull_requested() == 1
+    record.refresh_from_db()
+    assert record.etag == '"v2"'